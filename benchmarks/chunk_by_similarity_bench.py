@@ -0,0 +1,55 @@
+"""
+Scaling benchmark for ``NeibourSimilarityChunker.chunk_by_similarity``.
+
+Embeddings are synthetic (a drifting random walk), so only the clustering
+itself is timed. Run from the repository root:
+
+    python benchmarks/chunk_by_similarity_bench.py --sizes 1000 10000 100000
+"""
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src")))
+
+import argparse
+import math
+import time
+
+import numpy as np
+
+from retrieval.chunking_strategies.neighbour_sim import NeibourSimilarityChunker
+
+
+def synthetic_embeddings(n: int, dim: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    steps = rng.normal(size=(n, dim))
+    steps[rng.random(n) < 0.1] *= 8
+    return np.cumsum(steps, axis=0).astype(np.float32)
+
+
+def run(sizes, dim, threshold):
+    chunker = NeibourSimilarityChunker(embedding_model_name="unused")
+    previous = None
+    print(f"{'n':>10} {'clusters':>10} {'seconds':>10} {'exponent':>10}")
+    for n in sizes:
+        chunks = [str(i) for i in range(n)]
+        embeddings = synthetic_embeddings(n, dim)
+        start = time.perf_counter()
+        _, clusters = chunker.chunk_by_similarity(
+            chunks, similarity_threshold=threshold, embeddings=embeddings
+        )
+        elapsed = time.perf_counter() - start
+        # Empirical growth exponent relative to the previous size.
+        exponent = (
+            math.log(elapsed / previous[1]) / math.log(n / previous[0])
+            if previous else float("nan")
+        )
+        print(f"{n:>10} {len(clusters):>10} {elapsed:>10.3f} {exponent:>10.2f}")
+        previous = (n, elapsed)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="chunk_by_similarity scaling benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 4000, 16000, 64000])
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--threshold", type=float, default=0.7)
+    args = parser.parse_args()
+    run(args.sizes, args.dim, args.threshold)
@@ -0,0 +1,353 @@
+"""
+Open-loop load generator for the retrieval API (``src/api.py``).
+
+By default the API is started in a subprocess with an in-memory Qdrant
+client, a tiny random BERT and synthetic dialogue files (see
+``synthetic_dialogue.py``), so the run needs neither a Qdrant server nor a
+trained model. Requests arrive as a Poisson process at each of ``--rates``
+(requests/s) for ``--duration`` seconds, whether or not earlier ones have
+finished, and are drawn from ``--mix``:
+
+* ``single``: ``/retrieve/qdrant`` on one naive_csv collection
+* ``batch``: ``/retrieve/qdrant/multi`` across every file
+* ``filtered``: ``/retrieve/qdrant`` on one tenant of a shared collection
+* ``contextual``: ``/retrieve/qdrant`` in contextual mode
+
+Run from the repository root:
+
+    python benchmarks/load_test.py --rates 5 20 50 --duration 30 \
+        --mix single=0.6,batch=0.1,filtered=0.2,contextual=0.1 --out logs/load_report.json
+
+Latency is measured from the moment a request was due, not when it was
+sent, so a saturated server shows up as queueing delay instead of being
+hidden by a slower send rate. Contextual collections are indexed with the
+chunk's first sentence as its key instead of an LLM summary; the query
+path is unchanged. ``--url`` drives an API that is already running instead
+(``--model_output_path`` and ``--file_paths`` must then name files the server can read).
+"""
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src")))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import argparse
+import asyncio
+import json
+import random
+import socket
+import subprocess
+import tempfile
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+
+import httpx
+import numpy as np
+
+KINDS = ("single", "batch", "filtered", "contextual")
+SHARED_COLLECTION = "load_test_shared"
+
+
+def parse_mix(spec: str) -> dict[str, float]:
+    """"single=0.6,batch=0.1" -> normalised weights per request kind."""
+    mix = {}
+    for part in filter(None, spec.split(",")):
+        kind, _, weight = part.partition("=")
+        kind = kind.strip()
+        if kind not in KINDS:
+            raise ValueError(f"Unknown request kind '{kind}', expected one of {KINDS}")
+        mix[kind] = float(weight or 1)
+    total = sum(mix.values())
+    if total <= 0:
+        raise ValueError(f"Empty request mix '{spec}'")
+    return {kind: weight / total for kind, weight in mix.items()}
+
+
+def arrivals(rate: float, duration: float, rng: random.Random) -> list[float]:
+    """Send times (seconds from the start) of a Poisson process of `rate` requests/s."""
+    times, t = [], rng.expovariate(rate)
+    while t < duration:
+        times.append(t)
+        t += rng.expovariate(rate)
+    return times
+
+
+def percentiles(latencies: list[float]) -> dict:
+    if not latencies:
+        return {"p50": None, "p95": None, "p99": None, "max": None}
+    ms = np.asarray(latencies) * 1000
+    return {
+        "p50": float(np.percentile(ms, 50)),
+        "p95": float(np.percentile(ms, 95)),
+        "p99": float(np.percentile(ms, 99)),
+        "max": float(ms.max()),
+    }
+
+
+@dataclass
+class Workload:
+    """The files and queries requests are built from."""
+
+    model_output_path: str
+    file_paths: list[str]
+    queries: list[str]
+    top_k: int = 10
+    contextual_path: str | None = None
+
+    def request(self, kind: str, rng: random.Random) -> tuple[str, dict]:
+        query = rng.choice(self.queries)
+        base = {"model_output_path": self.model_output_path, "query": query, "top_k": self.top_k}
+        match kind:
+            case "single":
+                return "/retrieve/qdrant", {**base, "file_path": self.file_paths[0]}
+            case "batch":
+                return "/retrieve/qdrant/multi", {**base, "file_paths": self.file_paths}
+            case "filtered":
+                return "/retrieve/qdrant", {
+                    **base, "file_path": rng.choice(self.file_paths), "tenant_collection": SHARED_COLLECTION,
+                }
+            case "contextual":
+                # Collections are named after the file, so contextual mode gets a file of its own.
+                return "/retrieve/qdrant", {**base, "file_path": self.contextual_path, "mode": "contextual"}
+        raise ValueError(kind)
+
+    def warmup_requests(self, kinds) -> list[tuple[str, dict]]:
+        """One request per collection (and tenant) that `kinds` touch, so all are indexed up front."""
+        requests = []
+        for kind in kinds:
+            path, body = self.request(kind, random.Random(0))
+            if kind == "filtered":
+                requests += [(path, {**body, "file_path": file_path}) for file_path in self.file_paths]
+            else:
+                requests.append((path, body))
+        return requests
+
+
+@dataclass
+class Phase:
+    rate: float
+    duration: float
+    records: list[dict] = field(default_factory=list)
+
+    def summary(self, rss: list[tuple[float, float]]) -> dict:
+        ok = [r for r in self.records if r["ok"]]
+        finished = max((r["done"] for r in self.records), default=self.duration)
+        by_kind = {}
+        for kind in sorted({r["kind"] for r in self.records}):
+            records = [r for r in self.records if r["kind"] == kind]
+            by_kind[kind] = {
+                "requests": len(records),
+                "errors": sum(not r["ok"] for r in records),
+                "latency_ms": percentiles([r["latency"] for r in records if r["ok"]]),
+            }
+        errors = {}
+        for r in self.records:
+            if not r["ok"]:
+                errors[r["status"]] = errors.get(r["status"], 0) + 1
+        rss_mb = [mb for _, mb in rss]
+        return {
+            "offered_qps": self.rate,
+            "duration_seconds": self.duration,
+            "requests": len(self.records),
+            "errors": errors,
+            "error_rate": 1 - len(ok) / len(self.records) if self.records else 0.0,
+            # Completions per second until the last response came back.
+            "achieved_qps": len(ok) / max(finished, self.duration),
+            "latency_ms": percentiles([r["latency"] for r in ok]),
+            "by_kind": by_kind,
+            "server_rss_mb": {"start": rss_mb[0], "max": max(rss_mb), "end": rss_mb[-1]} if rss_mb else None,
+        }
+
+
+async def run_phase(client: httpx.AsyncClient, workload: Workload, mix: dict, rate: float, duration: float,
+                    rng: random.Random) -> Phase:
+    phase = Phase(rate, duration)
+    times = arrivals(rate, duration, rng)
+    kinds = rng.choices(list(mix), weights=list(mix.values()), k=len(times))
+    requests = [(t, kind, *workload.request(kind, rng)) for t, kind in zip(times, kinds)]
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+
+    async def send(t, kind, path, body):
+        await asyncio.sleep(max(0.0, start + t - loop.time()))
+        try:
+            response = await client.post(path, json=body)
+            ok, status = response.status_code == 200, str(response.status_code)
+        except httpx.HTTPError as e:
+            ok, status = False, type(e).__name__
+        now = loop.time()
+        phase.records.append({"kind": kind, "ok": ok, "status": status, "latency": now - start - t, "done": now - start})
+
+    await asyncio.gather(*(send(*request) for request in requests))
+    return phase
+
+
+async def sample_rss(pid: int | None, timeline: list, interval: float, stop: asyncio.Event, origin: float):
+    if pid is None:
+        return
+    import psutil
+
+    process = psutil.Process(pid)
+    while not stop.is_set():
+        try:
+            timeline.append((time.perf_counter() - origin, process.memory_info().rss / 2**20))
+        except psutil.NoSuchProcess:
+            return
+        try:
+            await asyncio.wait_for(stop.wait(), interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def drive(url: str, workload: Workload, mix: dict, rates: list[float], duration: float,
+                server_pid: int | None = None, timeout: float = 30.0, sample_seconds: float = 0.5,
+                seed: int = 0, transport: httpx.AsyncBaseTransport | None = None) -> dict:
+    rng = random.Random(seed)
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(base_url=url, timeout=timeout, limits=limits, transport=transport) as client:
+        # Index every collection before the clock starts.
+        warmup_start = time.perf_counter()
+        for path, body in workload.warmup_requests(mix):
+            response = await client.post(path, json=body, timeout=None)
+            response.raise_for_status()
+        warmup_seconds = time.perf_counter() - warmup_start
+
+        origin = time.perf_counter()
+        timeline: list[tuple[float, float]] = []
+        stop = asyncio.Event()
+        sampler = asyncio.create_task(sample_rss(server_pid, timeline, sample_seconds, stop, origin))
+        phases = []
+        for rate in rates:
+            phase_start = time.perf_counter() - origin
+            phase = await run_phase(client, workload, mix, rate, duration, rng)
+            phase_end = time.perf_counter() - origin
+            await asyncio.sleep(sample_seconds)  # one more RSS sample after the tail
+            phases.append(phase.summary([s for s in timeline if phase_start <= s[0] <= phase_end + sample_seconds]))
+        stop.set()
+        await sampler
+    return {
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "config": {"url": url, "mix": mix, "rates": rates, "duration_seconds": duration, "seed": seed},
+        "warmup_seconds": warmup_seconds,
+        "phases": phases,
+        "server_rss_timeline": [[round(t, 3), round(mb, 1)] for t, mb in timeline],
+    }
+
+
+def serve(port: int) -> None:
+    """Run the API with every `QdrantConnector().connect()` sharing one in-memory client."""
+    import uvicorn
+    from qdrant_client import QdrantClient
+    from database.connector import QdrantConnector
+    from retrieval.contextual_retrieve import ContextualIndexing
+
+    client = QdrantClient(":memory:")
+    QdrantConnector.connect = lambda self, *args, **kwargs: client
+    # No LLM: the first sentence stands in for the contextual summary.
+    ContextualIndexing._summarize = lambda self, chunk: chunk.split(".")[0][:200]
+    import api
+
+    uvicorn.run(api.app, host="127.0.0.1", port=port, log_level="warning")
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(port: int, startup_timeout: float = 120.0) -> subprocess.Popen:
+    process = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--serve", "--port", str(port)])
+    deadline = time.monotonic() + startup_timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"API exited with code {process.returncode}")
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/openapi.json", timeout=1).status_code == 200:
+                return process
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise TimeoutError(f"API did not start within {startup_timeout}s")
+
+
+def synthetic_workload(workdir: str, rows: int, files: int, lang: str = "en") -> Workload:
+    from benchmarks.synthetic_dialogue import SyntheticDialogue, tiny_model
+
+    model = tiny_model(os.path.join(workdir, "model"), lang)
+    paths = [
+        SyntheticDialogue(lang, seed=i).write(os.path.join(workdir, f"load_{i}.csv"), rows)
+        for i in range(files + 1)
+    ]
+    queries = [row["text"] for row in SyntheticDialogue(lang, seed=files + 1).rows(500)]
+    return Workload(model, paths[:files], queries, contextual_path=paths[files])
+
+
+def argparser():
+    parser = argparse.ArgumentParser(description="Open-loop load generator for the retrieval API")
+    parser.add_argument("--rates", type=float, nargs="+", default=[5, 20], help="Offered requests/s, one phase each")
+    parser.add_argument("--duration", type=float, default=20, help="Seconds per rate")
+    parser.add_argument("--mix", type=str, default="single=0.6,batch=0.1,filtered=0.2,contextual=0.1")
+    parser.add_argument("--rows", type=int, default=2000, help="Rows of every synthetic file")
+    parser.add_argument("--files", type=int, default=3, help="Synthetic files (collections)")
+    parser.add_argument("--lang", type=str, choices=["en", "cn"], default="en")
+    parser.add_argument("--timeout", type=float, default=30, help="Client timeout per request, in seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--url", type=str, default=None, help="Drive a running API instead of starting one")
+    parser.add_argument("--server_pid", type=int, default=None, help="With --url: process to sample RSS of")
+    parser.add_argument("--model_output_path", type=str, default=None, help="With --url: model to query with")
+    parser.add_argument("--file_paths", type=str, nargs="+", default=None, help="With --url: dialogue CSVs")
+    parser.add_argument("--out", type=str, default=None, help="Write the JSON report here")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, default=None, help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def format_report(report: dict) -> str:
+    lines = [f"{'offered':>8} {'achieved':>9} {'requests':>9} {'errors':>7} {'p50 ms':>9} {'p95 ms':>9} "
+             f"{'p99 ms':>9} {'rss max':>8}"]
+    for phase in report["phases"]:
+        latency, rss = phase["latency_ms"], phase["server_rss_mb"] or {}
+        fmt = lambda v: f"{v:9.1f}" if v is not None else f"{'-':>9}"
+        lines.append(
+            f"{phase['offered_qps']:8.1f} {phase['achieved_qps']:9.1f} {phase['requests']:9d} "
+            f"{phase['error_rate']:7.1%} {fmt(latency['p50'])} {fmt(latency['p95'])} {fmt(latency['p99'])} "
+            f"{rss.get('max', float('nan')):8.0f}"
+        )
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    args = argparser()
+    if args.serve:
+        serve(args.port)
+        sys.exit(0)
+
+    mix = parse_mix(args.mix)
+    with tempfile.TemporaryDirectory(prefix="load-") as workdir:
+        server = None
+        if args.url:
+            if not (args.model_output_path and args.file_paths):
+                sys.exit("--url needs --model_output_path and --file_paths")
+            from benchmarks.synthetic_dialogue import SyntheticDialogue
+            queries = [row["text"] for row in SyntheticDialogue(args.lang, seed=args.seed).rows(500)]
+            workload = Workload(args.model_output_path, args.file_paths, queries, contextual_path=args.file_paths[-1])
+            url, pid = args.url, args.server_pid
+        else:
+            workload = synthetic_workload(workdir, args.rows, args.files, args.lang)
+            port = free_port()
+            server = start_server(port)
+            url, pid = f"http://127.0.0.1:{port}", server.pid
+        try:
+            report = asyncio.run(drive(
+                url, workload, mix, args.rates, args.duration, server_pid=pid, timeout=args.timeout, seed=args.seed,
+            ))
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    print(format_report(report))
@@ -0,0 +1,251 @@
+"""
+Micro-benchmark suite with baselines and a regression report.
+
+Benchmarks run on synthetic dialogue (see ``synthetic_dialogue.py``) scaled
+from the English and Chinese example scripts, and Qdrant runs as an
+in-memory client, so no server or dataset is needed. ``--model tiny`` uses a
+small random BERT and runs offline; pass a real model to measure realistic
+embedding costs. Run from the repository root:
+
+    python benchmarks/suite.py --model tiny --rows 10000 100000 --save_baseline local
+    python benchmarks/suite.py --model tiny --rows 10000 100000 --compare local --threshold 0.15
+
+Every metric is stored as ``<benchmark>/<lang>/<rows>/<metric>``. With
+``--compare``, metrics that got worse than the baseline by more than
+``--threshold`` (relative) are reported as regressions and the exit code is 1.
+"""
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src")))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import argparse
+import contextlib
+import json
+import platform
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.chunk_by_similarity_bench import synthetic_embeddings
+from benchmarks.synthetic_dialogue import SyntheticDialogue, tiny_model
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+BENCHMARKS = ("embed", "chunk_text", "chunk_by_similarity", "cl_retrieve", "indexer")
+# Embedding every row of a large corpus dominates the run; the embedding
+# benchmarks use at most this many rows of each corpus.
+MAX_EMBED_ROWS = 20000
+
+
+def metric(value: float, better: str) -> dict:
+    return {"value": float(value), "better": better}
+
+
+@contextlib.contextmanager
+def memory_qdrant():
+    """Route `QdrantConnector().connect()` to a fresh in-memory client."""
+    from qdrant_client import QdrantClient
+    from database.connector import QdrantConnector
+
+    client = QdrantClient(":memory:")
+    connect = QdrantConnector.connect
+    QdrantConnector.connect = lambda self, *args, **kwargs: client
+    try:
+        yield client
+    finally:
+        QdrantConnector.connect = connect
+        client.close()
+
+
+def bench_embed(model, corpus, texts):
+    from model_management.embedding_model_controller import EmbeddingModelController
+
+    controller = EmbeddingModelController(model)
+    texts = texts[:MAX_EMBED_ROWS]
+    controller.embed(texts[:32])  # warm up
+    start = time.perf_counter()
+    controller.embed(texts)
+    bulk = time.perf_counter() - start
+    single = []
+    for text in texts[:50]:
+        start = time.perf_counter()
+        controller.embed(text)
+        single.append((time.perf_counter() - start) * 1000)
+    return {
+        "texts_per_second": metric(len(texts) / bulk, "higher"),
+        "single_ms_p50": metric(np.percentile(single, 50), "lower"),
+    }
+
+
+def bench_chunk_text(model, corpus, texts):
+    from retrieval.chunking_strategies.neighbour_sim import NeibourSimilarityChunker
+
+    chunker = NeibourSimilarityChunker(embedding_model_name=model)
+    text = "\n".join(texts)
+    start = time.perf_counter()
+    chunks = chunker.chunk_text(text, max_tokens=150)
+    seconds = time.perf_counter() - start
+    return {
+        "seconds": metric(seconds, "lower"),
+        "rows_per_second": metric(len(texts) / seconds, "higher"),
+        "chunks": metric(len(chunks), "info"),
+    }
+
+
+def bench_chunk_by_similarity(model, corpus, texts):
+    from retrieval.chunking_strategies.neighbour_sim import NeibourSimilarityChunker
+
+    chunker = NeibourSimilarityChunker(embedding_model_name=model)
+    # Synthetic embeddings, as in chunk_by_similarity_bench.py: only the
+    # clustering is timed.
+    embeddings = synthetic_embeddings(len(texts), 384)
+    start = time.perf_counter()
+    _, clusters = chunker.chunk_by_similarity(texts, similarity_threshold=0.7, embeddings=embeddings)
+    seconds = time.perf_counter() - start
+    return {"seconds": metric(seconds, "lower"), "clusters": metric(len(clusters), "info")}
+
+
+def bench_cl_retrieve(model, corpus, texts, queries=50):
+    from retrieval.cl_retrieve import CLRetrieve
+
+    path = corpus
+    if len(texts) > MAX_EMBED_ROWS:
+        path = corpus[: -len(".csv")] + f"_{MAX_EMBED_ROWS}.csv"
+        pd.read_csv(corpus, nrows=MAX_EMBED_ROWS).to_csv(path, index=False)
+    retriever = CLRetrieve(model)
+    embeddings = retriever.read_and_embed(path, text_embedding_only=True)
+    timings = []
+    for query in texts[:queries]:
+        start = time.perf_counter()
+        retriever.retrieve(path, query, embeddings, top_k=20)
+        timings.append((time.perf_counter() - start) * 1000)
+    return {
+        "latency_ms_p50": metric(np.percentile(timings, 50), "lower"),
+        "latency_ms_p95": metric(np.percentile(timings, 95), "lower"),
+    }
+
+
+def bench_indexer(model, corpus, texts):
+    from retrieval.structured_csv_retrieve import StructuredCSVIndexing
+
+    path = corpus
+    if len(texts) > MAX_EMBED_ROWS:
+        path = corpus[: -len(".csv")] + f"_{MAX_EMBED_ROWS}.csv"
+        pd.read_csv(corpus, nrows=MAX_EMBED_ROWS).to_csv(path, index=False)
+    rows = min(len(texts), MAX_EMBED_ROWS)
+    indexer = StructuredCSVIndexing()
+    with memory_qdrant():
+        start = time.perf_counter()
+        indexer.index(embedding_model_path=model, file_path=path, collection_name="bench")
+        seconds = time.perf_counter() - start
+    return {
+        "rows_per_second": metric(rows / seconds, "higher"),
+        # Everything but embedding: dedup, sparse vectors, upserts, style index.
+        "overhead_seconds": metric(seconds - indexer.report["embed_seconds"], "lower"),
+    }
+
+
+def run(model, langs, sizes, benchmarks, workdir, repeats=1):
+    """Run `benchmarks` on every corpus; each metric is the median of `repeats` runs."""
+    metrics = {}
+    for lang in langs:
+        model_path = tiny_model(os.path.join(workdir, f"tiny_{lang}"), lang) if model == "tiny" else model
+        generator = SyntheticDialogue(lang)
+        for rows in sizes:
+            corpus = generator.write(os.path.join(workdir, f"{lang}_{rows}.csv"), rows)
+            texts = pd.read_csv(corpus)["text"].astype(str).tolist()
+            for name in benchmarks:
+                print(f"{name} {lang} {rows}...", file=sys.stderr, flush=True)
+                results = [globals()[f"bench_{name}"](model_path, corpus, texts) for _ in range(repeats)]
+                for key, value in results[0].items():
+                    median = np.median([result[key]["value"] for result in results])
+                    metrics[f"{name}/{lang}/{rows}/{key}"] = metric(median, value["better"])
+    return metrics
+
+
+def environment() -> dict:
+    import torch
+
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "torch": torch.__version__,
+        "cuda": torch.cuda.is_available(),
+    }
+
+
+def compare(current: dict, baseline: dict, threshold: float = 0.1) -> list[dict]:
+    """
+    One row per metric present in both runs: the relative change, and
+    `status` "regression" / "improvement" when the metric moved by more than
+    `threshold` in its bad / good direction, else "ok". Informational
+    metrics are skipped.
+    """
+    rows = []
+    for key in sorted(set(current) & set(baseline)):
+        better = current[key]["better"]
+        if better not in ("higher", "lower"):
+            continue
+        old, new = baseline[key]["value"], current[key]["value"]
+        change = (new - old) / old if old else 0.0
+        worse = -change if better == "higher" else change
+        status = "regression" if worse > threshold else "improvement" if worse < -threshold else "ok"
+        rows.append({"metric": key, "baseline": old, "current": new, "change": change, "status": status})
+    return rows
+
+
+def format_report(rows: list[dict]) -> str:
+    lines = [f"{'metric':<55} {'baseline':>12} {'current':>12} {'change':>8}  status"]
+    for row in rows:
+        lines.append(
+            f"{row['metric']:<55} {row['baseline']:>12.4g} {row['current']:>12.4g} "
+            f"{row['change']:>+8.1%}  {row['status']}"
+        )
+    regressions = sum(row["status"] == "regression" for row in rows)
+    lines.append(f"{len(rows)} metrics compared, {regressions} regression(s)")
+    return "\n".join(lines)
+
+
+def baseline_path(name: str) -> str:
+    return name if name.endswith(".json") else os.path.join(BASELINE_DIR, f"{name}.json")
+
+
+def argparser():
+    parser = argparse.ArgumentParser(description="Micro-benchmark suite")
+    parser.add_argument("--model", type=str, default="tiny", help="Embedding model, or 'tiny' for a random offline BERT")
+    parser.add_argument("--lang", type=str, nargs="+", choices=["en", "cn"], default=["en", "cn"])
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000], help="Synthetic corpus sizes")
+    parser.add_argument("--benchmarks", type=str, nargs="+", choices=BENCHMARKS, default=list(BENCHMARKS))
+    parser.add_argument("--repeats", type=int, default=3, help="Runs per benchmark; the median is kept")
+    parser.add_argument("--out", type=str, default=None, help="Write the results JSON here")
+    parser.add_argument("--save_baseline", type=str, default=None, help="Store the results as this baseline")
+    parser.add_argument("--compare", type=str, default=None, help="Baseline name (or .json path) to compare with")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Relative change counted as a regression")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = argparser()
+    with tempfile.TemporaryDirectory(prefix="bench-") as workdir:
+        metrics = run(args.model, args.lang, args.rows, args.benchmarks, workdir, args.repeats)
+    results = {
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "config": {"model": args.model, "lang": args.lang, "rows": args.rows, "repeats": args.repeats},
+        "environment": environment(),
+        "metrics": metrics,
+    }
+    for path in filter(None, [args.out, args.save_baseline and baseline_path(args.save_baseline)]):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(baseline_path(args.compare), "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        rows = compare(metrics, baseline["metrics"], args.threshold)
+        print(format_report(rows))
+        sys.exit(1 if any(row["status"] == "regression" for row in rows) else 0)
+    for key, value in metrics.items():
+        print(f"{key:<55} {value['value']:>12.4g}")
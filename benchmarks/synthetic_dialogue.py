@@ -0,0 +1,139 @@
+"""
+Synthetic dialogue CSVs at any scale, derived from the ``examples/`` scripts.
+
+Lines are example lines with a share of their words (English) or characters
+(Chinese) swapped for others from the same script, so the output keeps the
+talkers, line lengths and vocabulary of the original without being a copy
+of it; near-duplicate folding at indexing time therefore does not collapse
+it. Rows get ``D<session>:<turn>`` sources and dated ``time`` cells, like the
+locomo CSVs. Run from the repository root:
+
+    python benchmarks/synthetic_dialogue.py --lang en --rows 100000 --out dataset/synthetic_en_100k.csv
+"""
+import argparse
+import csv
+import os
+import re
+from datetime import datetime, timedelta
+from typing import Iterator, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+EXAMPLES = {
+    "en": os.path.join(ROOT, "examples", "en_example_ironman_dataset.csv"),
+    "cn": os.path.join(ROOT, "examples", "cn_example_nazha_dataset.csv"),
+}
+# A CJK character, a run of other word characters, or one punctuation mark.
+_TOKEN = re.compile(r"[一-鿿]|[^\W一-鿿]+|[^\w\s]", re.UNICODE)
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN.findall(text)
+
+
+def detokenize(tokens: List[str], lang: str) -> str:
+    if lang == "cn":
+        return "".join(tokens)
+    text = " ".join(tokens)
+    return re.sub(r" ([^\w\s])", r"\1", text)
+
+
+class SyntheticDialogue:
+    """
+    Generate rows from the example script of `lang` ("en" or "cn"), or any
+    dialogue CSV with `talker` and `text` columns given as `template`.
+    Each line copies a random template line and replaces every word with
+    probability `mutation` by a word drawn from the script's vocabulary
+    (weighted by frequency). Output is deterministic for a given `seed`.
+    """
+
+    def __init__(self, lang: str = "en", template: str | None = None, mutation: float = 0.3,
+                 turns_per_session: int = 40, seed: int = 0):
+        df = pd.read_csv(template or EXAMPLES[lang])
+        df = df[df["text"].notna()]
+        self.lang = lang
+        self.lines: List[Tuple[str, List[str]]] = [
+            (str(talker), tokenize(str(text))) for talker, text in zip(df["talker"], df["text"])
+        ]
+        words, counts = np.unique(
+            [t for _, tokens in self.lines for t in tokens if t[0].isalnum() or "一" <= t <= "鿿"],
+            return_counts=True,
+        )
+        self.vocabulary = words
+        self.weights = counts / counts.sum()
+        self.mutation = mutation
+        self.turns_per_session = turns_per_session
+        self.seed = seed
+
+    def rows(self, n: int, batch_size: int = 10000) -> Iterator[dict]:
+        rng = np.random.default_rng(self.seed)
+        start = datetime(2023, 1, 1, 9, 0)
+        for offset in range(0, n, batch_size):
+            size = min(batch_size, n - offset)
+            templates = rng.integers(len(self.lines), size=size)
+            replacements = rng.choice(len(self.vocabulary), size=(size, 64), p=self.weights)
+            for i, (line, repl) in enumerate(zip(templates, replacements)):
+                row = offset + i
+                talker, tokens = self.lines[line]
+                swap = rng.random(len(tokens)) < self.mutation
+                tokens = [
+                    str(self.vocabulary[repl[j % len(repl)]]) if swap[j] and tok[0].isalnum() else tok
+                    for j, tok in enumerate(tokens)
+                ]
+                session, turn = divmod(row, self.turns_per_session)
+                yield {
+                    "source": f"D{session + 1}:{turn}",
+                    "time": (start + timedelta(days=session, minutes=turn)).strftime("%Y-%m-%d %H:%M"),
+                    "talker": talker,
+                    "text": detokenize(tokens, self.lang),
+                }
+
+    def write(self, path: str, n: int) -> str:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=["source", "time", "talker", "text"])
+            writer.writeheader()
+            writer.writerows(self.rows(n))
+        return path
+
+
+def tiny_model(path: str, lang: str = "en", hidden_size: int = 32, num_hidden_layers: int = 2) -> str:
+    """
+    Save a small random BERT whose vocabulary is the example script's, so
+    the suite can run offline. Its vectors are meaningless; only speed is
+    measured with it.
+    """
+    from transformers import BertConfig, BertModel, BertTokenizerFast
+
+    os.makedirs(path, exist_ok=True)
+    generator = SyntheticDialogue(lang)
+    vocab = os.path.join(path, "vocab.txt")
+    words = [w.lower() for w in generator.vocabulary]
+    with open(vocab, "w", encoding="utf-8") as f:
+        f.write("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + sorted(set(words))) + "\n")
+    tokenizer = BertTokenizerFast(vocab_file=vocab)
+    tokenizer.save_pretrained(path)
+    BertModel(BertConfig(
+        vocab_size=tokenizer.vocab_size, hidden_size=hidden_size, num_hidden_layers=num_hidden_layers,
+        num_attention_heads=2, intermediate_size=2 * hidden_size, max_position_embeddings=512,
+    )).save_pretrained(path)
+    return path
+
+
+def argparser():
+    parser = argparse.ArgumentParser(description="Scale the example dialogue scripts into synthetic CSVs")
+    parser.add_argument("--lang", type=str, choices=sorted(EXAMPLES), default="en")
+    parser.add_argument("--template", type=str, default=None, help="Dialogue CSV to scale instead of the example")
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--mutation", type=float, default=0.3, help="Share of the words replaced in every line")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", type=str, required=True)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = argparser()
+    generator = SyntheticDialogue(args.lang, args.template, args.mutation, seed=args.seed)
+    print(generator.write(args.out, args.rows))
@@ -47,6 +47,9 @@ def run_locomo_evaluation():
             if 'idx' in output[0]:
                 # If the output contains 'idx', it means we are in contextual mode
                 evidence_out = [q['idx'] for q in output]
+                # Near-duplicate lines are stored once; the lines they stand
+                # for count as retrieved too.
+                evidence_out += [dup for q in output for dup in q.get('duplicates', [])]
             else:
                 evidence_out = output
     
@@ -0,0 +1,275 @@
+"""
+Batched locomo evaluation: every conversation, mode and top_k in one run.
+
+    python evaluation/locomo_eval.py --model_output_path trained_model/model \
+        --modes naive_csv contextual --top_k 1 3 5 10 --out logs/locomo_report.json
+
+`--model_output_path` may contain `{conversation}` (e.g.
+`trained_model/locomo_{conversation}`) to use one trained model per
+conversation.
+"""
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src")))
+
+import argparse
+import glob
+import hashlib
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import numpy as np
+
+from database.connector import QdrantConnector
+from database.qdrant_controller import QdrantController
+from file_util import resolve_model_path
+from model_management.embedding_model_controller import EmbeddingModelController, model_fingerprint
+from model_management.sparse_model_controller import SparseModelController
+from retrieval.structured_csv_retrieve import StructuredCSVRetrieval
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = "evaluation/eval_dataset/locomo"
+STAGES = ("index", "embed", "search", "score")
+
+
+def discover_conversations(data_dir: str) -> dict[str, tuple[str, str]]:
+    """`{conversation: (csv_path, qa_path)}` for every `locomo_<conversation>.csv` with a `_qa.json`."""
+    conversations = {}
+    for qa_path in sorted(glob.glob(os.path.join(data_dir, "locomo_*_qa.json"))):
+        csv_path = qa_path[: -len("_qa.json")] + ".csv"
+        if os.path.exists(csv_path):
+            conversation = os.path.basename(csv_path)[len("locomo_"): -len(".csv")]
+            conversations[conversation] = (csv_path, qa_path)
+    return conversations
+
+
+def hit_sources(payload: dict) -> set:
+    """`source` ids of the turns a hit covers: naive_csv turns and their
+    folded near-duplicates, or the rows behind a contextual chunk."""
+    source = payload.get("source")
+    sources = set(source) if isinstance(source, list) else {source}
+    return {str(s) for s in sources | set(StructuredCSVRetrieval.stands_for(payload)) if s not in (None, "")}
+
+
+def evidence_ranks(evidence: list[str], hits: list[set]) -> list[float]:
+    """1-based rank of the first hit holding each evidence id (inf if none does)."""
+    ranks = []
+    for ev in dict.fromkeys(evidence):
+        ranks.append(next((rank for rank, sources in enumerate(hits, 1) if ev in sources), float("inf")))
+    return ranks
+
+
+def score(ranks_per_question: list[list[float]], top_ks: list[int]) -> dict:
+    """
+    Metrics for several k from one ranked list per question:
+    `accuracy@k` (all evidence in the top k, as in `evaluate.py`),
+    `recall@k` (share of the evidence in the top k) and `mrr` (reciprocal
+    rank of the first hit holding any evidence, within the largest k).
+    """
+    n = len(ranks_per_question)
+    if not n:
+        return {"questions": 0, "accuracy": {}, "recall": {}, "mrr": 0.0}
+    ranks = [np.asarray(r) for r in ranks_per_question]
+    max_k = max(top_ks)
+    first = np.asarray([r.min() for r in ranks])
+    return {
+        "questions": n,
+        "accuracy": {str(k): float(np.mean([(r <= k).all() for r in ranks])) for k in top_ks},
+        "recall": {str(k): float(np.mean([(r <= k).mean() for r in ranks])) for k in top_ks},
+        "mrr": float(np.mean(np.where(first <= max_k, 1.0 / first, 0.0))),
+    }
+
+
+class LocomoEvaluation:
+    """
+    Evaluate retrieval on the locomo conversations in `data_dir`.
+
+    Per conversation, the collections of every mode are indexed if needed,
+    all questions are embedded in one batch, and each mode answers them
+    with one Qdrant batch request for the largest `top_k`; the metrics of
+    every smaller k are read off the same ranked lists. Conversations are
+    evaluated on `workers` threads. `run` returns a JSON-serialisable
+    report with the metrics per conversation and mode, question-weighted
+    averages per mode, and seconds per stage (index, embed, search, score).
+
+    Hits are matched to the evidence by their `source` ids (exactly, so
+    "D1:3" does not match "D1:30"). Reranking, recency and context
+    expansion are per-query options of `qdrant_retrieve_mode` and are not
+    evaluated here.
+    """
+
+    def __init__(
+        self,
+        model_output_path: str,
+        data_dir: str = DATA_DIR,
+        conversations: list[str] | None = None,
+        modes: tuple[str, ...] = ("naive_csv",),
+        top_ks: tuple[int, ...] = (1, 3, 5, 10),
+        hybrid: bool = False,
+        workers: int = 4,
+        collection_suffix: str = "",
+    ):
+        self.model_output_path = model_output_path
+        self.data_dir = resolve_model_path(data_dir)
+        available = discover_conversations(self.data_dir)
+        missing = sorted(set(conversations or []) - set(available))
+        if missing:
+            raise ValueError(f"No locomo data for {missing} in {self.data_dir}")
+        self.conversations = {c: available[c] for c in (conversations or available)}
+        self.modes = list(modes)
+        self.top_ks = sorted(set(top_ks))
+        self.hybrid = hybrid
+        self.workers = workers
+        self.collection_suffix = collection_suffix
+
+    def _indexer(self, mode: str):
+        match mode:
+            case "naive_csv":
+                from retrieval.structured_csv_retrieve import StructuredCSVIndexing
+                return StructuredCSVIndexing()
+            case "contextual":
+                from retrieval.contextual_retrieve import ContextualIndexing
+                return ContextualIndexing()
+        raise ValueError(f"Unknown mode '{mode}'")
+
+    def collection_name(self, csv_path: str, mode: str, model_path: str) -> str:
+        """
+        One collection per conversation, mode and model: indexing skips an
+        existing collection, so a retrained model must not find the vectors
+        of the previous one under the same name.
+        """
+        model = hashlib.sha256(model_fingerprint(model_path).encode("utf-8")).hexdigest()[:12]
+        return os.path.basename(csv_path).rsplit(".", 1)[0] + f"_{mode}_{model}{self.collection_suffix}"
+
+    def evaluate_conversation(self, conversation: str) -> dict:
+        csv_path, qa_path = self.conversations[conversation]
+        model_path = resolve_model_path(self.model_output_path.format(conversation=conversation))
+        with open(qa_path, "r", encoding="utf-8") as f:
+            qas = json.load(f)
+        questions = [qa for qa in qas if qa.get("evidence")]
+        qc = QdrantController(QdrantConnector().connect())
+
+        timing = {stage: 0.0 for stage in STAGES}
+        start = time.perf_counter()
+        collections = {}
+        for mode in self.modes:
+            collections[mode] = self.collection_name(csv_path, mode, model_path)
+            self._indexer(mode).index(
+                embedding_model_path=model_path, file_path=csv_path, collection_name=collections[mode]
+            )
+        timing["index"] = time.perf_counter() - start
+
+        # One embedding pass per conversation, shared by every mode.
+        start = time.perf_counter()
+        texts = [qa["question"] for qa in questions]
+        query_vectors = EmbeddingModelController(model_name=model_path).embed(texts) if texts else []
+        sparse_vectors = [SparseModelController().embed_query(t) for t in texts] if self.hybrid else None
+        timing["embed"] = time.perf_counter() - start
+
+        result = {}
+        for mode in self.modes:
+            start = time.perf_counter()
+            hits = qc.batch_search(
+                collection_name=collections[mode],
+                query_vectors=query_vectors,
+                limit=max(self.top_ks),
+                sparse_vectors=sparse_vectors,
+            )
+            search_seconds = time.perf_counter() - start
+            start = time.perf_counter()
+            ranks = [
+                evidence_ranks([str(ev) for ev in qa["evidence"]], [hit_sources(p.payload or {}) for p in points])
+                for qa, points in zip(questions, hits)
+            ]
+            metrics = score(ranks, self.top_ks)
+            score_seconds = time.perf_counter() - start
+            timing["search"] += search_seconds
+            timing["score"] += score_seconds
+            result[mode] = {
+                **metrics,
+                "skipped": len(qas) - len(questions),
+                "collection": collections[mode],
+                "timing": {"search": search_seconds, "score": score_seconds},
+            }
+        logger.info(f"{conversation}: {len(questions)} questions in {sum(timing.values()):.2f}s")
+        return {"modes": result, "timing": timing}
+
+    def summarize(self, per_conversation: dict) -> dict:
+        """Question-weighted averages per mode over all conversations."""
+        summary = {}
+        for mode in self.modes:
+            rows = [c["modes"][mode] for c in per_conversation.values()]
+            n = sum(r["questions"] for r in rows)
+            weighted = lambda values: sum(v * r["questions"] for v, r in zip(values, rows)) / n if n else 0.0
+            summary[mode] = {
+                "questions": n,
+                "accuracy": {str(k): weighted([r["accuracy"].get(str(k), 0.0) for r in rows]) for k in self.top_ks},
+                "recall": {str(k): weighted([r["recall"].get(str(k), 0.0) for r in rows]) for k in self.top_ks},
+                "mrr": weighted([r["mrr"] for r in rows]),
+            }
+        return summary
+
+    def run(self) -> dict:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="locomo-eval") as pool:
+            per_conversation = dict(zip(
+                self.conversations, pool.map(self.evaluate_conversation, self.conversations)
+            ))
+        total_seconds = time.perf_counter() - start
+        questions = sum(c["modes"][self.modes[0]]["questions"] for c in per_conversation.values()) if self.modes else 0
+        return {
+            "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "config": {
+                "model_output_path": self.model_output_path,
+                "conversations": list(self.conversations),
+                "modes": self.modes,
+                "top_k": self.top_ks,
+                "hybrid": self.hybrid,
+                "workers": self.workers,
+            },
+            "summary": self.summarize(per_conversation),
+            "conversations": per_conversation,
+            "timing": {
+                "total_seconds": total_seconds,
+                # Summed over conversations, so they can exceed the wall time.
+                "stages": {s: sum(c["timing"][s] for c in per_conversation.values()) for s in STAGES},
+                "questions_per_second": questions * len(self.modes) / total_seconds if total_seconds else 0.0,
+            },
+        }
+
+
+def argparser():
+    parser = argparse.ArgumentParser(description="Batched locomo retrieval evaluation")
+    parser.add_argument("--model_output_path", type=str, required=True, help="Model; may contain {conversation}")
+    parser.add_argument("--data_dir", type=str, default=DATA_DIR, help="Directory of locomo_<conv>.csv and _qa.json")
+    parser.add_argument("--conversations", type=str, nargs="*", default=None, help="e.g. conv-26 (default: all)")
+    parser.add_argument("--modes", type=str, nargs="+", choices=["naive_csv", "contextual"], default=["naive_csv"])
+    parser.add_argument("--top_k", type=int, nargs="+", default=[1, 3, 5, 10])
+    parser.add_argument("--hybrid", action="store_true", help="Fuse dense and sparse lexical search")
+    parser.add_argument("--workers", type=int, default=4, help="Conversations evaluated in parallel")
+    parser.add_argument("--collection_suffix", type=str, default="", help="Appended to every collection name")
+    parser.add_argument("--out", type=str, default=None, help="Write the JSON report here")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    args = argparser()
+    report = LocomoEvaluation(
+        model_output_path=args.model_output_path,
+        data_dir=args.data_dir,
+        conversations=args.conversations,
+        modes=args.modes,
+        top_ks=args.top_k,
+        hybrid=args.hybrid,
+        workers=args.workers,
+        collection_suffix=args.collection_suffix,
+    ).run()
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps({"summary": report["summary"], "timing": report["timing"]}, indent=2))
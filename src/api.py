@@ -1,8 +1,66 @@
-from fastapi import FastAPI, Query
-from pydantic import BaseModel
-from retrieve import qdrant_retrieve_mode, one_time_retrieve_mode
+import os
+from contextlib import asynccontextmanager
+from typing import Annotated
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import JSONResponse
+from pydantic import AfterValidator, BaseModel
+from retrieve import qdrant_retrieve_mode, qdrant_multi_retrieve_mode, one_time_retrieve_mode
+from database.model_registry import ModelRegistry
+from retrieval.reembed import ReembedWorker
+from retrieval.style_index import StyleIndex
+from retrieval.memory_buffer import get_memory_buffer, close_memory_buffers, search_memories
+from tracing import PROFILE_MODES, trace
 
-app = FastAPI()
+# Profiles cost time and disk: X-Profile is refused unless PROFILE_ENABLED is set.
+PROFILE_ENABLED = bool(os.environ.get("PROFILE_ENABLED"))
+
+# Background re-embedding of stale collections; REEMBED_INTERVAL_SECONDS
+# makes it check periodically, otherwise it only runs on request.
+_reembed = {"worker": None}
+
+def _reembed_worker(**kwargs) -> ReembedWorker:
+    return ReembedWorker(
+        max_busy_fraction=float(os.environ.get("REEMBED_MAX_BUSY_FRACTION", 0.25)),
+        **kwargs,
+    )
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    interval = os.environ.get("REEMBED_INTERVAL_SECONDS")
+    if interval:
+        _reembed["worker"] = _reembed_worker(interval_seconds=float(interval))
+        _reembed["worker"].start()
+    yield
+    if _reembed["worker"] is not None:
+        _reembed["worker"].stop()
+    # Flush buffered memories before the process exits.
+    close_memory_buffers()
+
+app = FastAPI(lifespan=lifespan)
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    """
+    Trace every request: requests slower than $TRACE_SLOW_MS are logged with
+    their span breakdown, which is also returned as `Server-Timing`. With
+    $PROFILE_ENABLED set, an `X-Profile: cprofile|sample` header saves a
+    profile of the request to $PROFILE_DIR and returns its path as
+    `X-Profile-Path`.
+    """
+    profile = request.headers.get("x-profile") or None
+    if profile is not None and not PROFILE_ENABLED:
+        return JSONResponse(status_code=403, content={"detail": "Profiling is disabled; set PROFILE_ENABLED=1 to allow X-Profile"})
+    if profile not in (None, *PROFILE_MODES):
+        return JSONResponse(status_code=400, content={"detail": f"X-Profile must be one of {PROFILE_MODES}"})
+    # Endpoints run on worker threads; the event loop itself is not profiled.
+    with trace(f"{request.method} {request.url.path}", profile=profile, own_thread=False) as request_trace:
+        response = await call_next(request)
+    response.headers["X-Trace-Id"] = request_trace.id
+    if request_trace.spans:
+        response.headers["Server-Timing"] = request_trace.server_timing()
+    if request_trace.profile_path:
+        response.headers["X-Profile-Path"] = request_trace.profile_path
+    return response
 
 class RetrieveRequest(BaseModel):
     model_output_path: str
@@ -10,20 +68,150 @@ class RetrieveRequest(BaseModel):
     query: str
     mode: str = "naive_csv"  # Default mode
     top_k: int = 20
+    hybrid: bool = False  # Fuse dense and sparse lexical search
+    rerank_k: int | None = None  # Candidates to rerank with a cross-encoder
+    final_k: int | None = None  # Results kept after reranking (defaults to top_k)
+    reranker_model: str | None = None
+    rerank_budget_ms: float | None = None  # Per-request reranking latency budget
+    context_window: int = 0  # naive_csv: neighbouring turns added on each side of a hit
+    tenant_collection: str | None = None  # Shared collection holding every file as a tenant
+    recency_half_life_days: float | None = None  # naive_csv: boost recent turns, half the boost at this age
+    recency_weight: float = 0.3  # Maximum recency boost added to the similarity score
 
 @app.post("/retrieve/qdrant")
 def retrieve_qdrant(req: RetrieveRequest):
     collection_name = req.file_path.split("/")[-1].split(".")[0]
     result = qdrant_retrieve_mode(
-        model_output_path=req.model_output_path,
+        embedding_model_path=req.model_output_path,
         file_path=req.file_path,
         query=req.query,
         top_k=req.top_k,
         collection_name=collection_name,
         mode=req.mode,
+        hybrid=req.hybrid,
+        rerank_k=req.rerank_k,
+        final_k=req.final_k,
+        reranker_model=req.reranker_model,
+        rerank_budget_ms=req.rerank_budget_ms,
+        context_window=req.context_window,
+        tenant_collection=req.tenant_collection,
+        recency_half_life_days=req.recency_half_life_days,
+        recency_weight=req.recency_weight,
+    )
+    return {"result": result}
+
+class MultiRetrieveRequest(BaseModel):
+    model_output_path: str
+    file_paths: list[str]
+    query: str
+    mode: str = "naive_csv"
+    top_k: int = 20
+    hybrid: bool = False
+    timeout: float = 2.0  # Seconds each collection gets before it is skipped
+
+@app.post("/retrieve/qdrant/multi")
+def retrieve_qdrant_multi(req: MultiRetrieveRequest):
+    result, failed_collections = qdrant_multi_retrieve_mode(
+        embedding_model_path=req.model_output_path,
+        file_paths=req.file_paths,
+        query=req.query,
+        mode=req.mode,
+        top_k=req.top_k,
+        hybrid=req.hybrid,
+        timeout=req.timeout,
     )
+    return {"result": result, "failed_collections": failed_collections}
+
+@app.get("/style/{talker}")
+def style(talker: str, collection_name: str, top_n: int = 10, tenant: str | None = None):
+    """Precomputed style profile of a talker of an indexed naive_csv collection."""
+    result = StyleIndex().get(collection_name, talker, top_n=top_n, tenant=tenant)
+    if result is None:
+        raise HTTPException(status_code=404, detail=f"No style profile for '{talker}' in '{collection_name}'")
     return {"result": result}
 
+@app.get("/collections/status")
+def collections_status():
+    """Registered collections: their model fingerprint, whether they are stale and re-embed progress."""
+    worker = _reembed["worker"]
+    return {
+        "result": ModelRegistry().status(),
+        "reembedding": worker.current if worker is not None else None,
+    }
+
+@app.post("/collections/{collection_name}/reembed")
+def collections_reembed(collection_name: str):
+    """Start re-embedding a stale collection in the background; progress shows in /collections/status."""
+    record = next((s for s in ModelRegistry().status() if s["collection"] == collection_name), None)
+    if record is None:
+        raise HTTPException(status_code=404, detail=f"Collection '{collection_name}' is not in the model registry")
+    worker = _reembed["worker"]
+    started = False
+    if record["stale"] and (worker is None or not worker.is_running()):
+        _reembed["worker"] = _reembed_worker()
+        _reembed["worker"].start([collection_name], once=True)
+        started = True
+    return {"result": record, "started": started}
+
+def _plain_name(value: str) -> str:
+    # Memory collections and tenants also name local files (write-ahead logs).
+    if any(c in value for c in ("/", "\\", "\0")):
+        raise ValueError("must not contain path separators")
+    return value
+
+PlainName = Annotated[str, AfterValidator(_plain_name)]
+
+class MemoryItem(BaseModel):
+    text: str
+    talker: str = ""
+    time: str | None = None  # Defaults to the time the memory is added
+    source: str | None = None  # Defaults to "memory:<row>"
+
+class MemoryAddRequest(MemoryItem):
+    model_output_path: str
+    collection_name: PlainName
+    tenant: PlainName | None = None
+
+class MemoryBulkAddRequest(BaseModel):
+    model_output_path: str
+    collection_name: PlainName
+    items: list[MemoryItem]
+    tenant: PlainName | None = None
+
+class MemorySearchRequest(BaseModel):
+    model_output_path: str
+    collection_name: PlainName
+    query: str
+    top_k: int = 20
+    tenant: PlainName | None = None
+    recency_half_life_days: float | None = None
+    recency_weight: float = 0.3
+
+@app.post("/memory/add")
+def memory_add(req: MemoryAddRequest):
+    """Queue one memory; it is durable on return and searchable right away."""
+    buffer = get_memory_buffer(req.collection_name, req.model_output_path, tenant=req.tenant)
+    item = req.model_dump(include={"text", "talker", "time", "source"})
+    return {"result": buffer.add([item])[0]}
+
+@app.post("/memory/add/bulk")
+def memory_add_bulk(req: MemoryBulkAddRequest):
+    buffer = get_memory_buffer(req.collection_name, req.model_output_path, tenant=req.tenant)
+    return {"result": buffer.add([item.model_dump() for item in req.items])}
+
+@app.post("/memory/search")
+def memory_search(req: MemorySearchRequest):
+    """Search a memory collection, including memories not flushed yet."""
+    return {"result": search_memories(
+        req.collection_name,
+        req.model_output_path,
+        req.query,
+        top_k=req.top_k,
+        tenant=req.tenant,
+        recency_half_life_days=req.recency_half_life_days,
+        recency_weight=req.recency_weight,
+    )}
+
 @app.post("/retrieve/one_time")
 def retrieve_one_time(req: RetrieveRequest):
     result = one_time_retrieve_mode(
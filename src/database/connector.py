@@ -1,7 +1,14 @@
+import threading
 from qdrant_client import QdrantClient
 
 
 class QdrantConnector:
+    # Long-lived processes (the retrieve daemon) set this to share one client,
+    # and its connection pool, per set of connection arguments.
+    reuse_clients = False
+    _clients: dict = {}
+    _lock = threading.Lock()
+
     def connect(self, url: str = "http://localhost:6333",  # Default Qdrant URL
                 prefer_grpc: bool = False,
                 **client_kwargs):
@@ -14,8 +21,14 @@ class QdrantConnector:
             **client_kwargs: Additional keyword arguments for the Qdrant client.
 
         Returns:
-            None
+            QdrantClient: A new client, or the shared one when `reuse_clients` is set.
         """
 
-        # Initialize the Qdrant client with the provided parameters
-        return QdrantClient(url=url, prefer_grpc=prefer_grpc, **client_kwargs)
+        if not self.reuse_clients:
+            # Initialize the Qdrant client with the provided parameters
+            return QdrantClient(url=url, prefer_grpc=prefer_grpc, **client_kwargs)
+        key = (url, prefer_grpc, tuple(sorted(client_kwargs.items())))
+        with self._lock:
+            if key not in self._clients:
+                self._clients[key] = QdrantClient(url=url, prefer_grpc=prefer_grpc, **client_kwargs)
+            return self._clients[key]
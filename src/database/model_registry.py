@@ -0,0 +1,98 @@
+import uuid
+from datetime import datetime, timezone
+from database.connector import QdrantConnector
+from database.qdrant_controller import QdrantController
+from model_management.embedding_model_controller import model_fingerprint
+
+REGISTRY_COLLECTION = "model_registry"
+
+
+class ModelRegistry:
+    """
+    Which embedding model produced each collection.
+
+    One point per collection in `REGISTRY_COLLECTION` records the model path
+    and the fingerprint (`model_fingerprint`) of the weights its vectors
+    were embedded with, plus the progress of a running re-embed. A
+    collection is stale when the model at its path no longer has that
+    fingerprint, e.g. after `train.py` wrote a new model over it.
+    """
+
+    def __init__(self, qc: QdrantController | None = None):
+        self.qc = qc or QdrantController(QdrantConnector().connect())
+
+    @staticmethod
+    def record_id(collection_name: str) -> str:
+        return str(uuid.uuid5(uuid.NAMESPACE_URL, f"registry/{collection_name}"))
+
+    def _ensure(self) -> None:
+        if not self.qc.collection_exists(REGISTRY_COLLECTION):
+            # Records are only ever read by id; the vector is a placeholder.
+            self.qc.create_collection(name=REGISTRY_COLLECTION, vector_size=1)
+
+    def get(self, collection_name: str) -> dict | None:
+        if not self.qc.collection_exists(REGISTRY_COLLECTION):
+            return None
+        points = self.qc.client.retrieve(REGISTRY_COLLECTION, ids=[self.record_id(collection_name)], with_payload=True)
+        return points[0].payload if points else None
+
+    def _put(self, record: dict) -> None:
+        self._ensure()
+        record["updated_at"] = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        self.qc.upsert_points(collection=REGISTRY_COLLECTION, points=[
+            self.qc.make_point(point_id=self.record_id(record["collection"]), vector=[1.0], payload=record)
+        ])
+
+    def tag(self, collection_name: str, model_path: str, fingerprint: str | None = None) -> dict:
+        """Record that `collection_name` now holds vectors of the model at `model_path`."""
+        record = {
+            "collection": collection_name,
+            "model_path": model_path,
+            "fingerprint": fingerprint or model_fingerprint(model_path),
+            "reembed": None,
+        }
+        self._put(record)
+        return record
+
+    def ensure_tagged(self, collection_name: str, model_path: str) -> dict:
+        """
+        The record of `collection_name`, tagging it with `model_path` first
+        if it has none (collections created before the registry are assumed
+        to match the current model).
+        """
+        return self.get(collection_name) or self.tag(collection_name, model_path)
+
+    def set_progress(self, collection_name: str, progress: dict | None) -> None:
+        record = self.get(collection_name)
+        if record is not None:
+            record["reembed"] = progress
+            self._put(record)
+
+    def forget(self, collection_name: str) -> None:
+        if self.qc.collection_exists(REGISTRY_COLLECTION):
+            self.qc.delete_points(REGISTRY_COLLECTION, [self.record_id(collection_name)])
+
+    def records(self) -> list[dict]:
+        if not self.qc.collection_exists(REGISTRY_COLLECTION):
+            return []
+        records, offset = [], None
+        while True:
+            points, offset = self.qc.client.scroll(
+                REGISTRY_COLLECTION, limit=256, offset=offset, with_payload=True, with_vectors=False
+            )
+            records += [p.payload for p in points]
+            if offset is None:
+                return sorted(records, key=lambda r: r["collection"])
+
+    def status(self) -> list[dict]:
+        """Every registered collection with its current model fingerprint and whether it is stale."""
+        result = []
+        for record in self.records():
+            current = model_fingerprint(record["model_path"])
+            result.append({
+                **record,
+                "current_fingerprint": current,
+                "stale": current != record["fingerprint"],
+                "exists": self.qc.collection_exists(record["collection"]),
+            })
+        return result
@@ -1,4 +1,6 @@
 from __future__ import annotations
+import uuid
+from datetime import datetime, timezone
 from qdrant_client import QdrantClient, models
 from qdrant_client.http.models import (
     Distance,
@@ -6,8 +8,21 @@ from qdrant_client.http.models import (
     PointStruct,
     PointIdsList,
     Filter,           # optional for advanced search / delete
+    SparseVector,
+    SparseVectorParams,
 )
 
+# Name of the sparse lexical vector stored next to the (unnamed) dense one.
+SPARSE_VECTOR_NAME = "lexical"
+# Payload field that partitions a shared multi-tenant collection.
+TENANT_FIELD = "tenant"
+# RFC 3339 payload field that recency-weighted search decays on.
+TIMESTAMP_FIELD = "timestamp"
+# Payload field (the row of the point it was folded into) of a near-duplicate
+# dialogue line stored without a vector: never a search hit, but context
+# expansion still finds it by row.
+FOLDED_FIELD = "folded_into"
+
 class QdrantController:
     """
     Thin convenience layer around `qdrant_client.QdrantClient`
@@ -41,9 +56,18 @@ class QdrantController:
         name: str,
         vector_size: int,
         distance: str | Distance = "cosine",
+        sparse: bool = False,
+        multitenant: bool = False,
         **kwargs,
     ) -> None:
-        """Create a new collection (throws if it already exists)."""
+        """
+        Create a new collection (throws if it already exists).
+        With `sparse=True` the collection also holds a BM25-style sparse
+        vector (`SPARSE_VECTOR_NAME`, IDF applied server-side) for hybrid search.
+        With `multitenant=True` many datasets share the collection: `TENANT_FIELD`
+        gets a tenant keyword index and HNSW graphs are built per tenant
+        (`payload_m`) instead of one global graph (`m=0`).
+        """
         # if self.collection_exists(name):
         #     raise ValueError(f"Collection '{name}' already exists")
         # Accept both enum members and plain strings
@@ -52,16 +76,114 @@ class QdrantController:
             if isinstance(distance, Distance)
             else getattr(Distance, distance.upper())
         )
+        if sparse:
+            kwargs.setdefault("sparse_vectors_config", {
+                SPARSE_VECTOR_NAME: SparseVectorParams(modifier=models.Modifier.IDF)
+            })
+        if multitenant:
+            kwargs.setdefault("hnsw_config", models.HnswConfigDiff(payload_m=16, m=0))
         self.client.create_collection(                    # :contentReference[oaicite:0]{index=0}
             collection_name=name,
             vectors_config=VectorParams(size=vector_size, distance=metric),
             **kwargs,
         )
+        if multitenant:
+            self.client.create_payload_index(
+                collection_name=name,
+                field_name=TENANT_FIELD,
+                field_schema=models.KeywordIndexParams(
+                    type=models.KeywordIndexType.KEYWORD, is_tenant=True
+                ),
+            )
 
     def delete_collection(self, name: str, **kwargs) -> None:
         """Drop the collection and all its points."""
         self.client.delete_collection(collection_name=name, **kwargs)  # :contentReference[oaicite:1]{index=1}
 
+    # ---------- tenants -----------------------------------------------------
+
+    @staticmethod
+    def make_point_id(row: int, tenant: str | None = None) -> int | str:
+        """
+        Point id of data row `row`: the row itself, or within a shared
+        collection a UUID derived from (tenant, row), so ids never collide
+        across tenants and neighbouring rows can still be addressed directly.
+        """
+        if tenant is None:
+            return row
+        return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{tenant}/{row}"))
+
+    @staticmethod
+    def tenant_filter(tenant: str, query_filter: Filter | None = None) -> Filter:
+        """Restrict `query_filter` (if any) to the points of `tenant`."""
+        condition = models.FieldCondition(
+            key=TENANT_FIELD, match=models.MatchValue(value=tenant)
+        )
+        if query_filter is None:
+            return models.Filter(must=[condition])
+        return models.Filter(must=[condition, query_filter])
+
+    @staticmethod
+    def embedded_filter(query_filter: Filter | None = None) -> Filter:
+        """Restrict `query_filter` (if any) to points with a vector, i.e. not folded lines."""
+        condition = models.IsEmptyCondition(is_empty=models.PayloadField(key=FOLDED_FIELD))
+        if query_filter is None:
+            return models.Filter(must=[condition])
+        return models.Filter(must=[condition, query_filter])
+
+    def tenant_exists(self, collection: str, tenant: str) -> bool:
+        """Check if `tenant` has any point in `collection`."""
+        points, _ = self.client.scroll(
+            collection_name=collection,
+            scroll_filter=self.tenant_filter(tenant),
+            limit=1,
+            with_payload=False,
+            with_vectors=False,
+        )
+        return bool(points)
+
+    def delete_tenant(self, collection: str, tenant: str, wait: bool = True):
+        """Remove every point of `tenant` from a shared collection."""
+        return self.client.delete(
+            collection_name=collection,
+            points_selector=models.FilterSelector(filter=self.tenant_filter(tenant)),
+            wait=wait,
+        )
+
+    def ensure_row_index(self, collection: str) -> None:
+        """Index the `row` payload; ordering by a payload field needs it (a no-op if present)."""
+        self.client.create_payload_index(
+            collection_name=collection,
+            field_name="row",
+            field_schema=models.PayloadSchemaType.INTEGER,
+        )
+
+    def max_row(self, collection: str, tenant: str | None = None) -> int | None:
+        """Highest `row` payload in `collection` (within `tenant`), None if empty."""
+        self.ensure_row_index(collection)
+        points, _ = self.client.scroll(
+            collection_name=collection,
+            scroll_filter=self.tenant_filter(tenant) if tenant is not None else None,
+            order_by=models.OrderBy(key="row", direction=models.Direction.DESC),
+            limit=1,
+            with_payload=["row"],
+            with_vectors=False,
+        )
+        if points:
+            return points[0].payload["row"]
+        # Points written before rows were stored in the payload use the row as id.
+        best, offset = None, None
+        while True:
+            points, offset = self.client.scroll(
+                collection_name=collection, limit=1024, offset=offset,
+                with_payload=False, with_vectors=False,
+            )
+            rows = [p.id for p in points if isinstance(p.id, int)]
+            if rows:
+                best = max(rows + ([best] if best is not None else []))
+            if offset is None:
+                return best
+
     # ---------- points ------------------------------------------------------
 
     @staticmethod
@@ -69,8 +191,12 @@ class QdrantController:
         point_id: int | str,
         vector: list[float],
         payload: dict | None = None,
+        sparse_vector: SparseVector | None = None,
     ) -> PointStruct:
         """Helper to build a `PointStruct` in one line."""
+        if sparse_vector is not None:
+            # "" addresses the unnamed dense vector.
+            vector = {"": vector, SPARSE_VECTOR_NAME: sparse_vector}
         return PointStruct(id=point_id, vector=vector, payload=payload or {})
 
     def upsert_points(
@@ -124,6 +250,11 @@ class QdrantController:
         """Check if a collection exists."""
         return self.client.collection_exists(collection_name=collection)
     
+    def has_sparse_vectors(self, collection: str) -> bool:
+        """Check if `collection` was created with the sparse lexical vector."""
+        sparse_vectors = self.client.get_collection(collection).config.params.sparse_vectors
+        return bool(sparse_vectors) and SPARSE_VECTOR_NAME in sparse_vectors
+
     def get_points(
         self,
         collection: str,
@@ -156,8 +287,163 @@ class QdrantController:
             **kwargs,
         )
 
+    def hybrid_search(
+        self,
+        collection_name: str,
+        query_vector: list[float],
+        sparse_vector: SparseVector,
+        limit: int = 10,
+        query_filter: Filter | None = None,
+        prefetch_limit: int | None = None,
+        **kwargs,
+    ):
+        """
+        Dense + sparse search fused with reciprocal-rank fusion, server-side,
+        in a single request. Each branch contributes its `prefetch_limit`
+        best candidates (default `4 * limit`).
+        """
+        prefetch_limit = prefetch_limit or 4 * limit
+        if hasattr(query_vector, "tolist"):
+            query_vector = query_vector.tolist()
+        response = self.client.query_points(
+            collection_name=collection_name,
+            prefetch=[
+                models.Prefetch(query=query_vector, filter=query_filter, limit=prefetch_limit),
+                models.Prefetch(
+                    query=sparse_vector,
+                    using=SPARSE_VECTOR_NAME,
+                    filter=query_filter,
+                    limit=prefetch_limit,
+                ),
+            ],
+            query=models.FusionQuery(fusion=models.Fusion.RRF),
+            limit=limit,
+            **kwargs,
+        )
+        return response.points
+
+    def batch_search(
+        self,
+        collection_name: str,
+        query_vectors,
+        limit: int = 10,
+        query_filter: Filter | None = None,
+        sparse_vectors: list[SparseVector] | None = None,
+        prefetch_limit: int | None = None,
+        **kwargs,
+    ):
+        """
+        `search` (or, with `sparse_vectors`, `hybrid_search`) for many query
+        vectors in a single request. Returns one list of points per query.
+        """
+        prefetch_limit = prefetch_limit or 4 * limit
+        requests = []
+        for i, query_vector in enumerate(query_vectors):
+            if hasattr(query_vector, "tolist"):
+                query_vector = query_vector.tolist()
+            if sparse_vectors is None:
+                requests.append(models.QueryRequest(
+                    query=query_vector, filter=query_filter, limit=limit, with_payload=True,
+                ))
+                continue
+            requests.append(models.QueryRequest(
+                prefetch=[
+                    models.Prefetch(query=query_vector, filter=query_filter, limit=prefetch_limit),
+                    models.Prefetch(
+                        query=sparse_vectors[i],
+                        using=SPARSE_VECTOR_NAME,
+                        filter=query_filter,
+                        limit=prefetch_limit,
+                    ),
+                ],
+                query=models.FusionQuery(fusion=models.Fusion.RRF),
+                limit=limit,
+                with_payload=True,
+            ))
+        if not requests:
+            return []
+        responses = self.client.query_batch_points(collection_name=collection_name, requests=requests, **kwargs)
+        return [response.points for response in responses]
+
+    def recency_search(
+        self,
+        collection_name: str,
+        query_vector: list[float],
+        half_life_seconds: float,
+        weight: float = 0.3,
+        limit: int = 10,
+        query_filter: Filter | None = None,
+        sparse_vector: SparseVector | None = None,
+        prefetch_limit: int | None = None,
+        now: str | None = None,
+        **kwargs,
+    ):
+        """
+        Similarity search boosted by recency, scored server-side in one request:
+
+            score = similarity + weight * 0.5 ** (|now - timestamp| / half_life)
+
+        The `prefetch_limit` best candidates (default `4 * limit`) of the
+        dense search, or of the hybrid one when `sparse_vector` is given, are
+        rescored with this formula. `timestamp` is the RFC 3339 payload
+        written at index time; points without one get no boost. `now`
+        (RFC 3339) defaults to the current time.
+        """
+        prefetch_limit = prefetch_limit or 4 * limit
+        if hasattr(query_vector, "tolist"):
+            query_vector = query_vector.tolist()
+        if sparse_vector is None:
+            prefetch = models.Prefetch(query=query_vector, filter=query_filter, limit=prefetch_limit)
+        else:
+            prefetch = models.Prefetch(
+                prefetch=[
+                    models.Prefetch(query=query_vector, filter=query_filter, limit=prefetch_limit),
+                    models.Prefetch(
+                        query=sparse_vector,
+                        using=SPARSE_VECTOR_NAME,
+                        filter=query_filter,
+                        limit=prefetch_limit,
+                    ),
+                ],
+                query=models.FusionQuery(fusion=models.Fusion.RRF),
+                limit=prefetch_limit,
+            )
+        now = now or datetime.now(timezone.utc).isoformat()
+        decay = models.ExpDecayExpression(
+            exp_decay=models.DecayParamsExpression(
+                x=models.DatetimeKeyExpression(datetime_key=TIMESTAMP_FIELD),
+                target=models.DatetimeExpression(datetime=now),
+                scale=half_life_seconds,
+                midpoint=0.5,
+            )
+        )
+        response = self.client.query_points(
+            collection_name=collection_name,
+            prefetch=prefetch,
+            query=models.FormulaQuery(
+                formula=models.SumExpression(sum=["$score", models.MultExpression(mult=[weight, decay])]),
+                # Undated points decay from the epoch, i.e. get no boost.
+                defaults={TIMESTAMP_FIELD: "1970-01-01T00:00:00Z"},
+            ),
+            limit=limit,
+            **kwargs,
+        )
+        return response.points
+
     # ---------- delete points ----------------------------------------------
 
+    def update_dense_vectors(self, collection: str, ids: list[int | str], vectors, wait: bool = True):
+        """Replace the dense vector of existing points, keeping payload and sparse vector."""
+        named = self.has_sparse_vectors(collection)
+        return self.client.update_vectors(
+            collection_name=collection,
+            points=[
+                models.PointVectors(id=point_id, vector={"": list(vector)} if named else list(vector))
+                for point_id, vector in zip(ids, vectors)
+            ],
+            wait=wait,
+        )
+
     def delete_points(
         self,
         collection: str,
@@ -0,0 +1,236 @@
+"""
+Portable snapshots of an indexed collection.
+
+    python src/database/snapshot.py export --collection_name ironman --out snapshots/ironman --model_output_path trained_model/model
+    python src/database/snapshot.py import --snapshot snapshots/ironman --collection_name ironman
+
+A snapshot is a directory with
+  * `vectors.npy`: the dense vectors, a float32 `(count, dim)` array that is
+    written and read memory-mapped,
+  * `points.parquet`: one row per vector with the point id, the payload (as
+    JSON) and the sparse lexical vector, if any,
+    (a folded near-duplicate line has no vector: its row of `vectors.npy` is
+    zeros and it is imported without one again),
+  * `manifest.json`: count, dimension, distance, sparse config, the
+    embedding model fingerprint and the format version.
+Both directions stream in batches, so memory use does not grow with the
+collection and no model is ever loaded.
+"""
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import argparse
+import json
+from datetime import datetime, timezone
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from database.connector import QdrantConnector
+from database.qdrant_controller import QdrantController, FOLDED_FIELD, SPARSE_VECTOR_NAME
+from qdrant_client.http.models import SparseVector
+
+FORMAT_VERSION = 1
+VECTORS_FILE = "vectors.npy"
+POINTS_FILE = "points.parquet"
+MANIFEST_FILE = "manifest.json"
+
+_POINTS_SCHEMA = pa.schema([
+    ("id", pa.string()),  # JSON, so int and UUID ids round-trip
+    ("payload", pa.string()),
+    ("sparse_indices", pa.list_(pa.uint32())),
+    ("sparse_values", pa.list_(pa.float32())),
+])
+
+
+def export_collection(
+    qc: QdrantController,
+    collection_name: str,
+    out_dir: str,
+    model_fingerprint: str | None = None,
+    batch_size: int = 1024,
+    model_path: str | None = None,
+) -> dict:
+    """
+    Write `collection_name` to the snapshot directory `out_dir` and return
+    its manifest. Points written while the export runs may or may not be
+    included. The model fingerprint and path default to the collection's
+    `ModelRegistry` record.
+    """
+    from database.model_registry import ModelRegistry
+
+    record = ModelRegistry(qc).get(collection_name) or {}
+    model_fingerprint = model_fingerprint or record.get("fingerprint")
+    model_path = model_path or record.get("model_path")
+    info = qc.client.get_collection(collection_name)
+    params = info.config.params
+    dim = params.vectors.size
+    sparse = qc.has_sparse_vectors(collection_name)
+    expected = qc.client.count(collection_name, exact=True).count
+
+    os.makedirs(out_dir, exist_ok=True)
+    vectors = np.lib.format.open_memmap(
+        os.path.join(out_dir, VECTORS_FILE), mode="w+", dtype=np.float32, shape=(expected, dim)
+    )
+    written = 0
+    offset = None
+    with pq.ParquetWriter(os.path.join(out_dir, POINTS_FILE), _POINTS_SCHEMA) as writer:
+        while written < expected:
+            points, offset = qc.client.scroll(
+                collection_name=collection_name,
+                limit=min(batch_size, expected - written),
+                offset=offset,
+                with_payload=True,
+                with_vectors=True,
+            )
+            if not points:
+                break
+            dense, sparse_vectors = [], []
+            for point in points:
+                vector = point.vector
+                if isinstance(vector, dict):
+                    sparse_vectors.append(vector.get(SPARSE_VECTOR_NAME))
+                    vector = vector.get("", np.zeros(dim))
+                else:
+                    sparse_vectors.append(None)
+                dense.append(vector)
+            vectors[written:written + len(points)] = np.asarray(dense, dtype=np.float32)
+            writer.write_table(pa.table({
+                "id": [json.dumps(point.id) for point in points],
+                "payload": [json.dumps(point.payload, ensure_ascii=False, default=str) for point in points],
+                "sparse_indices": [s.indices if s is not None else None for s in sparse_vectors],
+                "sparse_values": [s.values if s is not None else None for s in sparse_vectors],
+            }, schema=_POINTS_SCHEMA))
+            written += len(points)
+            if offset is None:
+                break
+    vectors.flush()
+    del vectors
+    if written < expected:
+        # Points were deleted during the export: cut the array to size.
+        data = np.load(os.path.join(out_dir, VECTORS_FILE), mmap_mode="r")[:written].copy()
+        np.save(os.path.join(out_dir, VECTORS_FILE), data)
+
+    hnsw = info.config.hnsw_config
+    manifest = {
+        "format_version": FORMAT_VERSION,
+        "collection_name": collection_name,
+        "count": written,
+        "dim": dim,
+        "distance": params.vectors.distance.value,
+        "sparse": sparse,
+        "multitenant": bool(hnsw and hnsw.m == 0 and hnsw.payload_m),
+        "model_fingerprint": model_fingerprint,
+        "model_path": model_path,
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+    }
+    with open(os.path.join(out_dir, MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def read_manifest(snapshot_dir: str) -> dict:
+    with open(os.path.join(snapshot_dir, MANIFEST_FILE), "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("format_version") != FORMAT_VERSION:
+        raise ValueError(f"Unsupported snapshot format {manifest.get('format_version')} in {snapshot_dir}")
+    return manifest
+
+
+def import_snapshot(
+    qc: QdrantController,
+    snapshot_dir: str,
+    collection_name: str | None = None,
+    model_fingerprint: str | None = None,
+    batch_size: int = 1024,
+    model_path: str | None = None,
+) -> dict:
+    """
+    Bulk-load a snapshot into a new collection (default: the exported
+    collection's name) and return its manifest. With `model_fingerprint`,
+    refuse a snapshot embedded with a different model, since its vectors
+    would not be comparable to the queries.
+
+    The collection is tagged in the `ModelRegistry` with the snapshot's
+    fingerprint and `model_path` (default: the exported path), so that a
+    model later retrained at that path shows it as stale.
+    """
+    from database.model_registry import ModelRegistry
+
+    manifest = read_manifest(snapshot_dir)
+    if model_fingerprint is not None and manifest["model_fingerprint"] not in (None, model_fingerprint):
+        raise ValueError(
+            f"Snapshot was embedded with model {manifest['model_fingerprint']}, not {model_fingerprint}"
+        )
+    collection_name = collection_name or manifest["collection_name"]
+    if qc.collection_exists(collection_name):
+        raise ValueError(f"Collection '{collection_name}' already exists")
+    qc.create_collection(
+        name=collection_name,
+        vector_size=manifest["dim"],
+        distance=manifest["distance"],
+        sparse=manifest["sparse"],
+        multitenant=manifest["multitenant"],
+    )
+
+    vectors = np.load(os.path.join(snapshot_dir, VECTORS_FILE), mmap_mode="r")
+    start = 0
+    for batch in pq.ParquetFile(os.path.join(snapshot_dir, POINTS_FILE)).iter_batches(batch_size=batch_size):
+        rows = batch.to_pydict()
+        dense = vectors[start:start + batch.num_rows]
+        points = []
+        for n, (point_id, payload) in enumerate(zip(rows["id"], rows["payload"])):
+            indices = rows["sparse_indices"][n]
+            payload = json.loads(payload)
+            points.append(qc.make_point(
+                point_id=json.loads(point_id),
+                vector={} if FOLDED_FIELD in payload else dense[n].tolist(),
+                payload=payload,
+                sparse_vector=SparseVector(indices=indices, values=rows["sparse_values"][n])
+                if indices is not None else None,
+            ))
+        qc.upsert_points(collection=collection_name, points=points)
+        start += batch.num_rows
+    model_path = model_path or manifest.get("model_path")
+    if manifest["model_fingerprint"] and model_path:
+        ModelRegistry(qc).tag(collection_name, model_path, fingerprint=manifest["model_fingerprint"])
+    return manifest
+
+
+def argparser():
+    parser = argparse.ArgumentParser(description="Export or import a collection snapshot")
+    sub = parser.add_subparsers(dest="command", required=True)
+    export = sub.add_parser("export", help="Write a collection to a snapshot directory")
+    export.add_argument("--collection_name", type=str, required=True)
+    export.add_argument("--out", type=str, required=True, help="Snapshot directory")
+    export.add_argument("--model_output_path", type=str, default=None, help="Embedding model of the collection, for its fingerprint")
+    load = sub.add_parser("import", help="Load a snapshot into a new collection")
+    load.add_argument("--snapshot", type=str, required=True, help="Snapshot directory")
+    load.add_argument("--collection_name", type=str, default=None, help="Defaults to the exported collection's name")
+    load.add_argument("--model_output_path", type=str, default=None, help="Refuse snapshots made with another model; the collection is tagged with this path")
+    for command in (export, load):
+        command.add_argument("--qdrant_path", type=str, default=None, help="Use a local on-disk Qdrant instead of the server")
+        command.add_argument("--batch_size", type=int, default=1024)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    from file_util import resolve_model_path
+    from model_management.embedding_model_controller import model_fingerprint
+    args = argparser()
+    if args.qdrant_path:
+        from qdrant_client import QdrantClient
+        client = QdrantClient(path=args.qdrant_path)
+    else:
+        client = QdrantConnector().connect()
+    qc = QdrantController(client)
+    fingerprint = model_path = None
+    if args.model_output_path:
+        local_path = resolve_model_path(args.model_output_path)
+        model_path = local_path if os.path.isdir(local_path) else args.model_output_path
+        fingerprint = model_fingerprint(model_path)
+    if args.command == "export":
+        print(export_collection(qc, args.collection_name, args.out, model_fingerprint=fingerprint,
+                                batch_size=args.batch_size, model_path=model_path))
+    else:
+        print(import_snapshot(qc, args.snapshot, args.collection_name, model_fingerprint=fingerprint,
+                              batch_size=args.batch_size, model_path=model_path))
@@ -0,0 +1,123 @@
+"""
+Move a per-file collection into a shared multi-tenant collection.
+
+    python src/database/tenant_migration.py --source episode_1 --target transcripts
+
+Points keep their vectors and payload; they are re-keyed with
+`QdrantController.make_point_id` and tagged with the tenant (by default the
+source collection name), so the indexers and retrievers find them exactly
+as if the file had been indexed with `tenant=` in the first place.
+"""
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import argparse
+import logging
+from database.connector import QdrantConnector
+from database.qdrant_controller import QdrantController, SPARSE_VECTOR_NAME, TENANT_FIELD
+
+logger = logging.getLogger(__name__)
+
+
+def migrate_collection(
+    qc: QdrantController,
+    source: str,
+    target: str,
+    tenant: str | None = None,
+    batch_size: int = 256,
+    delete_source: bool = False,
+) -> int:
+    """
+    Copy every point of `source` into `target` as tenant `tenant` and return
+    the number of points copied. `target` is created (multi-tenant, with a
+    sparse vector) if it does not exist yet. The tenant's previous points in
+    `target`, if any, are replaced. `source` is dropped only with
+    `delete_source`, after the copy completed.
+
+    A new `target` takes over the `ModelRegistry` record of `source`; an
+    existing one must have been embedded with the same model.
+    """
+    from database.model_registry import ModelRegistry
+
+    tenant = tenant or source
+    registry = ModelRegistry(qc)
+    source_record, target_record = registry.get(source), registry.get(target)
+    if source_record and target_record and source_record["fingerprint"] != target_record["fingerprint"]:
+        raise ValueError(
+            f"'{source}' was embedded with model {source_record['fingerprint']}, "
+            f"'{target}' with {target_record['fingerprint']}"
+        )
+    params = qc.client.get_collection(source).config.params
+    if not qc.collection_exists(target):
+        qc.create_collection(
+            name=target,
+            vector_size=params.vectors.size,
+            distance=params.vectors.distance,
+            sparse=True,
+            multitenant=True,
+        )
+    elif qc.tenant_exists(target, tenant):
+        qc.delete_tenant(target, tenant)
+
+    copied = 0
+    offset = None
+    while True:
+        points, offset = qc.client.scroll(
+            collection_name=source,
+            limit=batch_size,
+            offset=offset,
+            with_payload=True,
+            with_vectors=True,
+        )
+        if points:
+            batch = []
+            for point in points:
+                payload = dict(point.payload or {})
+                row = payload.get("row", point.id)
+                payload.update({"row": row, TENANT_FIELD: tenant})
+                vector = point.vector
+                sparse_vector = None
+                if isinstance(vector, dict):
+                    sparse_vector = vector.get(SPARSE_VECTOR_NAME)
+                    vector = vector.get("", {})  # {}: a folded line without a vector
+                batch.append(qc.make_point(
+                    point_id=qc.make_point_id(row, tenant),
+                    vector=vector,
+                    payload=payload,
+                    sparse_vector=sparse_vector,
+                ))
+            qc.upsert_points(collection=target, points=batch)
+            copied += len(batch)
+        if offset is None:
+            break
+
+    if source_record and not target_record:
+        registry.tag(target, source_record["model_path"], fingerprint=source_record["fingerprint"])
+    logger.info(f"migrated {copied} points from '{source}' to '{target}' as tenant '{tenant}'")
+    if delete_source:
+        qc.delete_collection(source)
+        registry.forget(source)
+    return copied
+
+
+def argparser():
+    parser = argparse.ArgumentParser(description="Move a collection into a shared multi-tenant collection")
+    parser.add_argument("--source", type=str, required=True, help="Collection to migrate")
+    parser.add_argument("--target", type=str, required=True, help="Shared multi-tenant collection")
+    parser.add_argument("--tenant", type=str, default=None, help="Tenant name (defaults to the source collection name)")
+    parser.add_argument("--batch_size", type=int, default=256, help="Points copied per request")
+    parser.add_argument("--delete_source", action="store_true", help="Drop the source collection once copied")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = argparser()
+    qc = QdrantController(QdrantConnector().connect())
+    migrate_collection(
+        qc,
+        source=args.source,
+        target=args.target,
+        tenant=args.tenant,
+        batch_size=args.batch_size,
+        delete_source=args.delete_source,
+    )
@@ -1,6 +1,16 @@
+import json
 import os
+import re
+import uuid
 def resolve_model_path(path):
     # Always resolve relative to project root
     project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     abs_path = os.path.join(project_root, path) if not os.path.isabs(path) else path
     return abs_path
+
+def collection_file_stem(collection_name, tenant=None):
+    # File name for local state (logs, archives) of a collection or one of its
+    # tenants: readable, but derived from a UUID of (collection, tenant), so
+    # no two of them share a file and no name can leave its directory.
+    readable = re.sub(r"[^\w-]+", "_", collection_name)[:48]
+    return f"{readable}-{uuid.uuid5(uuid.NAMESPACE_URL, json.dumps([collection_name, tenant]))}"
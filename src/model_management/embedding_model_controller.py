@@ -1,8 +1,22 @@
+import hashlib
+import os
+from functools import lru_cache
 from sentence_transformers import SentenceTransformer
 
+
+@lru_cache(maxsize=4)
+def load_sentence_transformer(model_name: str, fingerprint: str | None = None) -> SentenceTransformer:
+    """
+    Load *model_name* once per process; later controllers share it.
+    *fingerprint* is only part of the cache key, so a model retrained in
+    place is loaded again.
+    """
+    return SentenceTransformer(model_name)
+
+
 class EmbeddingModelController:
     def __init__(self, model_name: str):
-        self.model = SentenceTransformer(model_name)
+        self.model = load_sentence_transformer(model_name, model_fingerprint(model_name))
 
     def embed(self, text: str|list[str]):
         """
@@ -17,3 +31,34 @@ class EmbeddingModelController:
         embeddings = self.model.encode(text)
         return embeddings
 
+
+_FINGERPRINTS: dict = {}
+
+
+def model_fingerprint(model_name: str) -> str:
+    """
+    Identify the exact weights behind *model_name*: a SHA-256 over the
+    relative paths and contents of a local model directory, or the hub id
+    for a model that is not on disk. Vectors are only comparable between
+    models with the same fingerprint.
+    """
+    if not os.path.isdir(model_name):
+        return f"hub:{model_name}"
+    files = []
+    for root, dirs, names in os.walk(model_name):
+        dirs.sort()
+        for name in sorted(names):
+            path = os.path.join(root, name)
+            stat = os.stat(path)
+            files.append((os.path.relpath(path, model_name), stat.st_size, stat.st_mtime_ns))
+    # Hashing weights takes seconds; only redo it when a file changed.
+    key = (os.path.abspath(model_name), tuple(files))
+    if key not in _FINGERPRINTS:
+        digest = hashlib.sha256()
+        for relpath, _, _ in files:
+            digest.update(relpath.encode("utf-8"))
+            with open(os.path.join(model_name, relpath), "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(block)
+        _FINGERPRINTS[key] = f"sha256:{digest.hexdigest()}"
+    return _FINGERPRINTS[key]
@@ -0,0 +1,116 @@
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from sentence_transformers import CrossEncoder
+
+DEFAULT_RERANKER_MODEL = "BAAI/bge-reranker-base"
+
+
+@lru_cache(maxsize=2)
+def load_cross_encoder(model_name: str) -> CrossEncoder:
+    """Load *model_name* once per process; later controllers share it."""
+    return CrossEncoder(model_name)
+
+
+class _ScoreCache:
+    """Thread-safe LRU of cross-encoder scores keyed by (model, query, passage)."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._scores: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            score = self._scores.get(key)
+            if score is not None:
+                self._scores.move_to_end(key)
+            return score
+
+    def put(self, key, score: float):
+        with self._lock:
+            self._scores[key] = score
+            self._scores.move_to_end(key)
+            while len(self._scores) > self.max_size:
+                self._scores.popitem(last=False)
+
+
+_SCORE_CACHE = _ScoreCache(max_size=50_000)
+
+# Seconds per scored pair of each model, learned from previous batches. Kept
+# per process: retrievers build a new controller for every request.
+_SECONDS_PER_PAIR: dict[str, float] = {}
+_SECONDS_PER_PAIR_LOCK = threading.Lock()
+
+
+class RerankerModelController:
+    """
+    Cross-encoder reranking under a latency budget.
+
+    Candidates are scored in batches, in the order given (i.e. best vector
+    match first). Before each batch the time it will take is estimated from
+    the model's throughput measured so far in this process; if it would not
+    fit in the remaining budget, the remaining candidates are left unscored
+    and dropped. Scores are cached per (query, passage), so repeated queries
+    only pay for new pairs.
+    """
+
+    def __init__(self, model_name: str = DEFAULT_RERANKER_MODEL, batch_size: int = 16):
+        self.model_name = model_name
+        self.model = load_cross_encoder(model_name)
+        self.batch_size = batch_size
+
+    def score(self, query: str, passages: list[str], budget_ms: float | None = None) -> list[float | None]:
+        """
+        Score every passage against *query*. Entries are None for passages
+        that were not scored because the budget ran out.
+        """
+        start = time.perf_counter()
+        scores: list[float | None] = [
+            _SCORE_CACHE.get((self.model_name, query, p)) for p in passages
+        ]
+        todo = [i for i, s in enumerate(scores) if s is None]
+
+        for offset in range(0, len(todo), self.batch_size):
+            batch = todo[offset:offset + self.batch_size]
+            seconds_per_pair = _SECONDS_PER_PAIR.get(self.model_name)
+            if budget_ms is not None and seconds_per_pair is not None:
+                elapsed = time.perf_counter() - start
+                if elapsed + seconds_per_pair * len(batch) > budget_ms / 1000:
+                    break
+
+            batch_start = time.perf_counter()
+            batch_scores = self.model.predict(
+                [(query, passages[i]) for i in batch],
+                batch_size=len(batch),
+                show_progress_bar=False,
+            )
+            per_pair = (time.perf_counter() - batch_start) / len(batch)
+            with _SECONDS_PER_PAIR_LOCK:
+                previous = _SECONDS_PER_PAIR.get(self.model_name)
+                _SECONDS_PER_PAIR[self.model_name] = (
+                    per_pair if previous is None else 0.7 * previous + 0.3 * per_pair
+                )
+            for i, s in zip(batch, batch_scores):
+                scores[i] = float(s)
+                _SCORE_CACHE.put((self.model_name, query, passages[i]), scores[i])
+        return scores
+
+    def rerank(
+        self,
+        query: str,
+        passages: list[str],
+        top_k: int,
+        budget_ms: float | None = None,
+    ) -> list[tuple[int, float | None]]:
+        """
+        Return up to *top_k* `(index, score)` pairs, best first. If nothing
+        could be scored within the budget, the original order is kept.
+        """
+        scores = self.score(query, passages, budget_ms=budget_ms)
+        scored = [(i, s) for i, s in enumerate(scores) if s is not None]
+        if not scored:
+            return [(i, None) for i in range(min(top_k, len(passages)))]
+        scored.sort(key=lambda item: item[1], reverse=True)
+        return scored[:top_k]
@@ -0,0 +1,81 @@
+import re
+import zlib
+from collections import Counter
+from qdrant_client.http.models import SparseVector
+
+# CJK ideographs (incl. extension A), kana and hangul are written without
+# spaces, so they are indexed as overlapping unigrams and bigrams. Anything
+# else that is alphanumeric is indexed as lower-cased words.
+_CJK = r"\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af"
+_TOKEN_PATTERN = re.compile(rf"[{_CJK}]+|[^\W_{_CJK}]+", re.UNICODE)
+_CJK_RUN = re.compile(rf"[{_CJK}]+")
+
+
+def lexical_tokens(text: str) -> list[str]:
+    """
+    CJK-aware lexical tokenization.
+
+    "Chitauri army" -> ["chitauri", "army"]
+    "混元珠"         -> ["混", "元", "珠", "混元", "元珠"]
+    """
+    tokens = []
+    for match in _TOKEN_PATTERN.findall(str(text).lower()):
+        if _CJK_RUN.fullmatch(match):
+            tokens.extend(match)
+            tokens.extend(match[i:i + 2] for i in range(len(match) - 1))
+        else:
+            tokens.append(match)
+    return tokens
+
+
+class SparseModelController:
+    """
+    BM25-style sparse lexical vectors for Qdrant.
+
+    Documents get the BM25 term-frequency component, queries get one unit
+    weight per distinct term. The IDF component is left to Qdrant (the sparse
+    vector is created with the IDF modifier), so the server-side dot product
+    is the BM25 score. Terms are hashed into the u32 index space, which needs
+    no vocabulary file and keeps indexing and querying consistent.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75, avg_doc_length: float | None = None):
+        self.k1 = k1
+        self.b = b
+        self.avg_doc_length = avg_doc_length
+
+    @staticmethod
+    def term_index(term: str) -> int:
+        return zlib.crc32(term.encode("utf-8"))
+
+    def _to_sparse(self, weights: dict[int, float]) -> SparseVector:
+        indices = sorted(weights)
+        return SparseVector(indices=indices, values=[weights[i] for i in indices])
+
+    def embed_documents(self, texts: list[str]) -> list[SparseVector]:
+        """
+        Embed documents for indexing.
+
+        The average document length is taken from the first batch embedded
+        (unless given up front) and reused afterwards, so documents indexed in
+        several batches are weighted consistently.
+        """
+        token_lists = [lexical_tokens(t) for t in texts]
+        if self.avg_doc_length is None:
+            total = sum(len(tokens) for tokens in token_lists)
+            self.avg_doc_length = max(total / max(len(token_lists), 1), 1.0)
+
+        vectors = []
+        for tokens in token_lists:
+            norm = self.k1 * (1 - self.b + self.b * len(tokens) / self.avg_doc_length)
+            weights: dict[int, float] = {}
+            for term, tf in Counter(tokens).items():
+                # Hash collisions simply add up, as a shared term would.
+                idx = self.term_index(term)
+                weights[idx] = weights.get(idx, 0.0) + tf * (self.k1 + 1) / (tf + norm)
+            vectors.append(self._to_sparse(weights))
+        return vectors
+
+    def embed_query(self, text: str) -> SparseVector:
+        """Embed a query: unit weight for every distinct term."""
+        return self._to_sparse({self.term_index(t): 1.0 for t in set(lexical_tokens(text))})
@@ -9,6 +9,19 @@ class Indexer(ABC):
     def index(self, *args, **kwargs):
         """Abstract method to index data."""
         raise NotImplementedError("Subclasses must implement this method.")
+
+    def delete(self, *, collection_name, tenant=None):
+        """Drop an index: the tenant's points of a shared collection, or the
+        whole collection when no tenant is given."""
+        from database.connector import QdrantConnector
+        from database.qdrant_controller import QdrantController
+        qc = QdrantController(QdrantConnector().connect())
+        if not qc.collection_exists(collection_name):
+            return
+        if tenant is None:
+            qc.delete_collection(collection_name)
+        else:
+            qc.delete_tenant(collection_name, tenant)
     
 
 class Retriever(ABC):
@@ -19,5 +32,13 @@ class Retriever(ABC):
     def retrieve(self, *args, **kwargs):
         """Abstract method to retrieve data."""
         raise NotImplementedError("Subclasses must implement this method.")
+
+    def rerank(self, query, results, passages, *, top_k, reranker_model, budget_ms=None):
+        """Reorder search *results* by cross-encoder score of their *passages*
+        and keep the best *top_k* (see `RerankerModelController`)."""
+        from model_management.reranker_model_controller import RerankerModelController
+        reranker = RerankerModelController(reranker_model)
+        order = reranker.rerank(query, passages, top_k=top_k, budget_ms=budget_ms)
+        return [results[i] for i, _ in order]
     
     
\ No newline at end of file
@@ -1,9 +1,24 @@
 import re
-from typing import Callable, List, Optional, Sequence
+import csv
+import io
+import heapq
+import itertools
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Sequence, Tuple
 from model_management.embedding_model_controller import EmbeddingModelController
+from tracing import span
 import numpy as np
+from pydantic import BaseModel, Field
 from tqdm import tqdm
 
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+
+
+class TextChunk(BaseModel):
+    text: str = Field(..., description="The chunk content.")
+    rows: List[int] = Field(default_factory=list, description="Zero-based data rows the chunk was built from.")
+    sources: List[Any] = Field(default_factory=list, description="The `source` value of each of those rows.")
+
+
 class NeibourSimilarityChunker:
     """
     
@@ -26,12 +41,15 @@ class NeibourSimilarityChunker:
     no more than *max_tokens* tokens - unless it can no longer be split.
 
     A pluggable *tokenizer* callback lets you swap in a model-specific tokenizer
-    (e.g., tiktoken). A very simple regex tokenizer is provided as default
-    fallback.
+    (e.g., tiktoken). With *use_model_tokenizer* the embedding model's own
+    (fast, batched) tokenizer is used so counts match what the model sees. A
+    very simple regex tokenizer is provided as default fallback.
     """
 
-    def __init__(self, embedding_model_name: str):
+    def __init__(self, embedding_model_name: str, *, use_model_tokenizer: bool = False):
         self.model_name = embedding_model_name
+        self.use_model_tokenizer = use_model_tokenizer
+        self._embedder: Optional[EmbeddingModelController] = None
 
     def detect_language(self, text: str) -> str:
         """Detect if the text is English or Chinese (very basic heuristic)."""
@@ -49,174 +67,400 @@ class NeibourSimilarityChunker:
         Splits on words and standalone punctuation characters. You can replace this
         with ``tiktoken.encoding_for_model(<model>).encode`` for exact counts.
         """
-        return re.findall(r"\w+|[^\w\s]", text, re.UNICODE)
+        return _TOKEN_PATTERN.findall(text)
     
-    def cosine_similarity_matrix(self, emb: np.ndarray) -> np.ndarray:
-        """Fully-vectorised cosine similarity matrix (diagonal == 1)."""
+    def normalize_embeddings(self, emb: np.ndarray) -> np.ndarray:
+        """Row-normalise *emb* so that dot products are cosine similarities."""
+        emb = np.asarray(emb, dtype=np.float64)
         norm = np.linalg.norm(emb, axis=1, keepdims=True)
         norm[norm == 0] = 1e-9  # avoid divide-by-zero
-        emb_norm = emb / norm
-        
+        return emb / norm
+
+    def cosine_similarity_matrix(self, emb: np.ndarray) -> np.ndarray:
+        """Fully-vectorised cosine similarity matrix (diagonal == 1)."""
+        emb_norm = self.normalize_embeddings(emb)
         return emb_norm @ emb_norm.T
 
+    @property
+    def embedder(self) -> EmbeddingModelController:
+        """Embedding model, loaded on first use and reused afterwards."""
+        if self._embedder is None:
+            self._embedder = EmbeddingModelController(model_name=self.model_name)
+        return self._embedder
+
+    @span("chunk_by_similarity")
     def chunk_by_similarity(
         self,
         chunks: Sequence[str],
         *,
         similarity_threshold: float = 0.85,
-    ) -> List[List[str]]:
-        
-
+        embeddings: Optional[np.ndarray] = None,
+    ) -> Tuple[List[List[str]], List[List[int]]]:
         """Order-preserving agglomerative clustering that always merges the most
         similar **adjacent** pair first.
 
+        The similarity of two clusters is the mean pairwise cosine similarity
+        of their members. Because that mean equals the dot product of the
+        clusters' summed unit vectors divided by ``|a| * |b|``, each cluster
+        only carries a running vector sum; candidate adjacent pairs live in a
+        max-heap and entries made stale by a merge are skipped when popped.
+        This runs in ``O(n log n)`` and never builds the ``n x n`` matrix.
+
         Parameters
         ----------
         chunks:
             List of text chunks (from :func:`chunk_text`).
         similarity_threshold:
             Minimum cosine similarity required to merge.
-        embedder:
-            Function mapping *chunks* → ``(n_chunks, dim)`` embedding matrix.
-        """
-        if not chunks:
-            return []
-        
-        
+        embeddings:
+            Optional precomputed ``(n_chunks, dim)`` embedding matrix. When
+            omitted, *chunks* are embedded with the chunker's model.
 
+        Returns
+        -------
+        Tuple[List[List[str]], List[List[int]]]
+            The text clusters and, for each, the original chunk indices it covers.
+        """
         n = len(chunks)
         if n == 0:
-            return []
+            return [], []
         if n == 1:
-            return [[chunks[0]]]
-
-        # Compute embeddings and similarity matrix once at singleton level.
-        embedder = EmbeddingModelController(model_name=self.model_name)
-        embeddings = embedder.embed(chunks)
-        sim_mat = self.cosine_similarity_matrix(embeddings)
-
-        # Each cluster is a list of *original* indices it covers.
-        clusters: List[List[int]] = [[i] for i in range(n)]
-
-        def _mean_similarity(a: Sequence[int], b: Sequence[int]) -> float:
-            sims = [sim_mat[i, j] for i in a for j in b]
-            return float(sum(sims) / len(sims)) if sims else -1.0
-
-        while True:
-            best_sim = -1.0
-            best_i = -1
-
-            # Scan current neighbour list for the strongest similarity.
-            for i in range(len(clusters) - 1):
-                sim = _mean_similarity(clusters[i], clusters[i + 1])
-                if sim > best_sim:
-                    best_sim = sim
-                    best_i = i
+            return [[chunks[0]]], [[0]]
+
+        if embeddings is None:
+            embeddings = self.embedder.embed(list(chunks))
+        unit = self.normalize_embeddings(embeddings)
+
+        # Clusters are contiguous runs of chunks, identified by their first
+        # index. A doubly linked list over those ids tracks adjacency.
+        sums = unit.copy()
+        sizes = np.ones(n)
+        nxt = list(range(1, n)) + [-1]
+        prv = [-1] + list(range(n - 1))
+        # Bumped on every merge so heap entries can detect they are stale;
+        # -1 marks a cluster that has been absorbed by its left neighbour.
+        version = [0] * n
+
+        def _mean_similarity(a: int, b: int) -> float:
+            return float(sums[a] @ sums[b]) / (sizes[a] * sizes[b])
+
+        def _entry(a: int, b: int) -> tuple:
+            # Ties resolve to the leftmost pair, as a linear scan would.
+            return (-_mean_similarity(a, b), a, b, version[a], version[b])
+
+        heap = [_entry(i, i + 1) for i in range(n - 1)]
+        heapq.heapify(heap)
+
+        while heap:
+            neg_sim, left, right, left_version, right_version = heapq.heappop(heap)
+            if (
+                version[left] != left_version
+                or version[right] != right_version
+                or nxt[left] != right
+            ):
+                continue
 
             # Stop if nothing meets the threshold.
-            if best_sim < similarity_threshold or best_i == -1:
+            if -neg_sim < similarity_threshold:
                 break
 
             # Merge the best pair and continue.
-            merged_cluster = clusters[best_i] + clusters[best_i + 1]
-            clusters[best_i : best_i + 2] = [merged_cluster]
+            sums[left] += sums[right]
+            sizes[left] += sizes[right]
+            version[left] += 1
+            version[right] = -1
+            nxt[left] = nxt[right]
+            if nxt[left] != -1:
+                prv[nxt[left]] = left
+                heapq.heappush(heap, _entry(left, nxt[left]))
+            if prv[left] != -1:
+                heapq.heappush(heap, _entry(prv[left], left))
 
         # Resolve index clusters back to text clusters in original order.
+        clusters: List[List[int]] = []
+        start = 0
+        while start != -1:
+            end = nxt[start] if nxt[start] != -1 else n
+            clusters.append(list(range(start, end)))
+            start = nxt[start]
         return [[chunks[idx] for idx in cluster] for cluster in clusters], clusters
-        
-    def chunk_text(
+
+    @span("count_tokens")
+    def count_tokens(
         self,
-        text: str,
-        max_tokens: int = 150,
-        *,
+        texts: Sequence[str],
         tokenizer: Optional[Callable[[str], List[str]]] = None,
-    ) -> List[str]:
-        """Chunk *text* into semantically coherent pieces ≤ *max_tokens*.
-
-        The splitting strategy follows these steps in order, only advancing to the
-        next delimiter when a chunk still exceeds *max_tokens*:
-
-        1. Double new line ("\n\n")
-        2. Single new line ("\n")
-        3. Period (".")
-        4. Comma (",")
+    ) -> List[int]:
+        """Return the token count of every text in *texts*.
 
-        Parameters
-        ----------
-        text:
-            The input text (structured or unstructured).
-        max_tokens:
-            Maximum allowed tokens in each chunk (default 150).
-        tokenizer:
-            Optional callable that returns a list of tokens. Defaults to
-            :func:`default_tokenizer`.
-
-        Returns
-        -------
-        List[str]
-            A list of chunks, each no longer than *max_tokens* tokens.
+        A custom *tokenizer* is called once per text. Without one, the
+        embedding model's fast tokenizer encodes the whole batch in a single
+        call when *use_model_tokenizer* is set, and the regex tokenizer is
+        used otherwise.
         """
-        if tokenizer is None:
-            tokenizer = self.default_tokenizer
-        language = self.detect_language(text)
+        if not texts:
+            return []
+        if tokenizer is not None:
+            return [len(tokenizer(t)) for t in texts]
+        if self.use_model_tokenizer:
+            encoded = self.embedder.model.tokenizer(
+                list(texts),
+                add_special_tokens=False,
+                return_attention_mask=False,
+                return_token_type_ids=False,
+                verbose=False,
+            )
+            return [len(ids) for ids in encoded["input_ids"]]
+        return [len(_TOKEN_PATTERN.findall(t)) for t in texts]
+
+    def delimiters_for(self, language: str) -> List[str]:
+        """Split delimiters, coarsest first, for *language*."""
         if language == "chinese":
-            delimiters = ["\n\n", "\n", "。", "，"]
-        elif language == "english":
-            
-            delimiters = ["\n\n", "\n", ".", ","]
-        
-
-        def _split(segment: str, level: int) -> List[str]:
-            """Recursively split *segment* starting at *level* delimiter."""
+            return ["\n\n", "\n", "。", "，"]
+        return ["\n\n", "\n", ".", ","]
+
+    def _splitter(
+        self,
+        delimiters: List[str],
+        max_tokens: int,
+        tokenizer: Optional[Callable[[str], List[str]]] = None,
+    ) -> Callable[[str, int, int], List[Tuple[str, int]]]:
+        """Build the recursive splitter shared by :func:`chunk_text` and
+        :func:`stream_chunks`."""
+        delimiter_counts = self.count_tokens(delimiters, tokenizer)
+
+        def _split(segment: str, level: int, n_tokens: int) -> List[Tuple[str, int]]:
+            """Recursively split *segment* (of *n_tokens* tokens) starting at
+            *level* delimiter. Returns ``(chunk, token_count)`` pairs."""
             if level >= len(delimiters):
                 # No more delimiters; return as is to preserve integrity.
-                return [segment.strip()]
+                return [(segment.strip(), n_tokens)]
 
             # If the current segment already satisfies the limit, keep it whole.
-            if len(tokenizer(segment)) <= max_tokens:
-                return [segment.strip()]
+            if n_tokens <= max_tokens:
+                return [(segment.strip(), n_tokens)]
 
             delim = delimiters[level]
             parts = segment.split(delim)
+            part_counts = self.count_tokens(parts, tokenizer)
+            # Pieces are re-joined with a space above sentence level, where
+            # the delimiter itself is dropped.
+            joiner = " " if level < 2 else ""
 
-            chunks: List[str] = []
+            chunks: List[Tuple[str, int]] = []
             buffer = ""
+            buffer_count = 0
             # Re-assemble greedily while respecting the limit.
-            for i, part in enumerate(parts):
+            for i, (part, part_count) in enumerate(zip(parts, part_counts)):
                 # Restore the delimiter we split on *except* for double‐newline to
                 # keep paragraphs intact.
                 append_delim = delim if level >= 2 and i < len(parts) - 1 else ""
+                unit_count = part_count + (delimiter_counts[level] if append_delim else 0)
                 candidate = (buffer + part + append_delim).strip()
 
                 if not candidate:
                     continue
 
-                if len(tokenizer(candidate)) > max_tokens:
+                if buffer_count + unit_count > max_tokens:
                     # The candidate is too large. Finalize current buffer and recurse.
                     if buffer:
-                        chunks.extend(_split(buffer.strip(), level + 1))
-                        buffer = part + append_delim
+                        chunks.extend(_split(buffer.strip(), level + 1, buffer_count))
+                        buffer = part + append_delim + joiner
+                        buffer_count = unit_count
                     else:
                         # Single unit bigger than limit; try deeper splitting.
-                        chunks.extend(_split(part + append_delim, level + 1))
+                        chunks.extend(_split(part + append_delim, level + 1, unit_count))
                         buffer = ""
+                        buffer_count = 0
                 else:
-                    buffer = candidate + (" " if level < 2 else "")
+                    buffer = candidate + joiner
+                    buffer_count += unit_count
 
-            if buffer:
-                chunks.append(buffer.strip())
+            if buffer.strip():
+                chunks.append((buffer.strip(), buffer_count))
 
             # Post-process in case nested chunks are still oversized.
-            refined: List[str] = []
-            for ch in chunks:
-                refined.extend(_split(ch, level + 1))
+            refined: List[Tuple[str, int]] = []
+            for ch, ch_count in chunks:
+                refined.extend(_split(ch, level + 1, ch_count))
             return refined
 
+        return _split
+
+    @span("chunk_text")
+    def chunk_text(
+        self,
+        text: str,
+        max_tokens: int = 150,
+        *,
+        tokenizer: Optional[Callable[[str], List[str]]] = None,
+    ) -> List[str]:
+        """Chunk *text* into semantically coherent pieces ≤ *max_tokens*.
+
+        The splitting strategy follows these steps in order, only advancing to the
+        next delimiter when a chunk still exceeds *max_tokens*:
+
+        1. Double new line ("\n\n")
+        2. Single new line ("\n")
+        3. Period (".")
+        4. Comma (",")
+
+        Every piece is tokenized once, when its parent segment is split, and
+        the greedy re-assembly tracks running token counts instead of
+        re-tokenizing the growing buffer, so the cost is linear in the length
+        of *text*.
+
+        Parameters
+        ----------
+        text:
+            The input text (structured or unstructured).
+        max_tokens:
+            Maximum allowed tokens in each chunk (default 150).
+        tokenizer:
+            Optional callable that returns a list of tokens. Defaults to the
+            embedding model's tokenizer when the chunker was created with
+            *use_model_tokenizer*, and to :func:`default_tokenizer` otherwise.
+
+        Returns
+        -------
+        List[str]
+            A list of chunks, each no longer than *max_tokens* tokens.
+        """
+        language = self.detect_language(text)
+        _split = self._splitter(self.delimiters_for(language), max_tokens, tokenizer)
+
         # Normalize Windows line endings for consistency.
         normalized = text.replace("\r\n", "\n")
-        return [c for c in _split(normalized, 0) if c]
+        (n_tokens,) = self.count_tokens([normalized], tokenizer)
+        return [c for c, _ in _split(normalized, 0, n_tokens) if c]
 
 
+    def iter_rows(self, file_path: str) -> Iterator[Tuple[str, Any]]:
+        """Yield ``(line, source)`` for every data row of *file_path*.
+
+        CSV files are parsed row by row, so quoted fields may span lines, and
+        each row is re-serialised as a single CSV line. The ``source`` column
+        is carried along when the header has one. Other files yield one row
+        per line with no source.
+        """
+        with open(file_path, "r", encoding="utf-8", newline="") as f:
+            if not file_path.endswith(".csv"):
+                for line in f:
+                    yield line.rstrip("\r\n"), None
+                return
+
+            reader = csv.reader(f)
+            header = next(reader, None) or []
+            source_col = header.index("source") if "source" in header else None
+            out = io.StringIO()
+            writer = csv.writer(out, lineterminator="")
+            for row in reader:
+                out.seek(0)
+                out.truncate()
+                writer.writerow(row)
+                source = row[source_col] if source_col is not None and source_col < len(row) else None
+                yield out.getvalue(), source
+
+    def stream_chunks(
+        self,
+        rows: Iterable[Tuple[str, Any]],
+        max_tokens: int = 150,
+        *,
+        tokenizer: Optional[Callable[[str], List[str]]] = None,
+        batch_size: int = 256,
+        language_sample_chars: int = 65536,
+    ) -> Iterator[TextChunk]:
+        """Incrementally chunk ``(line, source)`` *rows*, e.g. from :func:`iter_rows`.
+
+        Chunk boundaries follow :func:`chunk_text`. Blank rows separate
+        paragraphs (the "\n\n" level): whole paragraphs are packed greedily
+        into chunks of at most *max_tokens* tokens, and a paragraph that does
+        not fit in one chunk is packed row by row (the "\n" level). A CSV
+        file without blank rows is a single paragraph, i.e. its rows are
+        packed. A row that alone exceeds the limit is split further at
+        sentence and comma level; every piece keeps that row's index and
+        source. Each chunk is yielded as soon as it is complete.
+
+        Only a bounded amount of input is held in memory: the language is
+        detected on the first *language_sample_chars* characters, rows are
+        tokenized in batches of *batch_size*, and at most *max_tokens* tokens
+        of a paragraph are buffered.
+        """
+        numbered = enumerate(rows)
+        head: List[Tuple[int, Tuple[str, Any]]] = []
+        sampled = 0
+        for item in numbered:
+            head.append(item)
+            sampled += len(item[1][0])
+            if sampled >= language_sample_chars:
+                break
+        language = self.detect_language("\n".join(line for _, (line, _) in head))
+        _split = self._splitter(self.delimiters_for(language), max_tokens, tokenizer)
+
+        def as_chunk(units: List[Tuple[str, int, Any]]) -> TextChunk:
+            return TextChunk(
+                text=" ".join(line for line, _, _ in units),
+                rows=[row for _, row, _ in units],
+                sources=[source for _, _, source in units],
+            )
+
+        # (line, row, source) units of the whole paragraphs packed so far,
+        # and of the paragraph being read.
+        packed: List[Tuple[str, int, Any]] = []
+        packed_count = 0
+        paragraph: List[Tuple[str, int, Any]] = []
+        paragraph_count = 0
+        # Set once the paragraph is too long to keep whole: its rows are
+        # then packed into chunks of their own.
+        by_row = False
+
+        def end_paragraph() -> Iterator[TextChunk]:
+            nonlocal packed, packed_count, paragraph, paragraph_count, by_row
+            if by_row:
+                if paragraph:
+                    yield as_chunk(paragraph)
+            elif paragraph:
+                if packed and packed_count + paragraph_count > max_tokens:
+                    yield as_chunk(packed)
+                    packed, packed_count = [], 0
+                packed += paragraph
+                packed_count += paragraph_count
+            paragraph, paragraph_count, by_row = [], 0, False
+
+        pending = itertools.chain(head, numbered)
+        while True:
+            batch = list(itertools.islice(pending, batch_size))
+            if not batch:
+                break
+            counts = self.count_tokens([line for _, (line, _) in batch], tokenizer)
+            for (row, (line, source)), n_tokens in zip(batch, counts):
+                line = line.strip()
+                if not line:
+                    yield from end_paragraph()
+                    continue
+                if not by_row and paragraph_count + n_tokens > max_tokens:
+                    # The paragraph cannot stay whole: close the chunk before it.
+                    by_row = True
+                    if packed:
+                        yield as_chunk(packed)
+                        packed, packed_count = [], 0
+                if by_row:
+                    if paragraph and paragraph_count + n_tokens > max_tokens:
+                        yield as_chunk(paragraph)
+                        paragraph, paragraph_count = [], 0
+                    if n_tokens > max_tokens:
+                        # Single row bigger than limit; split below line level.
+                        for piece, _ in _split(line, 2, n_tokens):
+                            if piece:
+                                yield TextChunk(text=piece, rows=[row], sources=[source])
+                        continue
+                paragraph.append((line, row, source))
+                paragraph_count += n_tokens
+
+        yield from end_paragraph()
+        if packed:
+            yield as_chunk(packed)
+
     # -----------------------------------------------------------------------------
     # Example usage
     # -----------------------------------------------------------------------------
@@ -230,7 +474,7 @@ if __name__ == "__main__":
     for i, ch in enumerate(chunks, 1):
         print(f"--- Chunk {i} ({len(chunker.default_tokenizer(ch))} tokens) ---")
         print(ch)
-    clusters = chunker.chunk_by_similarity(chunks,  similarity_threshold=0.5)
+    clusters, _ = chunker.chunk_by_similarity(chunks,  similarity_threshold=0.5)
     print("\nClusters after neighbour-mering (threshold=0.7):", len(clusters))
     for i, cluster in enumerate(clusters, 1):
         print(f"--- Cluster {i} ---")
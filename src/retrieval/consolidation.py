@@ -0,0 +1,326 @@
+"""
+Background consolidation of a lifelong memory collection.
+
+    python src/retrieval/consolidation.py --collection_name memories --model_output_path trained_model/model
+"""
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import argparse
+import json
+import logging
+import statistics
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+import numpy as np
+from qdrant_client import models
+from database.connector import QdrantConnector
+from database.qdrant_controller import FOLDED_FIELD, TENANT_FIELD, TIMESTAMP_FIELD
+from file_util import collection_file_stem, resolve_model_path
+from model_management.embedding_model_controller import EmbeddingModelController
+from model_management.sparse_model_controller import SparseModelController
+from retrieval.chunking_strategies.neighbour_sim import NeibourSimilarityChunker
+from retrieval.model_calling import ModelContext
+from retrieval.structured_csv_retrieve import StructuredQdrantController
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ARCHIVE_DIR = os.environ.get("MEMORY_ARCHIVE_DIR", resolve_model_path("memory_archive"))
+
+
+def summarize_turns(model: ModelContext, turns: list[str]) -> str:
+    """Ask *model* for one memory that preserves the facts of *turns*."""
+    model.clear_history()
+    dialogue = "\n".join(turns)
+    model.add_user_message(
+        messages=f"""Here is a stretch of conversation
+            <dialogue>
+            {dialogue}
+            </dialogue>
+            Rewrite it as one short memory in the language of the dialogue. Keep every name, date, number and fact someone could ask about later. Answer only with the memory and nothing else.
+        """)
+    return model.call_model()
+
+
+class MemoryConsolidator:
+    """
+    Bound the growth of a naive_csv-style memory collection.
+
+    Turns older than `min_age_days` (by their `timestamp` payload) are
+    walked in row order, `batch_size` at a time, and grouped with the
+    adjacent-similarity clustering of `NeibourSimilarityChunker` on their
+    stored vectors. Every cluster of at least `min_cluster_size` turns is
+    summarised by the LLM into a single memory point that takes the place of
+    the cluster's first row; the other turns, and the near-duplicates folded
+    into any of them, are deleted. The summary keeps the `source` of every
+    turn it summarises in `consolidated_sources`, and the raw turns and
+    folded lines (payload and vector) are appended to a JSONL archive before
+    anything is deleted.
+
+    Progress (the next row to look at) is saved next to the archive, so each
+    run only looks at turns that are new since the last one. Runs sleep
+    `pause_seconds` between batches to leave Qdrant to the foreground.
+    """
+
+    def __init__(
+        self,
+        collection_name: str,
+        embedding_model_path: str,
+        tenant: str | None = None,
+        summary_model: str = "gpt-4.1-nano",
+        min_age_days: float = 30,
+        similarity_threshold: float = 0.8,
+        min_cluster_size: int = 3,
+        batch_size: int = 256,
+        pause_seconds: float = 0.5,
+        archive_dir: str | None = None,
+    ):
+        self.collection_name = collection_name
+        self.tenant = tenant
+        self.min_age_days = min_age_days
+        self.similarity_threshold = similarity_threshold
+        self.min_cluster_size = min_cluster_size
+        self.batch_size = batch_size
+        self.pause_seconds = pause_seconds
+        self.qc = StructuredQdrantController(QdrantConnector().connect())
+        self.embedding_model = EmbeddingModelController(model_name=embedding_model_path)
+        self.model = ModelContext(model_name=summary_model)
+        # Clustering runs on the stored vectors, so the chunker never loads a model.
+        self.chunker = NeibourSimilarityChunker(embedding_model_name=embedding_model_path)
+
+        archive_dir = archive_dir or DEFAULT_ARCHIVE_DIR
+        os.makedirs(archive_dir, exist_ok=True)
+        # One archive and cursor per (collection, tenant), as for memory logs.
+        name = collection_file_stem(collection_name, tenant)
+        self.archive_path = os.path.join(archive_dir, f"{name}.jsonl")
+        self.state_path = os.path.join(archive_dir, f"{name}.state.json")
+
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    # ---------- state -------------------------------------------------------
+
+    def _next_row(self) -> int:
+        if not os.path.exists(self.state_path):
+            return 0
+        with open(self.state_path, "r", encoding="utf-8") as f:
+            return json.load(f)["next_row"]
+
+    def _save_next_row(self, row: int) -> None:
+        with open(self.state_path, "w", encoding="utf-8") as f:
+            json.dump({"next_row": row}, f)
+
+    # ---------- measuring ---------------------------------------------------
+
+    def _count(self) -> int:
+        count_filter = self.qc.tenant_filter(self.tenant) if self.tenant is not None else None
+        return self.qc.client.count(self.collection_name, count_filter=count_filter, exact=True).count
+
+    def _probe_vectors(self, n: int = 8) -> list:
+        points, _ = self.qc.client.scroll(
+            collection_name=self.collection_name,
+            scroll_filter=self.qc.embedded_filter(
+                self.qc.tenant_filter(self.tenant) if self.tenant is not None else None
+            ),
+            limit=n,
+            with_payload=False,
+            with_vectors=True,
+        )
+        return [self._dense(p.vector) for p in points]
+
+    def _search_latency_ms(self, probes: list, top_k: int = 20) -> float | None:
+        if not probes:
+            return None
+        timings = []
+        for vector in probes:
+            start = time.perf_counter()
+            self.qc.search(collection_name=self.collection_name, query_vector=vector, limit=top_k)
+            timings.append((time.perf_counter() - start) * 1000)
+        return statistics.median(timings)
+
+    @staticmethod
+    def _dense(vector):
+        # A folded near-duplicate has no vector ({}).
+        return vector.get("") if isinstance(vector, dict) else vector
+
+    # ---------- consolidation ----------------------------------------------
+
+    def _old_turns_filter(self, next_row: int) -> models.Filter:
+        cutoff = datetime.now(timezone.utc) - timedelta(days=self.min_age_days)
+        must = [
+            models.FieldCondition(key=TIMESTAMP_FIELD, range=models.DatetimeRange(lt=cutoff)),
+            models.FieldCondition(key="row", range=models.Range(gte=next_row)),
+            # Folded near-duplicates have no vector; their representative stands for them.
+            models.IsEmptyCondition(is_empty=models.PayloadField(key=FOLDED_FIELD)),
+        ]
+        if self.tenant is not None:
+            must.append(models.FieldCondition(key=TENANT_FIELD, match=models.MatchValue(value=self.tenant)))
+        return models.Filter(
+            must=must,
+            # Summaries are not consolidated again.
+            must_not=[models.FieldCondition(key="kind", match=models.MatchValue(value="summary"))],
+        )
+
+    def _folded_into(self, rows: list[int]) -> list:
+        """The folded near-duplicates (points without a vector) of `rows`."""
+        must = [models.FieldCondition(key=FOLDED_FIELD, match=models.MatchAny(any=rows))]
+        if self.tenant is not None:
+            must.append(models.FieldCondition(key=TENANT_FIELD, match=models.MatchValue(value=self.tenant)))
+        folded, offset = [], None
+        while True:
+            points, offset = self.qc.client.scroll(
+                collection_name=self.collection_name,
+                scroll_filter=models.Filter(must=must),
+                limit=self.batch_size,
+                offset=offset,
+                with_payload=True,
+                with_vectors=True,
+            )
+            folded += points
+            if offset is None:
+                return folded
+
+    def _consolidate(self, points) -> None:
+        payloads = [p.payload for p in points]
+        summary = summarize_turns(self.model, [f"[{p.get('time', '')}] {p['text']}" for p in payloads])
+        first = payloads[0]
+        # Only the summarised turns: folded duplicates of them may come from
+        # anywhere in the dialogue, so they are archived, not claimed.
+        sources = [p.get("source", "") for p in payloads]
+        folded = self._folded_into([p["row"] for p in payloads])
+        payload = {
+            "text": summary,
+            "talker": ", ".join(dict.fromkeys(str(p.get("talker", "")) for p in payloads)),
+            "time": first.get("time", ""),
+            "source": first.get("source", ""),
+            "row": first["row"],
+            "kind": "summary",
+            "consolidated_sources": sources,
+            "consolidated_rows": [p["row"] for p in payloads],
+            # The newest turn decides how recent the memory is.
+            TIMESTAMP_FIELD: max(p[TIMESTAMP_FIELD] for p in payloads),
+        }
+        if self.tenant is not None:
+            payload[TENANT_FIELD] = self.tenant
+        sparse_vector = None
+        if self.qc.has_sparse_vectors(self.collection_name):
+            sparse_vector = SparseModelController().embed_documents([summary])[0]
+
+        # Archive first: a crash after this point loses nothing.
+        with open(self.archive_path, "a", encoding="utf-8") as f:
+            for p in points + folded:
+                f.write(json.dumps(
+                    {"id": p.id, "payload": p.payload, "vector": self._dense(p.vector)},
+                    ensure_ascii=False, default=str,
+                ) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.qc.upsert_points(collection=self.collection_name, points=[self.qc.make_point(
+            point_id=points[0].id,
+            vector=np.asarray(self.embedding_model.embed(summary)).tolist(),
+            payload=payload,
+            sparse_vector=sparse_vector,
+        )])
+        self.qc.delete_points(self.collection_name, [p.id for p in points[1:] + folded])
+
+    def run_once(self) -> dict:
+        """
+        Consolidate every old, dense cluster found since the last run and
+        report the collection size and median search latency before and
+        after, in a dict.
+        """
+        if not self.qc.collection_exists(self.collection_name):
+            return {}
+        probes = self._probe_vectors()
+        report = {
+            "points_before": self._count(),
+            "latency_ms_before": self._search_latency_ms(probes),
+            "clusters": 0,
+            "turns_consolidated": 0,
+        }
+        next_row = self._next_row()
+        self.qc.ensure_row_index(self.collection_name)
+        while not self._stop.is_set():
+            points, _ = self.qc.client.scroll(
+                collection_name=self.collection_name,
+                scroll_filter=self._old_turns_filter(next_row),
+                order_by=models.OrderBy(key="row", direction=models.Direction.ASC),
+                limit=self.batch_size,
+                with_payload=True,
+                with_vectors=True,
+            )
+            if not points:
+                break
+            _, clusters = self.chunker.chunk_by_similarity(
+                [p.payload["text"] for p in points],
+                similarity_threshold=self.similarity_threshold,
+                embeddings=np.asarray([self._dense(p.vector) for p in points]),
+            )
+            last_batch = len(points) < self.batch_size
+            if not last_batch and len(clusters) > 1:
+                # The last cluster may continue in the next batch.
+                clusters = clusters[:-1]
+            for cluster in clusters:
+                if len(cluster) >= self.min_cluster_size:
+                    self._consolidate([points[i] for i in cluster])
+                    report["clusters"] += 1
+                    report["turns_consolidated"] += len(cluster)
+            next_row = points[clusters[-1][-1]].payload["row"] + 1
+            self._save_next_row(next_row)
+            if last_batch:
+                break
+            self._stop.wait(self.pause_seconds)
+
+        report["points_after"] = self._count()
+        report["latency_ms_after"] = self._search_latency_ms(probes)
+        logger.info(f"consolidated '{self.collection_name}': {report}")
+        return report
+
+    # ---------- background --------------------------------------------------
+
+    def start(self, interval_seconds: float = 3600) -> None:
+        """Run `run_once` every `interval_seconds` in a daemon thread."""
+        def loop():
+            while not self._stop.is_set():
+                try:
+                    self.run_once()
+                except Exception as e:
+                    logger.warning(f"consolidating '{self.collection_name}' failed, will retry: {e}")
+                self._stop.wait(interval_seconds)
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=loop, name=f"consolidate-{self.collection_name}", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+def argparser():
+    parser = argparse.ArgumentParser(description="Consolidate old turns of a memory collection into summaries")
+    parser.add_argument("--collection_name", type=str, required=True, help="Memory collection to consolidate")
+    parser.add_argument("--model_output_path", type=str, required=True, help="Embedding model of the collection")
+    parser.add_argument("--tenant", type=str, default=None, help="Tenant of a shared collection")
+    parser.add_argument("--min_age_days", type=float, default=30, help="Only turns older than this are consolidated")
+    parser.add_argument("--similarity_threshold", type=float, default=0.8, help="Minimum similarity to cluster adjacent turns")
+    parser.add_argument("--min_cluster_size", type=int, default=3, help="Smallest cluster replaced by a summary")
+    parser.add_argument("--pause_seconds", type=float, default=0.5, help="Pause between batches")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    args = argparser()
+    consolidator = MemoryConsolidator(
+        collection_name=args.collection_name,
+        embedding_model_path=resolve_model_path(args.model_output_path),
+        tenant=args.tenant,
+        min_age_days=args.min_age_days,
+        similarity_threshold=args.similarity_threshold,
+        min_cluster_size=args.min_cluster_size,
+        pause_seconds=args.pause_seconds,
+    )
+    print(consolidator.run_once())
@@ -2,40 +2,79 @@ import os
 from qdrant_client.http.models import PointStruct, Distance
 from retrieval.model_calling import ModelContext
 from database.connector import QdrantConnector
-from database.qdrant_controller import QdrantController
+from database.qdrant_controller import QdrantController, TENANT_FIELD
+from database.model_registry import ModelRegistry
 from pydantic import BaseModel, Field
 from model_management.embedding_model_controller import EmbeddingModelController
-from retrieval.chunking_strategies.neighbour_sim import NeibourSimilarityChunker
+from model_management.sparse_model_controller import SparseModelController
+from model_management.reranker_model_controller import DEFAULT_RERANKER_MODEL
+from retrieval.chunking_strategies.neighbour_sim import NeibourSimilarityChunker, TextChunk
 from tqdm import tqdm  # Add this import at the top if not already present
-from retrieval.base import Indexer
+from retrieval.base import Indexer, Retriever
+from tracing import propagate, span
 from typing import Any
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import csv
+import threading
 class ContextualKeyValuePair(BaseModel):
     key: str = Field(..., description="The contextual summary of the information.")
     value: str = Field(..., description="The actual content for retrieval.")
     embedding: list[float] = Field(..., description="The embedding vector for the key.")
+    source: list[Any] = Field(default_factory=list, description="The `source` ids of the rows behind the value.")
+    sparse_embedding: Any = Field(None, description="Optional sparse lexical vector of the key and value.")
 class ContextualQdrantController(QdrantController):
     def __init__(self, client):
         super().__init__(client)
 
-    def batch_struct_points(self, points: list[ContextualKeyValuePair]):
-        """Convert a list of ContextualKeyValuePair to PointStruct."""
+    def batch_struct_points(self, points: list[ContextualKeyValuePair], start_id: int = 0, tenant: str | None = None):
+        """Convert a list of ContextualKeyValuePair to PointStruct (optionally
+        owned by `tenant` in a shared collection)."""
         return [
-            PointStruct(
-                id=i,
+            self.make_point(
+                point_id=self.make_point_id(start_id + i, tenant),
                 vector=point.embedding,
-                payload={"key": point.key, "value": point.value}
+                payload={
+                    "key": point.key,
+                    "value": point.value,
+                    "source": point.source,
+                    "row": start_id + i,
+                    **({TENANT_FIELD: tenant} if tenant is not None else {})},
+                sparse_vector=point.sparse_embedding,
             )
             for i, point in enumerate(points)
         ]
         
 
+def succinct_context(model: ModelContext, chunk: str) -> str:
+    """Ask *model* for a short context that situates *chunk* in its document."""
+    model.clear_history()
+    model.add_user_message(
+        messages=f"""Here is the chunk we want to situate within the whole document 
+            <chunk> 
+            {chunk}
+            </chunk> 
+            Please give a short succinct context using the language of the chunk's to situate this chunk within the overall document for the purposes of improving search retrieval of the chunk. Answer only with the succinct context and nothing else.
+        """)
+    return model.call_model()
+
+
 class ContextualIndexing(Indexer):
-    def __init__(self):
-        pass
-      
+    def __init__(self, summary_model="gpt-4.1-nano", summary_workers=8, batch_size=64):
+        self.summary_model = summary_model
+        self.summary_workers = summary_workers
+        self.batch_size = batch_size
+        self._local = threading.local()
+
+    def _summarize(self, chunk: str) -> str:
+        # ModelContext keeps a conversation history, so every worker thread
+        # gets its own.
+        model = getattr(self._local, "model", None)
+        if model is None:
+            model = self._local.model = ModelContext(model_name=self.summary_model)
+        return succinct_context(model, chunk)
 
-    def index(self, * , embedding_model_path, file_path, collection_name, hierachical_matching=False):
+    def index(self, * , embedding_model_path, file_path, collection_name, hierachical_matching=False, hybrid=True, tenant=None):
         """ Logic
         We perform a key, value based retrieval.
         The key is the contextual summary of the information + the actual content
@@ -47,93 +86,184 @@ class ContextualIndexing(Indexer):
                 _> This can be dates, chunks separated by certain delimiter, or just number of words
         2. Then call summarization on each chunk to get the key
         3. Store the key and value in a database (Qdrant)
+
+        The file is read and chunked as a stream: summaries are requested as
+        soon as a chunk is complete, and finished chunks are embedded and
+        upserted batch by batch while the rest of the file is still being read.
+        Hierarchical matching needs every chunk before it can cluster them, so
+        it collects the stream first.
+
+        With `hybrid` (the default) each point also gets a sparse lexical
+        vector of its key and value for hybrid queries.
+
+        With `tenant`, `collection_name` is a shared multi-tenant collection
+        and the chunks are stored under that tenant.
         """
         client = QdrantConnector().connect()
         cqc = ContextualQdrantController(client)
-        if cqc.collection_exists(collection_name):
+        existing_collection = cqc.collection_exists(collection_name)
+        if existing_collection and (tenant is None or cqc.tenant_exists(collection_name, tenant)):
             return
         # 1. Read and chunk the file
-        with open(file_path, 'r', encoding='utf-8') as f:
-            if file_path.endswith('.csv'):
-                next(f)  # Skip header line for CSV files
-            content = f.read()
-
-        # Example: simple chunking by paragraphs (customize as needed)
         chunking_strategy = NeibourSimilarityChunker(embedding_model_name=embedding_model_path)
-        chunks = chunking_strategy.chunk_text(content, max_tokens=150)
+        chunks = chunking_strategy.stream_chunks(
+            chunking_strategy.iter_rows(file_path), max_tokens=150
+        )
+        embedder = chunking_strategy.embedder
 
-        # 2. Summarize each chunk to create keys
-        model = ModelContext(model_name="gpt-4.1-nano")
-        
-        def succinct_contexts(chunks, model):
-            keys = []
-
-            for chunk in tqdm(chunks, desc="Generating succinct contexts"):
-                model.clear_history()
-                model.add_user_message(
-                    messages=f"""Here is the chunk we want to situate within the whole document 
-                        <chunk> 
-                        {chunk}
-                        </chunk> 
-                        Please give a short succinct context using the language of the chunk's to situate this chunk within the overall document for the purposes of improving search retrieval of the chunk. Answer only with the succinct context and nothing else.
-                    """)
-                summary = model.call_model()
-                keys.append(summary)
-            return keys
-        
-        keys = succinct_contexts(chunks, model)
-        
-        
-        # 3. Embed the keys and chunks
         if hierachical_matching:
+            with span("chunk"):
+                chunks = list(chunks)
             # restructure values based on similarity
-            contextual_keys, contextual_key_index = chunking_strategy.chunk_by_similarity(chunks,  similarity_threshold=0.7)
-            contextual_values = []
-            for indexes in contextual_key_index:
-                contextual_values.append(" ".join([chunks[i] for i in indexes]))
-            keys = succinct_contexts(contextual_values, model)
-            chunks = contextual_values
-            
-        embedder = EmbeddingModelController(model_name=embedding_model_path)
-        key_embeddings = embedder.embed(keys)
-
-        assert len(key_embeddings) == len(chunks), "Key embeddings and chunks must have the same length."
-        contextual_pairs = []
-        for k, v, embedding in zip(keys, chunks, key_embeddings):
-                
-            contextual_pairs.append(
+            contextual_keys, contextual_key_index = chunking_strategy.chunk_by_similarity(
+                [c.text for c in chunks], similarity_threshold=0.7
+            )
+            chunks = [
+                TextChunk(
+                    text=" ".join(chunks[i].text for i in indexes),
+                    rows=[r for i in indexes for r in chunks[i].rows],
+                    sources=[s for i in indexes for s in chunks[i].sources],
+                )
+                for indexes in contextual_key_index
+            ]
+
+        try:
+            sparse_model = SparseModelController() if hybrid else None
+            self._index_stream(
+                chunks, embedder, sparse_model, cqc, collection_name,
+                tenant=tenant, create_collection=not existing_collection,
+            )
+            if not existing_collection:
+                # Tag at creation, so a later retrain in place shows up as stale.
+                ModelRegistry(cqc).tag(collection_name, embedding_model_path)
+        except BaseException:
+            # Never leave a half-written index behind: it would be mistaken
+            # for a finished one on the next call.
+            if tenant is not None and cqc.collection_exists(collection_name):
+                cqc.delete_tenant(collection_name, tenant)
+            elif tenant is None and cqc.collection_exists(collection_name):
+                cqc.delete_collection(collection_name)
+            raise
+
+    def _index_stream(self, chunks, embedder, sparse_model, cqc, collection_name, tenant=None, create_collection=True):
+        """2.-4. Summarize, embed and store *chunks* as they arrive."""
+        next_id = 0
+        batch: list[tuple[TextChunk, str]] = []
+
+        def flush():
+            nonlocal next_id
+            keys = [key for _, key in batch]
+            with span("embed"):
+                key_embeddings = embedder.embed(keys)
+            sparse_embeddings = [None] * len(batch)
+            if sparse_model is not None:
+                with span("sparse"):
+                    sparse_embeddings = sparse_model.embed_documents(
+                        [f"{key} {chunk.text}" for chunk, key in batch]
+                    )
+            contextual_pairs = [
                 ContextualKeyValuePair(
-                key=k,
-                value=v,
-                embedding=embedding.tolist()
-            ))
-        
-        # 4. Store in Qdrant
-        
-        struct_points = cqc.batch_struct_points(contextual_pairs)
-        cqc.create_collection(
-            name=collection_name, 
-            vector_size=len(key_embeddings[0])
-        )
-        cqc.upsert_points(
-            collection=collection_name,
-            points=struct_points)
+                    key=key,
+                    value=chunk.text,
+                    embedding=embedding.tolist(),
+                    source=chunk.sources,
+                    sparse_embedding=sparse,
+                )
+                for (chunk, key), embedding, sparse in zip(batch, key_embeddings, sparse_embeddings)
+            ]
+            if next_id == 0 and create_collection:
+                cqc.create_collection(
+                    name=collection_name, 
+                    vector_size=len(key_embeddings[0]),
+                    # Tenants share the collection, so it always accepts sparse vectors.
+                    sparse=sparse_model is not None or tenant is not None,
+                    multitenant=tenant is not None,
+                )
+            with span("upsert"):
+                cqc.upsert_points(
+                    collection=collection_name,
+                    points=cqc.batch_struct_points(contextual_pairs, start_id=next_id, tenant=tenant))
+            next_id += len(contextual_pairs)
+            batch.clear()
+
+        # Bound the number of chunks waiting on the LLM so memory stays flat.
+        max_in_flight = self.summary_workers * 4
+        in_flight: deque = deque()
+        progress = tqdm(desc="Generating succinct contexts", unit="chunk")
 
-class ContextualRetrieval:
+        def collect_oldest():
+            chunk, future = in_flight.popleft()
+            batch.append((chunk, future.result()))
+            progress.update()
+            if len(batch) >= self.batch_size:
+                flush()
 
-    def retrieve(self, collection_name, embedding_model_path, query, top_k=20):
-        """Retrieve contextual information based on a query."""
+        with ThreadPoolExecutor(max_workers=self.summary_workers) as pool:
+            for chunk in chunks:
+                in_flight.append((chunk, pool.submit(propagate(self._summarize), chunk.text)))
+                if len(in_flight) >= max_in_flight:
+                    collect_oldest()
+            while in_flight:
+                collect_oldest()
+        progress.close()
+        if batch:
+            flush()
+
+class ContextualRetrieval(Retriever):
+
+    def retrieve(
+        self,
+        collection_name,
+        embedding_model_path,
+        query,
+        top_k=20,
+        hybrid=False,
+        rerank_k=None,
+        final_k=None,
+        reranker_model=DEFAULT_RERANKER_MODEL,
+        rerank_budget_ms=None,
+        tenant=None,
+    ):
+        """Retrieve contextual information based on a query.
+        With `hybrid`, dense and sparse results are fused server-side.
+        With `rerank_k`, that many candidates are reranked by a cross-encoder
+        within `rerank_budget_ms` and the best `final_k` (default `top_k`) kept.
+        With `tenant`, only that tenant's points of a shared collection are searched."""
+        limit = rerank_k or top_k
 
         client = QdrantConnector().connect()
         qc = ContextualQdrantController(client)
         embedding_model = EmbeddingModelController(model_name=embedding_model_path)
-        query_vector = embedding_model.embed(query)
+        with span("embed_query"):
+            query_vector = embedding_model.embed(query)
+        query_filter = qc.tenant_filter(tenant) if tenant is not None else None
         
-        search_result = qc.search(
-            collection_name=collection_name,
-            query_vector=query_vector,
-            limit=top_k
-        )
+        with span("search"):
+            if hybrid:
+                search_result = qc.hybrid_search(
+                    collection_name=collection_name,
+                    query_vector=query_vector,
+                    sparse_vector=SparseModelController().embed_query(query),
+                    limit=limit,
+                    query_filter=query_filter,
+                )
+            else:
+                search_result = qc.search(
+                    collection_name=collection_name,
+                    query_vector=query_vector,
+                    limit=limit,
+                    query_filter=query_filter,
+                )
+        if rerank_k:
+            with span("rerank"):
+                search_result = self.rerank(
+                    query,
+                    search_result,
+                    [result.payload['value'] for result in search_result],
+                    top_k=final_k or top_k,
+                    reranker_model=reranker_model,
+                    budget_ms=rerank_budget_ms,
+                )
         
         str_output = []
         for result in search_result:
@@ -0,0 +1,99 @@
+import zlib
+import numpy as np
+from model_management.sparse_model_controller import _TOKEN_PATTERN, _CJK_RUN
+
+# Mersenne prime for the universal hashes; `a * x + b` stays below 2**64
+# for 32-bit shingle hashes.
+_PRIME = (1 << 31) - 1
+
+
+def shingles(text: str, size: int = 4) -> set[str]:
+    """
+    CJK-aware shingles of a line, insensitive to case, punctuation and spacing.
+
+    Latin-like text is reduced to its words and cut into character
+    `size`-grams, so a retyped or re-punctuated line shares almost all of
+    them. CJK runs carry far more information per character and are cut into
+    character bigrams instead. A line without any word character (e.g. "...")
+    is its own single shingle, i.e. only matches itself.
+    """
+    result = set()
+    words = []
+    for match in _TOKEN_PATTERN.findall(str(text).lower()):
+        if _CJK_RUN.fullmatch(match):
+            result.update(match[i:i + 2] for i in range(max(len(match) - 1, 1)))
+        else:
+            words.append(match)
+    joined = " ".join(words)
+    if joined:
+        result.update(joined[i:i + size] for i in range(max(len(joined) - size + 1, 1)))
+    return result or {str(text).strip()}
+
+
+class MinHashDeduplicator:
+    """
+    Cluster near-duplicate lines ("Yeah." / "yeah", retransmitted messages)
+    with MinHash signatures and LSH banding.
+
+    Lines whose signatures agree on a whole band become candidates; a
+    candidate pair is merged only if the exact Jaccard similarity of the
+    shingle sets reaches `threshold`, so the banding only has to be cheap,
+    not precise. With the defaults (16 bands of 8 rows) pairs at 0.9 are
+    almost always candidates and pairs below 0.5 rarely are.
+    """
+
+    def __init__(self, threshold: float = 0.9, num_perm: int = 128, bands: int = 16,
+                 shingle_size: int = 4, seed: int = 0):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, _PRIME, size=num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, _PRIME, size=num_perm, dtype=np.uint64)
+
+    def signature(self, shingle_set: set[str]) -> np.ndarray:
+        hashes = np.fromiter(
+            (zlib.crc32(s.encode("utf-8")) for s in shingle_set),
+            dtype=np.uint64, count=len(shingle_set),
+        )
+        return ((self._a[:, None] * hashes[None, :] + self._b[:, None]) % _PRIME).min(axis=1)
+
+    def clusters(self, texts: list[str]) -> list[list[int]]:
+        """
+        Group `texts` into clusters of near-duplicates. Every index appears
+        in exactly one cluster; clusters are sorted and ordered by their first
+        (representative) index, so unique lines come back as singletons in
+        their original order.
+        """
+        shingle_sets = [shingles(t, self.shingle_size) for t in texts]
+        parent = list(range(len(texts)))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        buckets: dict[tuple, int] = {}
+        for i, shingle_set in enumerate(shingle_sets):
+            signature = self.signature(shingle_set)
+            for band in range(self.bands):
+                key = (band, signature[band * self.rows:(band + 1) * self.rows].tobytes())
+                j = buckets.setdefault(key, i)
+                if j == i:
+                    continue
+                root_i, root_j = find(i), find(j)
+                if root_i == root_j:
+                    continue
+                other = shingle_sets[j]
+                if len(shingle_set & other) >= self.threshold * len(shingle_set | other):
+                    # Keep the earliest line as the root, i.e. the representative.
+                    parent[max(root_i, root_j)] = min(root_i, root_j)
+
+        groups: dict[int, list[int]] = {}
+        for i in range(len(texts)):
+            groups.setdefault(find(i), []).append(i)
+        return [groups[root] for root in sorted(groups)]
@@ -0,0 +1,464 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+import weakref
+from collections import OrderedDict
+from datetime import datetime, timezone
+import numpy as np
+from database.connector import QdrantConnector
+from database.model_registry import ModelRegistry
+from file_util import collection_file_stem, resolve_model_path
+from model_management.embedding_model_controller import EmbeddingModelController
+from model_management.sparse_model_controller import SparseModelController
+from retrieval.structured_csv_retrieve import (
+    StructuredDialogue, StructuredQdrantController, StructuredCSVRetrieval, parse_timestamp
+)
+from retrieval.style_index import StyleIndex
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WAL_DIR = os.environ.get("MEMORY_WAL_DIR", resolve_model_path("memory_wal"))
+
+
+def wal_path(collection_name: str, tenant: str | None = None, wal_dir: str | None = None) -> str:
+    """The write-ahead log of a collection (and tenant) in `wal_dir`."""
+    return os.path.join(wal_dir or DEFAULT_WAL_DIR, f"{collection_file_stem(collection_name, tenant)}.wal")
+
+
+class MemoryWriteBuffer:
+    """
+    Buffered write path for adding memories to a naive_csv-style collection
+    one turn at a time.
+
+    `add` appends the entries to a write-ahead log on local disk (fsynced)
+    before acknowledging them, so an acknowledged write survives a crash: a
+    new buffer for the same collection (and tenant) replays the log. Each
+    (collection, tenant) has its own log file, and every entry records both,
+    so a replay never picks up another buffer's memories. A background thread
+    embeds pending entries in micro-batches and upserts them when
+    `max_batch` entries are waiting or every `flush_interval` seconds; the
+    log is then trimmed to what is still pending.
+
+    Memories are ordinary rows (ids continue after the highest row already
+    stored), so context expansion and the style index work on them too.
+    `search` also scores the entries that are not flushed yet, so a memory
+    can be read back right after it was added.
+    """
+
+    def __init__(
+        self,
+        collection_name: str,
+        embedding_model_path: str,
+        tenant: str | None = None,
+        max_batch: int = 64,
+        flush_interval: float = 1.0,
+        wal_dir: str | None = None,
+        style: bool = True,
+    ):
+        self.collection_name = collection_name
+        self.tenant = tenant
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.style = style
+        self.qc = StructuredQdrantController(QdrantConnector().connect())
+        self.embedding_model_path = embedding_model_path
+        self.embedding_model = EmbeddingModelController(model_name=embedding_model_path)
+
+        wal_dir = wal_dir or DEFAULT_WAL_DIR
+        os.makedirs(wal_dir, exist_ok=True)
+        self.wal_path = wal_path(collection_name, tenant, wal_dir)
+
+        self._lock = threading.Lock()
+        # Serialises flushes; never held while `_lock` is waited for by add().
+        self._flush_lock = threading.Lock()
+        self._pending: list[dict] = self._replay()
+        # Embeddings of pending entries, filled by search() or flush(), by id.
+        self._embeddings: dict[str, np.ndarray] = {}
+        self._next_row = self._first_free_row()
+
+        self._wake = threading.Event()
+        self._closed = threading.Event()
+        self._worker = threading.Thread(target=self._run, name=f"memory-flush-{collection_name}", daemon=True)
+        self._worker.start()
+
+    # ---------- write-ahead log --------------------------------------------
+
+    def _replay(self) -> list[dict]:
+        if not os.path.exists(self.wal_path):
+            return []
+        entries = []
+        foreign = 0
+        with open(self.wal_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # A torn last line was never acknowledged.
+                    logger.warning(f"skipping incomplete write-ahead log line in {self.wal_path}")
+                    continue
+                if entry.get("collection") != self.collection_name or entry.get("tenant") != self.tenant:
+                    foreign += 1
+                    continue
+                entries.append(entry)
+        if foreign:
+            logger.warning(f"skipping {foreign} write-ahead log entries of another collection in {self.wal_path}")
+        if entries:
+            logger.info(f"replaying {len(entries)} unflushed memories from {self.wal_path}")
+        return entries
+
+    def _rewrite_wal(self, entries: list[dict]) -> None:
+        tmp_path = self.wal_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for entry in entries:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.wal_path)
+
+    def _first_free_row(self) -> int:
+        rows = [entry["row"] for entry in self._pending]
+        if self.qc.collection_exists(self.collection_name):
+            stored = self.qc.max_row(self.collection_name, tenant=self.tenant)
+            if stored is not None:
+                rows.append(stored)
+        return max(rows) + 1 if rows else 0
+
+    # ---------- write -------------------------------------------------------
+
+    def add(self, items: list[dict]) -> list[dict]:
+        """
+        Durably queue memories (dicts with `text` and optionally `talker`,
+        `time` and `source`) and return them with their assigned `row` and
+        `source`. Returns once the entries are in the write-ahead log.
+        """
+        now = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        with self._lock:
+            if self._closed.is_set():
+                raise RuntimeError(f"memory buffer of '{self.collection_name}' is closed")
+            entries = []
+            for item in items:
+                row = self._next_row
+                self._next_row += 1
+                entries.append({
+                    "id": uuid.uuid4().hex,
+                    "collection": self.collection_name,
+                    "tenant": self.tenant,
+                    "row": row,
+                    "text": item["text"],
+                    "talker": item.get("talker") or "",
+                    "time": item.get("time") or now,
+                    "source": item.get("source") or f"memory:{row}",
+                })
+            with open(self.wal_path, "a", encoding="utf-8") as f:
+                for entry in entries:
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self._pending.extend(entries)
+            full = len(self._pending) >= self.max_batch
+        if full:
+            self._wake.set()
+        return [{key: entry[key] for key in ("row", "source", "time")} for entry in entries]
+
+    @staticmethod
+    def _document(entry: dict) -> str:
+        # Same text as naive_csv indexing embeds (add_talker=True).
+        return f"{entry['talker']}: {entry['text']}"
+
+    def _embed_missing(self, entries: list[dict]) -> None:
+        missing = [entry for entry in entries if entry["id"] not in self._embeddings]
+        if missing:
+            vectors = self.embedding_model.embed([self._document(entry) for entry in missing])
+            for entry, vector in zip(missing, vectors):
+                self._embeddings[entry["id"]] = np.asarray(vector, dtype=np.float32)
+
+    def _pending_vectors(self, entries: list[dict]) -> np.ndarray:
+        """
+        Embeddings of pending `entries`, for search. Missing ones are embedded
+        without holding a lock, so a search never waits for a flush, and are
+        cached only while their entry is still pending.
+        """
+        vectors = {entry["id"]: self._embeddings.get(entry["id"]) for entry in entries}
+        missing = [entry for entry in entries if vectors[entry["id"]] is None]
+        if missing:
+            embedded = self.embedding_model.embed([self._document(entry) for entry in missing])
+            with self._lock:
+                pending = {entry["id"] for entry in self._pending}
+                for entry, vector in zip(missing, embedded):
+                    vectors[entry["id"]] = np.asarray(vector, dtype=np.float32)
+                    if entry["id"] in pending:
+                        self._embeddings[entry["id"]] = vectors[entry["id"]]
+        return np.stack([vectors[entry["id"]] for entry in entries])
+
+    def flush(self) -> int:
+        """Write every pending entry to Qdrant now; returns how many were written."""
+        with self._flush_lock:
+            with self._lock:
+                batch = list(self._pending)
+            if not batch:
+                return 0
+            self._embed_missing(batch)
+            dialogues = [
+                StructuredDialogue(
+                    text=self._document(entry),
+                    talker=entry["talker"],
+                    time=entry["time"],
+                    source=entry["source"],
+                    row=entry["row"],
+                    embedding=self._embeddings[entry["id"]].tolist(),
+                    timestamp=parse_timestamp(entry["time"]),
+                )
+                for entry in batch
+            ]
+            if not self.qc.collection_exists(self.collection_name):
+                self.qc.create_collection(
+                    name=self.collection_name,
+                    vector_size=len(dialogues[0].embedding),
+                    sparse=True,
+                    multitenant=self.tenant is not None,
+                )
+                ModelRegistry(self.qc).tag(self.collection_name, self.embedding_model_path)
+            if self.qc.has_sparse_vectors(self.collection_name):
+                for dialogue, vector in zip(
+                    dialogues, SparseModelController().embed_documents([d.text for d in dialogues])
+                ):
+                    dialogue.sparse_embedding = vector
+            self.qc.upsert_points(
+                collection=self.collection_name,
+                points=self.qc.batch_struct_points(dialogues, tenant=self.tenant),
+            )
+            if self.style:
+                StyleIndex(self.qc).update(self.collection_name, dialogues, tenant=self.tenant)
+
+            flushed = {entry["id"] for entry in batch}
+            with self._lock:
+                self._pending = [entry for entry in self._pending if entry["id"] not in flushed]
+                self._rewrite_wal(self._pending)
+            for entry_id in flushed:
+                self._embeddings.pop(entry_id, None)
+            return len(batch)
+
+    def _run(self):
+        while not self._closed.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                # Entries stay in the log and are retried on the next tick.
+                logger.warning(f"flushing memories to '{self.collection_name}' failed, will retry: {e}")
+
+    def close(self):
+        """Stop the background thread after a final flush."""
+        self._closed.set()
+        self._wake.set()
+        self._worker.join()
+        self.flush()
+
+    # ---------- read --------------------------------------------------------
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def search(self, query: str, top_k: int = 20, recency_half_life_days: float | None = None,
+               recency_weight: float = 0.3) -> list[dict]:
+        """
+        Dense search over the stored memories and the ones still pending,
+        merged by score. Hits are formatted like `StructuredCSVRetrieval`.
+        With `recency_half_life_days`, scores get the same recency boost as
+        `StructuredCSVRetrieval.retrieve` applies.
+        """
+        now = datetime.now(timezone.utc)
+        query_vector = np.asarray(self.embedding_model.embed(query), dtype=np.float32)
+        # Snapshot before searching: an entry flushed in between then shows
+        # up twice (and is deduplicated) rather than not at all.
+        with self._lock:
+            pending = list(self._pending)
+        candidates = search_stored(
+            self.qc, self.collection_name, query_vector, top_k=top_k, tenant=self.tenant,
+            recency_half_life_days=recency_half_life_days, recency_weight=recency_weight, now=now,
+        )
+
+        if pending:
+            vectors = self._pending_vectors(pending)
+            norms = np.linalg.norm(vectors, axis=1) * (np.linalg.norm(query_vector) or 1.0)
+            scores = vectors @ query_vector / np.where(norms == 0, 1, norms)
+            if recency_half_life_days:
+                for n, entry in enumerate(pending):
+                    timestamp = parse_timestamp(entry["time"])
+                    if timestamp is not None:
+                        age = abs((now - datetime.fromisoformat(timestamp)).total_seconds())
+                        scores[n] += recency_weight * 0.5 ** (age / (recency_half_life_days * 86400))
+            stored = {payload.get("row") for _, payload in candidates}
+            candidates.extend(
+                (float(score), {**entry, "text": self._document(entry)})
+                for score, entry in zip(scores, pending)
+                if entry["row"] not in stored
+            )
+
+        return format_hits(candidates, top_k)
+
+
+def search_stored(qc, collection_name: str, query_vector, top_k: int = 20, tenant: str | None = None,
+                  recency_half_life_days: float | None = None, recency_weight: float = 0.3,
+                  now: datetime | None = None) -> list[tuple]:
+    """`(score, payload)` of the best stored memories; none when the collection does not exist."""
+    if not qc.collection_exists(collection_name):
+        return []
+    query_filter = qc.tenant_filter(tenant) if tenant is not None else None
+    if recency_half_life_days:
+        hits = qc.recency_search(
+            collection_name=collection_name,
+            query_vector=query_vector,
+            half_life_seconds=recency_half_life_days * 86400,
+            weight=recency_weight,
+            limit=top_k,
+            query_filter=query_filter,
+            now=(now or datetime.now(timezone.utc)).isoformat(),
+        )
+    else:
+        hits = qc.search(
+            collection_name=collection_name,
+            query_vector=query_vector,
+            limit=top_k,
+            query_filter=query_filter,
+        )
+    return [(hit.score, hit.payload) for hit in hits]
+
+
+def format_hits(candidates: list[tuple], top_k: int) -> list[dict]:
+    """The best `top_k` `(score, payload)` candidates, formatted like `StructuredCSVRetrieval`."""
+    candidates = sorted(candidates, key=lambda c: c[0], reverse=True)
+    return [
+        {"idx": payload.get("source", ""), "text": StructuredCSVRetrieval.format_turn(payload), "score": score}
+        for score, payload in candidates[:top_k]
+    ]
+
+
+# Buffers by (collection, tenant, model) -> (buffer, target, last use), least
+# recently used first. Every buffer runs a flush thread, so at most
+# MEMORY_BUFFERS_MAX are kept and ones idle for MEMORY_BUFFER_IDLE_SECONDS
+# are flushed and closed.
+_BUFFERS: OrderedDict = OrderedDict()
+_BUFFERS_LOCK = threading.Lock()
+_BUFFERS_MAX = int(os.environ.get("MEMORY_BUFFERS_MAX", 256))
+_BUFFER_IDLE_SECONDS = float(os.environ.get("MEMORY_BUFFER_IDLE_SECONDS", 600))
+
+
+class _Target:
+    """Held while a buffer of one (collection, tenant), i.e. of one log, is opened or closed."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+
+
+_TARGETS: weakref.WeakValueDictionary = weakref.WeakValueDictionary()
+
+
+def _touch(key: tuple) -> MemoryWriteBuffer | None:
+    entry = _BUFFERS.get(key)
+    if entry is None:
+        return None
+    _BUFFERS[key] = (entry[0], entry[1], time.monotonic())
+    _BUFFERS.move_to_end(key)
+    return entry[0]
+
+
+def _evict(keep: tuple) -> list:
+    """
+    Pop the buffers over the size limit or idle for too long, except `keep`,
+    with the lock of their target taken; one being opened or closed by
+    another request is left for later.
+    """
+    now = time.monotonic()
+    evicted = []
+    for key, (buffer, target, last_used) in list(_BUFFERS.items()):
+        if len(_BUFFERS) <= _BUFFERS_MAX and now - last_used < _BUFFER_IDLE_SECONDS:
+            break
+        if key == keep or not target.lock.acquire(blocking=False):
+            continue
+        del _BUFFERS[key]
+        evicted.append((buffer, target))
+    return evicted
+
+
+def _close_evicted(evicted: list) -> None:
+    for buffer, target in evicted:
+        try:
+            buffer.close()
+        finally:
+            target.lock.release()
+
+
+def _open(key: tuple, target: _Target) -> MemoryWriteBuffer:
+    """Create the buffer of `key`, with `target.lock` held."""
+    with _BUFFERS_LOCK:
+        buffer = _touch(key)
+        if buffer is not None:  # opened by a concurrent request
+            return buffer
+        replaced = [_BUFFERS.pop(other)[0] for other in list(_BUFFERS) if other[:2] == key[:2]]
+    for other in replaced:
+        other.close()
+    buffer = MemoryWriteBuffer(key[0], key[2], tenant=key[1])
+    with _BUFFERS_LOCK:
+        _BUFFERS[key] = (buffer, target, time.monotonic())
+    return buffer
+
+
+def get_memory_buffer(collection_name: str, embedding_model_path: str, tenant: str | None = None,
+                      create: bool = True) -> MemoryWriteBuffer | None:
+    """
+    The process-wide buffer of a collection (and tenant) for a model, created
+    on first use unless `create` is False (then None). A buffer of the same
+    collection for another model is flushed and closed first: the two would
+    share one write-ahead log. Flushes of replaced and evicted buffers run
+    outside the registry lock, so other collections are served meanwhile.
+    """
+    key = (collection_name, tenant, embedding_model_path)
+    with _BUFFERS_LOCK:
+        buffer = _touch(key)
+        target = _TARGETS.setdefault(key[:2], _Target()) if buffer is None and create else None
+    if target is not None:
+        with target.lock:
+            buffer = _open(key, target)
+    with _BUFFERS_LOCK:
+        evicted = _evict(keep=key)
+    _close_evicted(evicted)
+    return buffer
+
+
+def search_memories(collection_name: str, embedding_model_path: str, query: str, top_k: int = 20,
+                    tenant: str | None = None, recency_half_life_days: float | None = None,
+                    recency_weight: float = 0.3) -> list[dict]:
+    """
+    Search a memory collection (see `MemoryWriteBuffer.search`). Unflushed
+    memories only exist in a buffer or its log, so a buffer searches when
+    there is one, or a log left by an earlier process to replay; otherwise
+    Qdrant is searched directly, without starting a buffer.
+    """
+    path = wal_path(collection_name, tenant)
+    replay = os.path.exists(path) and os.path.getsize(path) > 0
+    buffer = get_memory_buffer(collection_name, embedding_model_path, tenant=tenant, create=replay)
+    if buffer is not None:
+        return buffer.search(query, top_k=top_k, recency_half_life_days=recency_half_life_days,
+                             recency_weight=recency_weight)
+    query_vector = np.asarray(EmbeddingModelController(model_name=embedding_model_path).embed(query), dtype=np.float32)
+    qc = StructuredQdrantController(QdrantConnector().connect())
+    return format_hits(search_stored(
+        qc, collection_name, query_vector, top_k=top_k, tenant=tenant,
+        recency_half_life_days=recency_half_life_days, recency_weight=recency_weight,
+    ), top_k)
+
+
+def close_memory_buffers():
+    """Flush and stop every buffer (e.g. on shutdown)."""
+    with _BUFFERS_LOCK:
+        entries = list(_BUFFERS.values())
+        _BUFFERS.clear()
+    for buffer, target, _ in entries:
+        with target.lock:
+            buffer.close()
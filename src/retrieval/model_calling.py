@@ -1,4 +1,5 @@
 from openai import OpenAI
+from tracing import span
 
 class ModelContext:
     def __init__(self, model_name: str):
@@ -45,6 +46,7 @@ class ModelContext:
         return None
     
     
+    @span("llm")
     def call_model(self):
         """Call the model with the current conversation history."""
         response = self.client.responses.create(
@@ -0,0 +1,123 @@
+import heapq
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from database.connector import QdrantConnector
+from database.qdrant_controller import QdrantController
+from model_management.embedding_model_controller import EmbeddingModelController
+from model_management.sparse_model_controller import SparseModelController
+from retrieval.base import Retriever
+from retrieval.structured_csv_retrieve import StructuredCSVRetrieval
+from tracing import propagate, span
+
+logger = logging.getLogger(__name__)
+
+# Shared across requests so a fan-out does not pay for thread start-up. A
+# search that outlives its timeout keeps its worker until Qdrant answers.
+_SEARCH_POOL = ThreadPoolExecutor(max_workers=16, thread_name_prefix="qdrant-fanout")
+
+
+def normalize_scores(scores: list[float], method: str = "none") -> list[float]:
+    """
+    Put one collection's scores on a common scale before merging.
+    `none` (the default) keeps raw scores, which are already comparable when
+    every collection uses the same model and distance. `minmax` maps each
+    collection's hits to [0, 1] and `zscore` centres them; both rescale per
+    collection, so the best hit of a shard with nothing relevant ties with
+    the best of a good one. Use them only for collections embedded differently.
+    """
+    if method == "none" or not scores:
+        return list(scores)
+    if method == "minmax":
+        low, high = min(scores), max(scores)
+        if high == low:
+            return [1.0] * len(scores)
+        return [(s - low) / (high - low) for s in scores]
+    if method == "zscore":
+        mean = sum(scores) / len(scores)
+        std = (sum((s - mean) ** 2 for s in scores) / len(scores)) ** 0.5
+        return [(s - mean) / std if std else 0.0 for s in scores]
+    raise ValueError(f"Unknown score normalization '{method}'")
+
+
+class MultiCollectionRetrieval(Retriever):
+    """
+    Search several collections (e.g. one per episode or per character)
+    concurrently and merge the hits into one global top-k.
+
+    The query is embedded once. Each collection gets its own deadline: a
+    collection that does not answer in `timeout` seconds, or fails, is
+    skipped and listed in `failed_collections`, so a slow shard degrades the
+    result instead of failing the whole request.
+    """
+
+    def __init__(self):
+        self.failed_collections: list[str] = []
+
+    @staticmethod
+    def format_hit(payload):
+        if 'text' in payload:
+            return StructuredCSVRetrieval.format_turn(payload)
+        return f"{payload.get('value', '')}\n"
+
+    def retrieve(
+        self,
+        collection_names,
+        embedding_model_path,
+        query,
+        top_k=20,
+        timeout=2.0,
+        hybrid=False,
+        normalization="none",
+    ):
+        client = QdrantConnector().connect()
+        qc = QdrantController(client)
+        embedding_model = EmbeddingModelController(model_name=embedding_model_path)
+        with span("embed_query"):
+            query_vector = embedding_model.embed(query)
+            sparse_vector = SparseModelController().embed_query(query) if hybrid else None
+
+        @span("search")
+        def search(collection_name):
+            if hybrid:
+                return qc.hybrid_search(
+                    collection_name=collection_name,
+                    query_vector=query_vector,
+                    sparse_vector=sparse_vector,
+                    limit=top_k,
+                )
+            return qc.search(
+                collection_name=collection_name,
+                query_vector=query_vector,
+                limit=top_k,
+            )
+
+        futures = {name: _SEARCH_POOL.submit(propagate(search), name) for name in collection_names}
+        deadline = time.monotonic() + timeout
+        self.failed_collections = []
+        candidates = []
+        for name, future in futures.items():
+            try:
+                hits = future.result(timeout=max(deadline - time.monotonic(), 0))
+            except FutureTimeoutError:
+                future.cancel()
+                logger.warning(f"search on collection '{name}' timed out after {timeout}s, skipping it")
+                self.failed_collections.append(name)
+                continue
+            except Exception as e:
+                logger.warning(f"search on collection '{name}' failed, skipping it: {e}")
+                self.failed_collections.append(name)
+                continue
+            scores = normalize_scores([hit.score for hit in hits], normalization)
+            candidates.extend((score, name, hit) for score, hit in zip(scores, hits))
+
+        best = heapq.nlargest(top_k, candidates, key=lambda c: c[0])
+        return [
+            {
+                "collection": name,
+                "idx": hit.payload.get('source', ''),
+                "text": self.format_hit(hit.payload),
+                "score": score,
+            }
+            for score, name, hit in best
+        ]
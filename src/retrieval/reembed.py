@@ -0,0 +1,214 @@
+"""
+Re-embed collections whose embedding model changed.
+
+    python src/retrieval/reembed.py --status
+    python src/retrieval/reembed.py --collection_name ironman --max_busy_fraction 0.3
+"""
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import argparse
+import json
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+import numpy as np
+from database.model_registry import ModelRegistry
+from database.qdrant_controller import FOLDED_FIELD, TENANT_FIELD
+from model_management.embedding_model_controller import EmbeddingModelController, model_fingerprint
+from retrieval.style_index import StyleIndex
+
+logger = logging.getLogger(__name__)
+
+
+def document_of(payload: dict) -> str | None:
+    """The text a point's dense vector was embedded from, None for a point without one."""
+    if FOLDED_FIELD in payload:
+        return None
+    # Contextual collections embed the generated key, naive_csv and memory
+    # collections the stored "talker: text".
+    return payload.get("key") or payload.get("text")
+
+
+class ReembedJob:
+    """
+    Rebuild the dense vectors of one stale collection in place from its
+    stored payloads, so neither the original CSV nor the LLM is needed.
+    Sparse vectors and payloads are left alone.
+
+    Points are processed `batch_size` at a time in id order, and progress
+    (points done, scroll offset, target fingerprint) is saved in the
+    `ModelRegistry` after every batch, so an interrupted job resumes where it
+    stopped; a job whose target model changed again starts over. Two
+    throttles protect serving: the job is busy at most `max_busy_fraction`
+    of the wall-clock time, and re-embeds at most `max_points_per_second`.
+    Queries already use the new model, so every re-embedded batch makes a
+    stale collection more accurate, not less.
+    """
+
+    def __init__(
+        self,
+        collection_name: str,
+        registry: ModelRegistry | None = None,
+        batch_size: int = 64,
+        max_busy_fraction: float = 0.5,
+        max_points_per_second: float | None = None,
+        stop_event: threading.Event | None = None,
+    ):
+        self.collection_name = collection_name
+        self.registry = registry or ModelRegistry()
+        self.qc = self.registry.qc
+        self.batch_size = batch_size
+        self.max_busy_fraction = max_busy_fraction
+        self.max_points_per_second = max_points_per_second
+        self._stop = stop_event or threading.Event()
+
+    def _throttle(self, busy_seconds: float, points: int) -> None:
+        pause = busy_seconds * (1 - self.max_busy_fraction) / self.max_busy_fraction
+        if self.max_points_per_second:
+            pause = max(pause, points / self.max_points_per_second - busy_seconds)
+        if pause > 0:
+            self._stop.wait(pause)
+
+    def _rebuild_style(self) -> None:
+        style = StyleIndex(self.qc)
+        style_collection = style.collection_for(self.collection_name)
+        if not self.qc.collection_exists(style_collection):
+            return
+        points, _ = self.qc.client.scroll(style_collection, limit=100000, with_payload=[TENANT_FIELD])
+        for tenant in sorted({p.payload.get(TENANT_FIELD) for p in points}, key=str):
+            style.rebuild(self.collection_name, tenant=tenant)
+
+    def run(self) -> dict:
+        """Re-embed until done or stopped; returns the progress record."""
+        record = self.registry.get(self.collection_name)
+        if record is None:
+            raise ValueError(f"Collection '{self.collection_name}' is not in the model registry")
+        target = model_fingerprint(record["model_path"])
+        if target == record["fingerprint"]:
+            return {"status": "current"}
+
+        progress = record.get("reembed")
+        if not progress or progress.get("target") != target:
+            progress = {
+                "target": target,
+                "status": "running",
+                "done": 0,
+                "total": self.qc.client.count(self.collection_name, exact=True).count,
+                "skipped": 0,
+                "offset": None,
+                "started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            }
+        embedding_model = EmbeddingModelController(model_name=record["model_path"])
+        collection_dim = self.qc.client.get_collection(self.collection_name).config.params.vectors.size
+
+        progress["status"] = "running"
+        while not self._stop.is_set():
+            start = time.perf_counter()
+            points, offset = self.qc.client.scroll(
+                collection_name=self.collection_name,
+                limit=self.batch_size,
+                offset=progress["offset"],
+                with_payload=True,
+                with_vectors=False,
+            )
+            documents = [(p.id, document_of(p.payload or {})) for p in points]
+            documents = [(point_id, text) for point_id, text in documents if text]
+            if documents:
+                vectors = np.asarray(embedding_model.embed([text for _, text in documents]), dtype=np.float32)
+                if vectors.shape[1] != collection_dim:
+                    # Vectors cannot be swapped in place; the collection must be re-indexed.
+                    progress["status"] = f"dimension_mismatch: model {vectors.shape[1]}, collection {collection_dim}"
+                    self.registry.set_progress(self.collection_name, progress)
+                    return progress
+                self.qc.update_dense_vectors(self.collection_name, [point_id for point_id, _ in documents], vectors)
+            progress["done"] += len(points)
+            progress["skipped"] += len(points) - len(documents)
+            progress["offset"] = offset
+            if offset is None:
+                break
+            self.registry.set_progress(self.collection_name, progress)
+            self._throttle(time.perf_counter() - start, len(points))
+        else:
+            progress["status"] = "paused"
+            self.registry.set_progress(self.collection_name, progress)
+            return progress
+
+        self._rebuild_style()
+        progress["status"] = "done"
+        self.registry.tag(self.collection_name, record["model_path"], target)
+        logger.info(f"re-embedded '{self.collection_name}': {progress['done']} points")
+        return progress
+
+
+class ReembedWorker:
+    """Every `interval_seconds`, re-embed the stale collections of the registry, one at a time."""
+
+    def __init__(self, registry: ModelRegistry | None = None, interval_seconds: float = 60, **job_kwargs):
+        self.registry = registry or ModelRegistry()
+        self.interval_seconds = interval_seconds
+        self.job_kwargs = job_kwargs
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self.current: str | None = None
+
+    def run_once(self, collection_names: list[str] | None = None) -> dict:
+        results = {}
+        for status in self.registry.status():
+            name = status["collection"]
+            if self._stop.is_set():
+                break
+            if not status["stale"] or not status["exists"] or (collection_names and name not in collection_names):
+                continue
+            self.current = name
+            try:
+                results[name] = ReembedJob(name, self.registry, stop_event=self._stop, **self.job_kwargs).run()
+            except Exception as e:
+                logger.warning(f"re-embedding '{name}' failed, will retry: {e}")
+            finally:
+                self.current = None
+        return results
+
+    def start(self, collection_names: list[str] | None = None, once: bool = False) -> None:
+        def loop():
+            while not self._stop.is_set():
+                self.run_once(collection_names)
+                if once:
+                    break
+                self._stop.wait(self.interval_seconds)
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=loop, name="reembed", daemon=True)
+        self._thread.start()
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+def argparser():
+    parser = argparse.ArgumentParser(description="Re-embed collections whose embedding model changed")
+    parser.add_argument("--status", action="store_true", help="Only list the registered collections")
+    parser.add_argument("--collection_name", type=str, nargs="*", default=None, help="Only these collections")
+    parser.add_argument("--batch_size", type=int, default=64)
+    parser.add_argument("--max_busy_fraction", type=float, default=0.5, help="Share of the time spent embedding")
+    parser.add_argument("--max_points_per_second", type=float, default=None)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    args = argparser()
+    worker = ReembedWorker(
+        batch_size=args.batch_size,
+        max_busy_fraction=args.max_busy_fraction,
+        max_points_per_second=args.max_points_per_second,
+    )
+    if not args.status:
+        print(json.dumps(worker.run_once(args.collection_name), indent=2, default=str))
+    print(json.dumps(worker.registry.status(), indent=2, default=str))
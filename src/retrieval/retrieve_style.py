@@ -2,9 +2,16 @@ import pandas as pd
 from sentence_transformers import SentenceTransformer
 import numpy as np
 from sklearn.metrics.pairwise import cosine_similarity
+from retrieval.dedup import MinHashDeduplicator
 class RStyle:
-    def __init__(self, model_name):
+    """
+    One-off style analysis of a CSV file. For indexed collections use
+    `retrieval.style_index.StyleIndex`, which keeps the same profile
+    precomputed for every talker.
+    """
+    def __init__(self, model_name, talker="sky"):
         self.model = SentenceTransformer(model_name)
+        self.talker = talker
     def read_file(self, all_dataset):
         with open(all_dataset, 'r', encoding='utf-8') as f:
             reader = pd.read_csv(f)
@@ -14,7 +21,7 @@ class RStyle:
 
             results = []
             for i in range(len(list_of_text)):
-                if talker[i].lower() == "sky":
+                if str(talker[i]).lower() == self.talker.lower():
 
                     _dict = {
                         'text': list_of_text[i],
@@ -32,25 +39,20 @@ class RStyle:
         return embeddings, avg_embedding
     
     def remove_duplicates(self, data):
-        seen = set()
-        unique_data = []
-        for item in data:
-            text = item['text'].strip()
-            if text not in seen:
-                seen.add(text)
-                unique_data.append(item)
-        return unique_data
+        """Keep the first of every group of (near-)duplicate texts."""
+        clusters = MinHashDeduplicator().clusters([item['text'].strip() for item in data])
+        return [data[cluster[0]] for cluster in clusters]
     def calculate_similarity(self, data, embeddings, avg_embedding):
         topk = 20
-        similarities = cosine_similarity([avg_embedding], embeddings)
-        max_indices = np.argsort(similarities, axis=1)[:, :]
-        top_indices = max_indices[0][::-1]  # reverse to get highest similarity first
-        bot_indices = max_indices[0]
-        most_sim_dialogues = [data[i] for i in top_indices[:topk]][::-1] # biggest to smallest   
-        most_sim_dialogues = [data[i] for i in top_indices] # biggest to smallest   
-        most_sim_dialogues = self.remove_duplicates(most_sim_dialogues)
-        least_sim_dialogues = [data[i] for i in bot_indices[:topk]]# smallest to biggest   
-        similarities = similarities[0]
+        similarities = cosine_similarity([avg_embedding], embeddings)[0]
+        # Only the ends of the ranking are needed: partition, then sort those.
+        k = min(topk, len(similarities))
+        top_indices = np.argpartition(-similarities, k - 1)[:k]
+        top_indices = top_indices[np.argsort(-similarities[top_indices])] # biggest to smallest
+        bot_indices = np.argpartition(similarities, k - 1)[:k]
+        bot_indices = bot_indices[np.argsort(similarities[bot_indices])] # smallest to biggest
+        most_sim_dialogues = self.remove_duplicates([data[i] for i in top_indices])
+        least_sim_dialogues = [data[i] for i in bot_indices]
         most_sim_scores = [similarities[i] for i in top_indices]
         least_sim_scores = [similarities[i] for i in bot_indices]
         
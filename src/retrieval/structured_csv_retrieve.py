@@ -1,43 +1,133 @@
+import logging
+import re
+import time as timer
+from datetime import datetime, timezone
+from dateutil import parser as date_parser
 from retrieval.base import Indexer, Retriever
+from retrieval.dedup import MinHashDeduplicator
+from retrieval.style_index import StyleIndex
 from model_management.embedding_model_controller import EmbeddingModelController
+from model_management.sparse_model_controller import SparseModelController
+from model_management.reranker_model_controller import DEFAULT_RERANKER_MODEL
 from qdrant_client.http.models import PointStruct
 from database.connector import QdrantConnector
-from database.qdrant_controller import QdrantController
+from database.qdrant_controller import QdrantController, FOLDED_FIELD, TENANT_FIELD, TIMESTAMP_FIELD
+from database.model_registry import ModelRegistry
+from tracing import span
 import pandas as pd
 from pydantic import BaseModel
 from typing import List, Any
 import os
+
+logger = logging.getLogger(__name__)
+
+_YEAR = re.compile(r"\d{4}")
+
+
+def parse_timestamp(value) -> str | None:
+    """
+    RFC 3339 (UTC) form of a `time` cell such as "2023-05-08 13:56" or
+    "1:56 pm on 8 May, 2023", or None if it does not name a date. Times
+    without a zone are taken as UTC.
+    """
+    if not isinstance(value, str) or not _YEAR.search(value):
+        # Fuzzy parsing would fill a missing date in from today's.
+        return None
+    try:
+        parsed = date_parser.parse(value, fuzzy=True)
+    except (ValueError, OverflowError):
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+def newest_row(rows, timestamps) -> int:
+    """The most recent of `rows` by `timestamps` (row -> RFC 3339 or None), else the first."""
+    dated = [i for i in rows if timestamps.get(i)]
+    if not dated:
+        return rows[0]
+    return max(dated, key=lambda i: (datetime.fromisoformat(timestamps[i]), -i))
+
+
 class StructuredDialogue(BaseModel):
     text: str
     talker: str
     time: Any
     source: Any = None
     embedding: List[float]
+    sparse_embedding: Any = None
+    row: int | None = None  # CSV row; rows can be missing after deduplication
+    duplicate_sources: List[Any] = []  # `source` of the near-duplicates this row stands for
+    folded: List[dict] = []  # text, talker, time, source and row of those near-duplicates
+    timestamp: str | None = None  # `time` as RFC 3339, for recency-weighted search
     
 class StructuredQdrantController(QdrantController):
     def __init__(self, client):
         super().__init__(client)
 
-    def batch_struct_points(self, points: list[StructuredDialogue]):
-        """Convert a list of ContextualKeyValuePair to PointStruct."""
-        return [
-            PointStruct(
-                id=i,
+    def batch_struct_points(self, points: list[StructuredDialogue], tenant: str | None = None):
+        """Convert a list of StructuredDialogue to PointStruct (optionally
+        owned by `tenant` in a shared collection)."""
+        points_out = []
+        for i, point in enumerate(points):
+            row = point.row if point.row is not None else i
+            payload = {
+                "text": point.text, 
+                "talker": point.talker,
+                "time": point.time,
+                "source": point.source,
+                "row": row,
+            }
+            if point.duplicate_sources:
+                payload["duplicate_sources"] = point.duplicate_sources
+            if point.timestamp is not None:
+                payload[TIMESTAMP_FIELD] = point.timestamp
+            if tenant is not None:
+                payload[TENANT_FIELD] = tenant
+            points_out.append(self.make_point(
+                point_id=self.make_point_id(row, tenant),
                 vector=point.embedding,
-                payload={
-                    "text": point.text, 
-                    "talker": point.talker,
-                    "time": point.time,
-                    "source": point.source}
-            )
-            for i, point in enumerate(points)
-        ]
+                payload=payload,
+                sparse_vector=point.sparse_embedding,
+            ))
+            for folded in point.folded:
+                # No vector: the line is found through its representative,
+                # but keeps its row so context expansion has no gaps.
+                folded_payload = {**folded, FOLDED_FIELD: row}
+                if tenant is not None:
+                    folded_payload[TENANT_FIELD] = tenant
+                points_out.append(self.make_point(
+                    point_id=self.make_point_id(folded["row"], tenant),
+                    vector={},
+                    payload=folded_payload,
+                ))
+        return points_out
 
 class StructuredCSVIndexing(Indexer):  
     def __init__(self):
-        pass
+        # Statistics of the last `read_and_embed` run (rows, embedded,
+        # duplicates, embed_seconds, ...), for reporting.
+        self.report = {}
     
-    def index(self, *, embedding_model_path, file_path, collection_name):
+    def index(self, *, embedding_model_path, file_path, collection_name, hybrid=True, tenant=None, dedup=True, style=True):
+        """
+        Embed every row of the CSV into `collection_name`. With `hybrid`
+        (the default) each point also gets a sparse lexical vector so the
+        collection can serve hybrid queries.
+
+        With `dedup` (the default), near-duplicate lines of the same talker
+        are embedded and searched once; the representative keeps the `source`
+        of the others in `duplicate_sources`. The others are stored without
+        a vector (see `FOLDED_FIELD`), so context expansion still shows them.
+
+        With `style` (the default), the per-talker style index
+        (`{collection_name}_style`, see `StyleIndex`) is updated with the rows.
+
+        With `tenant`, `collection_name` is a shared multi-tenant collection
+        (created on first use) and the rows are stored under that tenant;
+        indexing is skipped if the tenant already has points.
+        """
         if not file_path.endswith('.csv'):
             raise ValueError("The class must pass a CSV file.")
         
@@ -45,24 +135,49 @@ class StructuredCSVIndexing(Indexer):
         qc = StructuredQdrantController(client)
         existing_collection = qc.collection_exists(collection_name)
         
-        if existing_collection:
+        if existing_collection and (tenant is None or qc.tenant_exists(collection_name, tenant)):
             return
-        embeddings = self.read_and_embed(embedding_model_path, file_path)
+        with span("read_and_embed"):
+            embeddings = self.read_and_embed(embedding_model_path, file_path, sparse=hybrid, dedup=dedup)
         struct_points = qc.batch_struct_points(
-            points=embeddings
-        )
-        qc.create_collection(
-            name=collection_name, 
-            vector_size=len(embeddings[0].embedding)
+            points=embeddings,
+            tenant=tenant,
         )
+        if not existing_collection:
+            qc.create_collection(
+                name=collection_name, 
+                vector_size=len(embeddings[0].embedding),
+                # Tenants share the collection, so it always accepts sparse vectors.
+                sparse=hybrid or tenant is not None,
+                multitenant=tenant is not None,
+            )
         
-        qc.upsert_points(
-            collection=collection_name, 
-            points=struct_points)
-        
+        with span("upsert"):
+            qc.upsert_points(
+                collection=collection_name, 
+                points=struct_points)
+        if not existing_collection:
+            # Tag at creation, so a later retrain in place shows up as stale.
+            ModelRegistry(qc).tag(collection_name, embedding_model_path)
+        if style:
+            with span("style"):
+                StyleIndex(qc).update(collection_name, embeddings, tenant=tenant)
+
+    def delete(self, *, collection_name, tenant=None):
+        """Drop the index and its style index."""
+        super().delete(collection_name=collection_name, tenant=tenant)
+        super().delete(collection_name=StyleIndex.collection_for(collection_name), tenant=tenant)
+
             
 
-    def read_and_embed(self, embedding_model_path, all_dataset, add_talker=True, text_embedding_only=False):
+    def read_and_embed(self, embedding_model_path, all_dataset, add_talker=True, text_embedding_only=False, sparse=False, dedup=False):
+        """
+        Read the dialogue CSV and embed it. With `dedup`, only one
+        representative of every cluster of near-duplicate lines is embedded
+        and returned; see `self.report`. The representative is the most
+        recent line (by `time`, else the first one), so that a line repeated
+        lately is as recent as its last occurrence for recency-weighted search.
+        """
         embedding_model = EmbeddingModelController(model_name=embedding_model_path)
         with open(all_dataset, 'r', encoding='utf-8') as f:
             reader = pd.read_csv(f)
@@ -73,58 +188,233 @@ class StructuredCSVIndexing(Indexer):
             
             if add_talker:
                 talker_text = [f"{spk}: {txt}" for spk, txt in zip(talker, list_of_text)]
-                text_embeddings = embedding_model.embed(talker_text)
-            else:
-                text_embeddings = embedding_model.embed(list_of_text)
+            texts = talker_text if add_talker else list_of_text
+
+            # Talkers are deduplicated separately: the same "Yeah." from two
+            # people is two different turns.
+            clusters = [[i] for i in range(len(texts))]
+            if dedup:
+                with span("dedup"):
+                    by_talker = {}
+                    for i, spk in enumerate(talker):
+                        by_talker.setdefault(spk, []).append(i)
+                    deduplicator = MinHashDeduplicator()
+                    clusters = sorted(
+                        [rows[j] for j in cluster]
+                        for rows in by_talker.values()
+                        for cluster in deduplicator.clusters([list_of_text[i] for i in rows])
+                    )
+            timestamps = {}
+            for cluster in clusters:
+                if len(cluster) > 1:
+                    for i in cluster:
+                        timestamps[i] = parse_timestamp(time[i])
+            representatives = [newest_row(cluster, timestamps) for cluster in clusters]
+
+            start = timer.perf_counter()
+            with span("embed"):
+                text_embeddings = embedding_model.embed([texts[i] for i in representatives])
+            embed_seconds = timer.perf_counter() - start
             if text_embedding_only:
                 return text_embeddings
-            results = []
-            for i in range(len(list_of_text)):
-                if add_talker:
-                    obj = StructuredDialogue(
-                        text=talker_text[i],
-                        talker=talker[i],
-                        time=time[i],
-                        source=source[i],
-                        embedding=text_embeddings[i]
+            sparse_embeddings = [None] * len(representatives)
+            if sparse:
+                with span("sparse"):
+                    sparse_embeddings = SparseModelController().embed_documents(
+                        [texts[i] for i in representatives]
                     )
-                   
-                else:
-                    obj = StructuredDialogue(
-                        text=list_of_text[i],
-                        talker=talker[i],
-                        time=time[i],
-                        source=source[i],
-                        embedding=text_embeddings[i]
-                    )
-                   
+            results = []
+            for n, (i, cluster) in enumerate(zip(representatives, clusters)):
+                obj = StructuredDialogue(
+                    text=texts[i],
+                    talker=talker[i],
+                    time=time[i],
+                    source=source[i],
+                    embedding=text_embeddings[n],
+                    sparse_embedding=sparse_embeddings[n],
+                    row=i,
+                    duplicate_sources=[source[j] for j in cluster if j != i],
+                    folded=[
+                        {"text": texts[j], "talker": talker[j], "time": time[j], "source": source[j], "row": j}
+                        for j in cluster if j != i
+                    ],
+                    timestamp=timestamps[i] if i in timestamps else parse_timestamp(time[i]),
+                )
                 results.append(obj)
+
+        duplicates = len(list_of_text) - len(results)
+        dim = len(results[0].embedding) if results else 0
+        self.report = {
+            "rows": len(list_of_text),
+            "embedded": len(results),
+            "duplicates": duplicates,
+            "embed_seconds": embed_seconds,
+            # Extrapolated from the measured per-line embedding cost.
+            "embed_seconds_saved": embed_seconds / max(len(results), 1) * duplicates,
+            # float32 dense vectors that were not stored (payload and
+            # sparse vectors come on top).
+            "vector_bytes_saved": duplicates * dim * 4,
+        }
+        if dedup:
+            logger.info(
+                f"{all_dataset}: embedded {len(results)}/{len(list_of_text)} rows, "
+                f"{duplicates} near-duplicates folded in, {embed_seconds:.2f}s embedding "
+                f"(~{self.report['embed_seconds_saved']:.2f}s and "
+                f"{self.report['vector_bytes_saved'] / 1024:.0f} KiB of vectors saved)"
+            )
         return results
     
 
 class StructuredCSVRetrieval(Retriever):
-    def retrieve(self, collection_name, embedding_model_path, query, top_k=20):
+    def retrieve(
+        self,
+        collection_name,
+        embedding_model_path,
+        query,
+        top_k=20,
+        hybrid=False,
+        rerank_k=None,
+        final_k=None,
+        reranker_model=DEFAULT_RERANKER_MODEL,
+        rerank_budget_ms=None,
+        context_window=0,
+        tenant=None,
+        recency_half_life_days=None,
+        recency_weight=0.3,
+        recency_now=None,
+    ):
+        """
+        Dense vector search, or with `hybrid` a single dense + sparse query
+        fused server-side (the collection must have been indexed with sparse
+        vectors).
+
+        With `rerank_k`, that many candidates are fetched and reranked by a
+        cross-encoder within `rerank_budget_ms`, keeping the best `final_k`
+        (default `top_k`).
+
+        With `context_window` > 0, every hit is expanded to the turns around
+        it (see `expand_context`).
+
+        With `tenant`, only that tenant's points of a shared collection are searched.
+
+        With `recency_half_life_days`, recent turns are boosted inside the
+        search request: a turn that old gets half of `recency_weight` added
+        to its similarity (see `QdrantController.recency_search`). Ages are
+        measured from `recency_now` (RFC 3339, default: now).
+        """
+        limit = rerank_k or top_k
         client = QdrantConnector().connect()
         qc = StructuredQdrantController(client)
         embedding_model = EmbeddingModelController(model_name=embedding_model_path)
-        query_vector = embedding_model.embed(query)
-        search_result = qc.search(
-            collection_name=collection_name,
-            query_vector=query_vector,
-            limit=top_k
-        )
+        with span("embed_query"):
+            query_vector = embedding_model.embed(query)
+        query_filter = qc.tenant_filter(tenant) if tenant is not None else None
+        with span("search"):
+            if recency_half_life_days:
+                search_result = qc.recency_search(
+                    collection_name=collection_name,
+                    query_vector=query_vector,
+                    half_life_seconds=recency_half_life_days * 86400,
+                    weight=recency_weight,
+                    limit=limit,
+                    query_filter=query_filter,
+                    sparse_vector=SparseModelController().embed_query(query) if hybrid else None,
+                    now=recency_now,
+                )
+            elif hybrid:
+                search_result = qc.hybrid_search(
+                    collection_name=collection_name,
+                    query_vector=query_vector,
+                    sparse_vector=SparseModelController().embed_query(query),
+                    limit=limit,
+                    query_filter=query_filter,
+                )
+            else:
+                search_result = qc.search(
+                    collection_name=collection_name,
+                    query_vector=query_vector,
+                    limit=limit,
+                    query_filter=query_filter,
+                )
+        if rerank_k:
+            with span("rerank"):
+                search_result = self.rerank(
+                    query,
+                    search_result,
+                    [result.payload['text'] for result in search_result],
+                    top_k=final_k or top_k,
+                    reranker_model=reranker_model,
+                    budget_ms=rerank_budget_ms,
+                )
+        if context_window:
+            with span("expand_context"):
+                return self.expand_context(qc, collection_name, search_result, context_window, tenant=tenant)
         
         str_output = ""
         list_of_content = []
         for result in search_result:
-            text = result.payload['text']
-            talker = result.payload.get('talker', '')
-            time = result.payload.get('time', '')
-            tt = f"[{time}] {talker}: {text}\n"
+            tt = self.format_turn(result.payload)
             str_output += tt
             list_of_content.append({
                 "idx": result.payload.get('source', ''),
-                "text": tt
+                "text": tt,
+                "duplicates": self.stands_for(result.payload),
+            })
+        return list_of_content
+
+    @staticmethod
+    def _row_of(point):
+        return (point.payload or {}).get("row", point.id)
+
+    @staticmethod
+    def stands_for(payload):
+        """`source` of the lines a point replaced: folded near-duplicates and consolidated turns."""
+        return payload.get('duplicate_sources', []) + payload.get('consolidated_sources', [])
+
+    @staticmethod
+    def format_turn(payload):
+        text = payload['text']
+        talker = payload.get('talker', '')
+        time = payload.get('time', '')
+        return f"[{time}] {talker}: {text}\n"
+
+    def expand_context(self, qc, collection_name, hits, window, tenant=None):
+        """
+        Expand each hit to the `window` turns before and after it.
+
+        Point ids are derived from row numbers, so the neighbours of every
+        hit are fetched together in one `get_points` call. Overlapping or touching windows are
+        merged into a single snippet, and snippets are ordered by their best
+        hit. Each item's `idx` lists the `source` of every turn it contains.
+        Folded near-duplicates are stored (without a vector) at their own
+        row, so windows have no gaps; `duplicates` lists only the lines a
+        snippet stands for without showing them.
+        """
+        if not hits:
+            return []
+        # Points written before rows were stored in the payload use the row as id.
+        rank = {self._row_of(hit): r for r, hit in enumerate(hits)}
+        # Merge [id - window, id + window] intervals, walking hits by row.
+        runs = []
+        for row in sorted(rank):
+            start, end = max(row - window, 0), row + window
+            if runs and start <= runs[-1][1] + 1:
+                runs[-1][1] = max(runs[-1][1], end)
+                runs[-1][2] = min(runs[-1][2], rank[row])
+            else:
+                runs.append([start, end, rank[row]])
+
+        ids = [qc.make_point_id(i, tenant) for start, end, _ in runs for i in range(start, end + 1)]
+        points = {self._row_of(p): p for p in qc.get_points(collection_name, ids)}
+
+        list_of_content = []
+        for start, end, _ in sorted(runs, key=lambda run: run[2]):
+            turns = [points[i].payload for i in range(start, end + 1) if i in points]
+            idx = [turn.get('source', '') for turn in turns]
+            list_of_content.append({
+                "idx": idx,
+                "text": "".join(self.format_turn(turn) for turn in turns),
+                "duplicates": [dup for turn in turns for dup in self.stands_for(turn) if dup not in idx],
             })
         return list_of_content
 
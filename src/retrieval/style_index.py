@@ -0,0 +1,157 @@
+import uuid
+from types import SimpleNamespace
+import numpy as np
+from database.connector import QdrantConnector
+from database.qdrant_controller import QdrantController, TENANT_FIELD
+
+STYLE_SUFFIX = "_style"
+
+
+class StyleIndex:
+    """
+    Per-talker style profile kept next to a dialogue collection.
+
+    `{collection}_style` holds one point per talker: its vector is the
+    talker's centroid (the mean of their normalised line embeddings) and its
+    payload the running vector sum, the line count and a pool of the
+    `pool_size` lines closest to the centroid. Adding rows only touches the
+    talkers involved: their sum is updated and the pool is re-scored against
+    the new centroid together with the new lines, so no pass over the corpus
+    is ever needed. Looking a talker up is a single point read.
+
+    The pool is re-ranked, not rebuilt, when the centroid moves; keeping it a
+    few times larger than the number of representatives served makes that
+    approximation negligible.
+    """
+
+    def __init__(self, qc: QdrantController | None = None, pool_size: int = 40):
+        self.qc = qc or QdrantController(QdrantConnector().connect())
+        self.pool_size = pool_size
+
+    @staticmethod
+    def collection_for(collection_name: str) -> str:
+        return f"{collection_name}{STYLE_SUFFIX}"
+
+    @staticmethod
+    def talker_id(talker: str, tenant: str | None = None) -> str:
+        return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{tenant or ''}/style/{talker}"))
+
+    @staticmethod
+    def _plain(value):
+        # pandas reads empty cells as NaN, which is not valid JSON.
+        return "" if isinstance(value, float) and value != value else value
+
+    @staticmethod
+    def _normalize(vectors) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+    def update(self, collection_name: str, dialogues, tenant: str | None = None) -> None:
+        """
+        Fold `dialogues` (objects with `talker`, `text`, `time`, `source`,
+        `row` and `embedding`, e.g. `StructuredDialogue`) into the style
+        profiles of their talkers.
+        """
+        if not dialogues:
+            return
+        style_collection = self.collection_for(collection_name)
+        if not self.qc.collection_exists(style_collection):
+            self.qc.create_collection(
+                name=style_collection,
+                vector_size=len(dialogues[0].embedding),
+                multitenant=tenant is not None,
+            )
+
+        by_talker: dict[str, list] = {}
+        for dialogue in dialogues:
+            by_talker.setdefault(str(dialogue.talker), []).append(dialogue)
+        ids = {talker: self.talker_id(talker, tenant) for talker in by_talker}
+        existing = {
+            point.payload["talker"]: point.payload
+            for point in self.qc.get_points(style_collection, list(ids.values()))
+        }
+
+        points = []
+        for talker, lines in by_talker.items():
+            previous = existing.get(talker, {})
+            vectors = self._normalize([line.embedding for line in lines])
+            vector_sum = vectors.sum(axis=0) + np.asarray(previous.get("vector_sum", 0.0), dtype=np.float32)
+            count = previous.get("count", 0) + len(lines)
+            centroid = self._normalize(vector_sum / count)
+
+            pool = list(previous.get("pool", []))
+            pool += [
+                {"text": line.text, "time": self._plain(line.time), "source": self._plain(line.source),
+                 "row": line.row, "embedding": vector.tolist()}
+                for line, vector in zip(lines, vectors)
+            ]
+            scores = self._normalize([entry["embedding"] for entry in pool]) @ centroid
+            keep = np.argsort(-scores, kind="stable")[:self.pool_size]
+            pool = [{**pool[i], "score": float(scores[i])} for i in keep]
+
+            payload = {
+                "talker": talker,
+                "count": count,
+                "vector_sum": vector_sum.tolist(),
+                "pool": pool,
+            }
+            if tenant is not None:
+                payload[TENANT_FIELD] = tenant
+            points.append(self.qc.make_point(ids[talker], centroid.tolist(), payload))
+        self.qc.upsert_points(collection=style_collection, points=points)
+
+    def get(self, collection_name: str, talker: str, top_n: int = 10, tenant: str | None = None) -> dict | None:
+        """
+        Style profile of `talker`: the number of lines seen and the `top_n`
+        lines closest to their centroid, best first. None if the talker (or
+        the style index) is unknown.
+        """
+        style_collection = self.collection_for(collection_name)
+        if not self.qc.collection_exists(style_collection):
+            return None
+        points = self.qc.get_points(style_collection, [self.talker_id(talker, tenant)])
+        if not points:
+            return None
+        payload = points[0].payload
+        return {
+            "talker": payload["talker"],
+            "count": payload["count"],
+            "representatives": [
+                {key: value for key, value in entry.items() if key != "embedding"}
+                for entry in payload["pool"][:top_n]
+            ],
+        }
+
+    def rebuild(self, collection_name: str, tenant: str | None = None, batch_size: int = 512) -> None:
+        """Build the style index of an existing dialogue collection from its stored vectors."""
+        style_collection = self.collection_for(collection_name)
+        if self.qc.collection_exists(style_collection):
+            if tenant is None:
+                self.qc.delete_collection(style_collection)
+            else:
+                self.qc.delete_tenant(style_collection, tenant)
+        scroll_filter = self.qc.embedded_filter(self.qc.tenant_filter(tenant) if tenant is not None else None)
+        offset = None
+        while True:
+            points, offset = self.qc.client.scroll(
+                collection_name=collection_name,
+                scroll_filter=scroll_filter,
+                limit=batch_size,
+                offset=offset,
+                with_payload=True,
+                with_vectors=True,
+            )
+            self.update(collection_name, [
+                SimpleNamespace(
+                    talker=p.payload.get("talker", ""),
+                    text=p.payload.get("text", ""),
+                    time=p.payload.get("time", ""),
+                    source=p.payload.get("source", ""),
+                    row=p.payload.get("row", p.id),
+                    embedding=p.vector[""] if isinstance(p.vector, dict) else p.vector,
+                )
+                for p in points
+            ], tenant=tenant)
+            if offset is None:
+                break
@@ -1,8 +1,45 @@
 import os
 import argparse
-print("pwd :::",os.getcwd())
-from retrieval.cl_retrieve import CLRetrieve
+import json
+import logging
+import threading
+from collections import OrderedDict
 from file_util import resolve_model_path
+from tracing import PROFILE_MODES, span, trace
+
+# Models, Qdrant and the retrievers are imported where they are used, so the
+# CLI stays a thin client of the retrieve daemon (retrieve_daemon.py).
+
+logger = logging.getLogger(__name__)
+
+# Embedded files of one_time_retrieve_mode, keyed by model and file version.
+_TEXT_EMBEDDINGS: OrderedDict = OrderedDict()
+_TEXT_EMBEDDINGS_SIZE = 8
+_TEXT_EMBEDDINGS_LOCK = threading.Lock()
+
+# (collection, model fingerprint) pairs `check_model` found to match.
+_MATCHING_MODELS: set = set()
+
+
+def check_model(collection_name, embedding_model_path):
+    """
+    Tag an untagged collection with its model; warn if its vectors come from
+    another one. A collection found to match the model is not looked up
+    again by this process until the model changes.
+    """
+    from database.model_registry import ModelRegistry
+    from model_management.embedding_model_controller import model_fingerprint
+    fingerprint = model_fingerprint(embedding_model_path)
+    if (collection_name, fingerprint) in _MATCHING_MODELS:
+        return
+    record = ModelRegistry().ensure_tagged(collection_name, embedding_model_path)
+    if record["fingerprint"] != fingerprint:
+        logger.warning(
+            f"collection '{collection_name}' was embedded with another version of the model; "
+            f"re-embed it (retrieval/reembed.py) for accurate results"
+        )
+    else:
+        _MATCHING_MODELS.add((collection_name, fingerprint))
 
 def argparser():
     parser = argparse.ArgumentParser(description="Contrastive Learning Training/Evaluation/Retrieval Script")
@@ -12,68 +49,210 @@ def argparser():
     parser.add_argument("--top_k", type=int, default=20, help="Number of top results to retrieve")
     parser.add_argument("--qdrant", action="store_true", help="Use Qdrant for retrieval")
     parser.add_argument("--mode", "-m", type=str, choices=["naive_csv", "contextual"], default="naive_csv", help="Mode of operation: naive_csv or contextual")
+    parser.add_argument("--hybrid", action="store_true", help="Fuse dense and sparse lexical search (Qdrant only)")
+    parser.add_argument("--rerank_k", type=int, default=None, help="Rerank this many candidates with a cross-encoder (Qdrant only)")
+    parser.add_argument("--final_k", type=int, default=None, help="Results kept after reranking (defaults to top_k)")
+    parser.add_argument("--reranker_model", type=str, default=None, help="Cross-encoder used for reranking")
+    parser.add_argument("--rerank_budget_ms", type=float, default=None, help="Latency budget for reranking, in milliseconds")
+    parser.add_argument("--context_window", type=int, default=0, help="Expand each naive_csv hit to this many neighbouring turns on each side")
+    parser.add_argument("--recency_half_life_days", type=float, default=None, help="naive_csv: boost recent turns; a turn this many days old gets half the boost")
+    parser.add_argument("--recency_weight", type=float, default=0.3, help="Maximum recency boost added to the similarity score")
+    parser.add_argument("--tenant_collection", type=str, default=None, help="Store every file as a tenant of this shared collection instead of one collection per file")
+    parser.add_argument("--slow_ms", type=float, default=None, help="Log the span breakdown of runs slower than this (default $TRACE_SLOW_MS or 1000)")
+    parser.add_argument("--profile", type=str, choices=PROFILE_MODES, default=None, help="Save a cProfile or sampled (flamegraph) profile of the run to $PROFILE_DIR")
+    parser.add_argument("--no_daemon", action="store_true", default=bool(os.environ.get("RETRIEVE_NO_DAEMON")), help="Run in this process instead of the warm retrieve daemon (or set $RETRIEVE_NO_DAEMON)")
     args = parser.parse_args()
     
     return args
 
-def qdrant_retrieve_mode(embedding_model_path, file_path, query, collection_name, mode, top_k=20):
+@span("qdrant_retrieve_mode")
+def qdrant_retrieve_mode(
+    embedding_model_path,
+    file_path,
+    query,
+    collection_name,
+    mode,
+    top_k=20,
+    hybrid=False,
+    rerank_k=None,
+    final_k=None,
+    reranker_model=None,
+    rerank_budget_ms=None,
+    context_window=0,
+    tenant_collection=None,
+    recency_half_life_days=None,
+    recency_weight=0.3,
+):
+    """
+    Index `file_path` if needed and query it. With `tenant_collection`, the
+    file is stored as a tenant (named `collection_name`) of that shared
+    collection rather than in a collection of its own.
+    """
+    from model_management.reranker_model_controller import DEFAULT_RERANKER_MODEL
     embedding_model_path = resolve_model_path(embedding_model_path)
     file_path = resolve_model_path(file_path)
+    tenant = None
+    if tenant_collection is not None:
+        collection_name, tenant = tenant_collection, collection_name
+    mode_kwargs = {}
     match mode:
         case "naive_csv":
             from retrieval.structured_csv_retrieve import StructuredCSVRetrieval, StructuredCSVIndexing
             indexer = StructuredCSVIndexing()
             retriever = StructuredCSVRetrieval()
+            mode_kwargs["context_window"] = context_window
+            mode_kwargs["recency_half_life_days"] = recency_half_life_days
+            mode_kwargs["recency_weight"] = recency_weight
             
         case "contextual":
             from retrieval.contextual_retrieve import ContextualRetrieval, ContextualIndexing
             indexer = ContextualIndexing()
             retriever = ContextualRetrieval()
-            
-    indexer.index(
-        embedding_model_path=embedding_model_path, 
-        file_path=file_path, 
-        collection_name=collection_name
-    )
+        case _:
+            raise ValueError(f"Unknown mode '{mode}'")
+
+    # Indexing is a no-op for a warm collection; a slow trace with a long
+    # "index" span hit a cold one.
+    with span("index"):
+        indexer.index(
+            embedding_model_path=embedding_model_path, 
+            file_path=file_path, 
+            collection_name=collection_name,
+            tenant=tenant,
+        )
+    with span("check_model"):
+        check_model(collection_name, embedding_model_path)
     
-    output = retriever.retrieve(
-        collection_name=collection_name,
-        embedding_model_path=embedding_model_path,
-        query=query,
-        top_k=top_k
-    )
+    with span("retrieve"):
+        output = retriever.retrieve(
+            collection_name=collection_name,
+            embedding_model_path=embedding_model_path,
+            query=query,
+            top_k=top_k,
+            hybrid=hybrid,
+            rerank_k=rerank_k,
+            final_k=final_k,
+            rerank_budget_ms=rerank_budget_ms,
+            reranker_model=reranker_model or DEFAULT_RERANKER_MODEL,
+            tenant=tenant,
+            **mode_kwargs,
+        )
         
     return output
+
+@span("qdrant_multi_retrieve_mode")
+def qdrant_multi_retrieve_mode(embedding_model_path, file_paths, query, mode, top_k=20, hybrid=False, timeout=2.0):
+    """
+    Search the collections of several files at once and merge their hits.
+    Files are indexed first if needed. Returns the merged hits and the
+    collections that timed out or failed.
+    """
+    from retrieval.multi_collection_retrieve import MultiCollectionRetrieval
+    embedding_model_path = resolve_model_path(embedding_model_path)
+    match mode:
+        case "naive_csv":
+            from retrieval.structured_csv_retrieve import StructuredCSVIndexing
+            indexer = StructuredCSVIndexing()
+        case "contextual":
+            from retrieval.contextual_retrieve import ContextualIndexing
+            indexer = ContextualIndexing()
+        case _:
+            raise ValueError(f"Unknown mode '{mode}'")
+
+    collection_names = []
+    for file_path in file_paths:
+        collection_name = file_path.split("/")[-1].split(".")[0]
+        with span("index"):
+            indexer.index(
+                embedding_model_path=embedding_model_path,
+                file_path=resolve_model_path(file_path),
+                collection_name=collection_name
+            )
+        with span("check_model"):
+            check_model(collection_name, embedding_model_path)
+        collection_names.append(collection_name)
+
+    retriever = MultiCollectionRetrieval()
+    with span("retrieve"):
+        output = retriever.retrieve(
+            collection_names=collection_names,
+            embedding_model_path=embedding_model_path,
+            query=query,
+            top_k=top_k,
+            timeout=timeout,
+            hybrid=hybrid,
+        )
+    return output, retriever.failed_collections
         
 def one_time_retrieve_mode(model_output_path:str, file_path:str, query:str, top_k=20):
+    from retrieval.cl_retrieve import CLRetrieve
+    from model_management.embedding_model_controller import model_fingerprint
     model_output_path = resolve_model_path(model_output_path)
     file_path = resolve_model_path(file_path)
     retriever = CLRetrieve(model_name=model_output_path)
-    text_embeddings = retriever.read_and_embed(
-        file_path, 
-        add_talker=True, 
-        text_embedding_only=True
-    )
+    # A warm process (the API, the daemon) re-embeds a file only when it or the model changed.
+    stat = os.stat(file_path)
+    key = (model_fingerprint(model_output_path), file_path, stat.st_mtime_ns, stat.st_size)
+    with _TEXT_EMBEDDINGS_LOCK:
+        text_embeddings = _TEXT_EMBEDDINGS.get(key)
+        if text_embeddings is not None:
+            _TEXT_EMBEDDINGS.move_to_end(key)
+    if text_embeddings is None:
+        with span("embed"):
+            text_embeddings = retriever.read_and_embed(
+                file_path, 
+                add_talker=True, 
+                text_embedding_only=True
+            )
+        with _TEXT_EMBEDDINGS_LOCK:
+            _TEXT_EMBEDDINGS[key] = text_embeddings
+            if len(_TEXT_EMBEDDINGS) > _TEXT_EMBEDDINGS_SIZE:
+                _TEXT_EMBEDDINGS.popitem(last=False)
     result = retriever.retrieve(file_path, query, text_embeddings, top_k)
     return result
-       
 
-if __name__ == "__main__":
-    args = argparser()
-    if args.qdrant:
-        collection_name = args.file_path.split("/")[-1].split(".")[0]
-        qdrant_retrieve_mode(
-            embedding_model_path=args.model_output_path,
+
+def request_from_args(args):
+    """The retrieve function (by name, see `MODES`) and keyword arguments for the CLI arguments."""
+    if not args.qdrant:
+        return "one_time", dict(
+            model_output_path=args.model_output_path,
             file_path=args.file_path,
             query=args.query,
             top_k=args.top_k,
-            collection_name=collection_name,
-            mode=args.mode
         )
+    return "qdrant", dict(
+        embedding_model_path=args.model_output_path,
+        file_path=args.file_path,
+        query=args.query,
+        top_k=args.top_k,
+        collection_name=args.file_path.split("/")[-1].split(".")[0],
+        mode=args.mode,
+        hybrid=args.hybrid,
+        rerank_k=args.rerank_k,
+        final_k=args.final_k,
+        reranker_model=args.reranker_model,
+        rerank_budget_ms=args.rerank_budget_ms,
+        context_window=args.context_window,
+        tenant_collection=args.tenant_collection,
+        recency_half_life_days=args.recency_half_life_days,
+        recency_weight=args.recency_weight,
+    )
+
+
+MODES = {"qdrant": qdrant_retrieve_mode, "one_time": one_time_retrieve_mode}
+
+
+if __name__ == "__main__":
+    args = argparser()
+    mode, kwargs = request_from_args(args)
+    if args.no_daemon:
+        with trace("retrieve.py", slow_ms=args.slow_ms, profile=args.profile) as run_trace:
+            result = MODES[mode](**kwargs)
+        profile_path = run_trace.profile_path
     else:
-        one_time_retrieve_mode(
-            model_output_path=args.model_output_path,
-            file_path=args.file_path,
-            query=args.query,
-            top_k=args.top_k,
-        )
\ No newline at end of file
+        import retrieve_daemon
+        result, profile_path = retrieve_daemon.request(mode, kwargs, slow_ms=args.slow_ms, profile=args.profile)
+    print(result if isinstance(result, str) else json.dumps(result, ensure_ascii=False, default=str))
+    if profile_path:
+        print(f"profile saved to {profile_path}")
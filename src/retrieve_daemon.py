@@ -0,0 +1,259 @@
+"""
+A warm daemon behind the retrieve.py CLI.
+
+Every `retrieve.py` run used to import torch, load the embedding model and
+the reranker, and connect to Qdrant before answering one query. The daemon
+does that once and keeps it: models stay in the process caches, Qdrant
+clients are shared (`QdrantConnector.reuse_clients`), and one_time mode
+keeps the embedded files. The CLI becomes a thin client that sends its
+arguments over a Unix domain socket:
+
+* the socket is `$RETRIEVE_DAEMON_SOCKET`, or one in `$XDG_RUNTIME_DIR`,
+  or in a private (0700) per-user directory of the temp dir;
+* a client starts the daemon when none answers, and the daemon exits after
+  `$RETRIEVE_DAEMON_IDLE_SECONDS` (default 900) without requests;
+* a lock file next to the socket keeps concurrent clients from starting two,
+  and the daemon logs to a `.log` file next to it.
+
+The protocol is one JSON line each way per connection:
+``{"op", "kwargs", "slow_ms", "profile"}`` answered by
+``{"ok": true, "result", "profile_path"}`` or ``{"ok": false, "error", "type"}``.
+Ops are the retrieve modes (`retrieve.MODES`), "ping" and "shutdown".
+
+The daemon keeps the environment and code it was started with; run
+``python src/retrieve_daemon.py --stop`` after changing either.
+"""
+import argparse
+import fcntl
+import json
+import logging
+import os
+import socket
+import socketserver
+import stat
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def runtime_dir() -> str:
+    """
+    Where the socket, lock and log live: `$XDG_RUNTIME_DIR`, or else a
+    0700 directory of this user in the temp dir, which is refused if another
+    user could have created or opened it.
+    """
+    xdg = os.environ.get("XDG_RUNTIME_DIR")
+    if xdg and os.path.isdir(xdg):
+        return xdg
+    directory = os.path.join(tempfile.gettempdir(), f"retrieve-daemon-{os.getuid()}")
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    info = os.lstat(directory)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise PermissionError(f"{directory} is not private to this user; set $RETRIEVE_DAEMON_SOCKET instead")
+    return directory
+
+
+SOCKET_PATH = os.environ.get("RETRIEVE_DAEMON_SOCKET") or os.path.join(runtime_dir(), "retrieve-daemon.sock")
+IDLE_SECONDS = float(os.environ.get("RETRIEVE_DAEMON_IDLE_SECONDS", 900))
+SPAWN_TIMEOUT = 30.0
+
+
+class DaemonError(RuntimeError):
+    """A request failed in the daemon; `type` is the name of the exception raised there."""
+
+    def __init__(self, message: str, type: str):
+        super().__init__(f"{type}: {message}")
+        self.type = type
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+        response = self.server.daemon.handle(json.loads(line))
+        self.wfile.write(json.dumps(response, ensure_ascii=False, default=str).encode("utf-8") + b"\n")
+
+
+class RetrieveDaemon:
+    """
+    Serve retrieve requests on `socket_path` until idle for `idle_seconds`
+    or asked to shut down. `serve_forever` returns False without serving
+    when another daemon holds the socket.
+    """
+
+    def __init__(self, socket_path: str = SOCKET_PATH, idle_seconds: float = IDLE_SECONDS):
+        self.socket_path = socket_path
+        self.idle_seconds = idle_seconds
+        self.started = time.monotonic()
+        self.requests = 0
+        self._active = 0
+        self._last_request = time.monotonic()
+        self._lock = threading.Lock()
+        self._server: socketserver.ThreadingUnixStreamServer | None = None
+        self.ready = threading.Event()
+
+    def handle(self, message: dict) -> dict:
+        from retrieve import MODES
+        from tracing import trace
+
+        op = message.get("op")
+        with self._lock:
+            self._active += 1
+            self.requests += 1
+        try:
+            if op == "ping":
+                return {"ok": True, "result": {
+                    "pid": os.getpid(),
+                    "uptime_s": time.monotonic() - self.started,
+                    "requests": self.requests,
+                }}
+            if op == "shutdown":
+                threading.Thread(target=self._server.shutdown, daemon=True).start()
+                return {"ok": True, "result": None}
+            if op not in MODES:
+                raise ValueError(f"Unknown op '{op}', expected one of {['ping', 'shutdown', *MODES]}")
+            with trace(f"retrieve_daemon.{op}", slow_ms=message.get("slow_ms"), profile=message.get("profile")) as t:
+                result = MODES[op](**message.get("kwargs", {}))
+            profile_path = os.path.abspath(t.profile_path) if t.profile_path else None
+            return {"ok": True, "result": result, "profile_path": profile_path}
+        except Exception as e:
+            logger.exception(f"{op} request failed")
+            return {"ok": False, "error": str(e), "type": type(e).__name__}
+        finally:
+            with self._lock:
+                self._active -= 1
+                self._last_request = time.monotonic()
+
+    def _watch_idle(self) -> None:
+        interval = min(self.idle_seconds / 4, 5.0)
+        while not self._stopped.wait(interval):
+            with self._lock:
+                idle = self._active == 0 and time.monotonic() - self._last_request > self.idle_seconds
+            if idle:
+                logger.info(f"idle for {self.idle_seconds:.0f}s, exiting")
+                self._server.shutdown()
+                return
+
+    def serve_forever(self) -> bool:
+        # "a": never truncate whatever already has this name.
+        lock = open(self.socket_path + ".lock", "a")
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock.close()
+            logger.info(f"another daemon serves {self.socket_path}")
+            return False
+        try:
+            # Holding the lock, any socket left behind is from a daemon that died.
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+            self._server = socketserver.ThreadingUnixStreamServer(self.socket_path, _Handler)
+            self._server.daemon = self
+            self._stopped = threading.Event()
+            watchdog = threading.Thread(target=self._watch_idle, name="idle-watchdog", daemon=True)
+            watchdog.start()
+            logger.info(f"serving on {self.socket_path} (pid {os.getpid()})")
+            self.ready.set()
+            self._server.serve_forever()
+            return True
+        finally:
+            if self._server is not None:
+                self._stopped.set()
+                self._server.server_close()
+                os.unlink(self.socket_path)
+            lock.close()
+
+    def shutdown(self) -> None:
+        self._server.shutdown()
+
+
+def _send(message: dict, socket_path: str, timeout: float | None = None) -> dict:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(socket_path)
+        sock.sendall(json.dumps(message).encode("utf-8") + b"\n")
+        with sock.makefile("rb") as f:
+            line = f.readline()
+    if not line:
+        raise ConnectionResetError("retrieve daemon closed the connection")
+    return json.loads(line)
+
+
+def ping(socket_path: str = SOCKET_PATH) -> dict | None:
+    """The daemon's pid, uptime and request count, or None when none is running."""
+    try:
+        return _send({"op": "ping"}, socket_path, timeout=SPAWN_TIMEOUT)["result"]
+    except (FileNotFoundError, ConnectionError):
+        return None
+
+
+def spawn(socket_path: str = SOCKET_PATH, idle_seconds: float = IDLE_SECONDS,
+          timeout: float = SPAWN_TIMEOUT) -> dict:
+    """Start a daemon in the background and wait until it answers; returns its `ping`."""
+    log = open(socket_path + ".log", "ab")
+    process = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--socket", socket_path, "--idle_seconds", str(idle_seconds)],
+        stdin=subprocess.DEVNULL, stdout=log, stderr=log, start_new_session=True,
+    )
+    log.close()
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        status = ping(socket_path)
+        if status is not None:
+            return status
+        # Exiting early is fine when another client's daemon won the lock.
+        if process.poll() not in (None, 0):
+            break
+        time.sleep(0.05)
+    raise RuntimeError(f"retrieve daemon did not start, see {socket_path}.log")
+
+
+def request(op: str, kwargs: dict | None = None, slow_ms: float | None = None, profile: str | None = None,
+            socket_path: str = SOCKET_PATH, autostart: bool = True) -> tuple:
+    """
+    Run retrieve mode `op` with `kwargs` in the daemon, starting it if
+    needed. Returns the result and the path of the saved profile, if any;
+    raises `DaemonError` when the request failed in the daemon.
+    """
+    message = {"op": op, "kwargs": kwargs or {}, "slow_ms": slow_ms, "profile": profile}
+    try:
+        response = _send(message, socket_path)
+    except (FileNotFoundError, ConnectionError):
+        # No daemon, or one that was exiting on idle as we connected.
+        if not autostart:
+            raise
+        spawn(socket_path)
+        response = _send(message, socket_path)
+    if not response["ok"]:
+        raise DaemonError(response["error"], response["type"])
+    return response["result"], response.get("profile_path")
+
+
+def argparser():
+    parser = argparse.ArgumentParser(description="Warm daemon serving retrieve.py requests over a Unix socket")
+    parser.add_argument("--socket", type=str, default=SOCKET_PATH, help="Unix socket path (default $RETRIEVE_DAEMON_SOCKET)")
+    parser.add_argument("--idle_seconds", type=float, default=IDLE_SECONDS, help="Exit after this long without requests (default $RETRIEVE_DAEMON_IDLE_SECONDS or 900)")
+    parser.add_argument("--status", action="store_true", help="Print the running daemon's status and exit")
+    parser.add_argument("--stop", action="store_true", help="Stop the running daemon")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = argparser()
+    if args.status:
+        print(json.dumps(ping(args.socket)))
+    elif args.stop:
+        if ping(args.socket) is not None:
+            _send({"op": "shutdown"}, args.socket)
+    else:
+        logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+        from database.connector import QdrantConnector
+
+        # Share Qdrant clients (and their connections) across requests.
+        QdrantConnector.reuse_clients = True
+        RetrieveDaemon(args.socket, args.idle_seconds).serve_forever()
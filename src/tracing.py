@@ -0,0 +1,269 @@
+"""
+Lightweight in-process tracing and on-demand profiling.
+
+A `trace` wraps one request (an API call, a CLI run); `span`s inside it time
+its stages. Spans outside a trace cost one context-variable lookup, so the
+code paths stay instrumented permanently:
+
+    with trace("retrieve", slow_ms=500, profile="sample"):
+        with span("index"):
+            ...
+
+A trace slower than `slow_ms` is logged with its span breakdown. With
+`profile`, the request is also profiled and the profile saved to
+`PROFILE_DIR` (default `profiles/`), which keeps the newest `PROFILE_KEEP`
+(default 50) profiles:
+
+* ``"cprofile"`` writes a `.prof` file (``python -m pstats``, snakeviz, or
+  ``flameprof`` for a flamegraph);
+* ``"sample"`` samples the stacks of the request's threads every few
+  milliseconds and writes a `.folded` file in the collapsed format of
+  ``flamegraph.pl`` and speedscope.
+
+Spans and profiles follow a request onto worker threads when the work is
+submitted with `propagate` (thread pools do not copy context variables).
+"""
+import contextvars
+import cProfile
+import functools
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+PROFILE_KEEP = int(os.environ.get("PROFILE_KEEP", 50))
+SLOW_MS = float(os.environ.get("TRACE_SLOW_MS", 1000))
+PROFILE_MODES = ("cprofile", "sample")
+SAMPLE_INTERVAL = 0.005
+
+_trace: contextvars.ContextVar = contextvars.ContextVar("trace", default=None)
+_path: contextvars.ContextVar = contextvars.ContextVar("span_path", default=())
+
+
+class Trace:
+    """Spans recorded for one request, and its profile."""
+
+    def __init__(self, name: str, profile: str | None = None):
+        if profile not in (None, *PROFILE_MODES):
+            raise ValueError(f"Unknown profile mode '{profile}', expected one of {PROFILE_MODES}")
+        self.id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.profile = profile
+        self.start = time.perf_counter()
+        self.duration_ms: float | None = None
+        self.spans: list[tuple[tuple, float]] = []  # (path, duration_ms)
+        self.profile_path: str | None = None
+        self._lock = threading.Lock()
+        # Spans open per thread: profiling follows the threads doing the work.
+        self._open: Counter = Counter()
+        self._profilers: dict[int, cProfile.Profile] = {}
+        self._finished_profilers: list[cProfile.Profile] = []
+        self._samples: Counter = Counter()
+        self._sampler: threading.Thread | None = None
+        self._stop = threading.Event()
+
+    def _enter_thread(self) -> None:
+        ident = threading.get_ident()
+        with self._lock:
+            self._open[ident] += 1
+            first = self._open[ident] == 1
+        if first and self.profile == "cprofile":
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError as e:  # another profiler is active on this thread
+                logger.warning(f"not profiling {self.name} on this thread: {e}")
+                return
+            self._profilers[ident] = profiler
+
+    def _exit_thread(self) -> None:
+        ident = threading.get_ident()
+        with self._lock:
+            self._open[ident] -= 1
+            last = self._open[ident] == 0
+            if last:
+                del self._open[ident]
+        if last and ident in self._profilers:
+            profiler = self._profilers.pop(ident)
+            profiler.disable()
+            self._finished_profilers.append(profiler)
+
+    def _sample(self) -> None:
+        while not self._stop.wait(SAMPLE_INTERVAL):
+            frames = sys._current_frames()
+            for ident in list(self._open):
+                frame = frames.get(ident)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                if stack:
+                    self._samples[";".join(reversed(stack))] += 1
+
+    def breakdown(self) -> list[dict]:
+        """Total time and count per span path, in order of first appearance."""
+        totals: dict[tuple, list] = {}
+        for path, duration in self.spans:
+            entry = totals.setdefault(path, [0.0, 0])
+            entry[0] += duration
+            entry[1] += 1
+        return [{"span": "/".join(path), "ms": ms, "count": count} for path, (ms, count) in totals.items()]
+
+    def format(self) -> str:
+        lines = [f"{self.name} ({self.id}): {self.duration_ms:.1f}ms"]
+        for entry in self.breakdown():
+            indent = "  " * entry["span"].count("/")
+            count = f" x{entry['count']}" if entry["count"] > 1 else ""
+            lines.append(f"  {indent}{entry['span'].rsplit('/', 1)[-1]}: {entry['ms']:.1f}ms{count}")
+        return "\n".join(lines)
+
+    def server_timing(self) -> str:
+        """The breakdown as a `Server-Timing` header value (span paths joined by ".")."""
+        return ", ".join(
+            f"{entry['span'].replace('/', '.')};dur={entry['ms']:.1f}" for entry in self.breakdown()
+        )
+
+    def _save_profile(self, profile_dir: str) -> None:
+        os.makedirs(profile_dir, exist_ok=True)
+        stem = os.path.join(profile_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{self.id}")
+        if self.profile == "cprofile" and self._finished_profilers:
+            import pstats
+
+            stats = pstats.Stats(*self._finished_profilers)
+            self.profile_path = stem + ".prof"
+            stats.dump_stats(self.profile_path)
+        elif self.profile == "sample" and self._samples:
+            self.profile_path = stem + ".folded"
+            with open(self.profile_path, "w", encoding="utf-8") as f:
+                for stack, count in self._samples.most_common():
+                    f.write(f"{stack} {count}\n")
+        _rotate_profiles(profile_dir, PROFILE_KEEP)
+
+
+def _rotate_profiles(profile_dir: str, keep: int) -> None:
+    """Delete all but the newest `keep` profiles in `profile_dir`."""
+    profiles = [
+        entry for entry in os.scandir(profile_dir)
+        if entry.is_file() and entry.name.endswith((".prof", ".folded"))
+    ]
+    profiles.sort(key=lambda entry: entry.stat().st_mtime_ns, reverse=True)
+    for entry in profiles[keep:]:
+        try:
+            os.unlink(entry.path)
+        except FileNotFoundError:  # removed by a concurrent request
+            pass
+
+
+class span:
+    """
+    Time a stage of the current trace; a no-op outside one. Works as a
+    context manager or, with a name, as a decorator.
+    """
+
+    __slots__ = ("name", "_trace", "_token", "_start")
+
+    def __init__(self, name: str):
+        self.name = name
+        self._trace = None
+
+    def __enter__(self):
+        self._trace = _trace.get()
+        if self._trace is not None:
+            self._token = _path.set(_path.get() + (self.name,))
+            self._trace._enter_thread()
+            self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self._trace is not None:
+            duration = (time.perf_counter() - self._start) * 1000
+            self._trace.spans.append((_path.get(), duration))
+            self._trace._exit_thread()
+            _path.reset(self._token)
+            self._trace = None
+        return False
+
+    def __call__(self, fn):
+        name = self.name
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+
+class trace:
+    """
+    Record the spans of one request. On exit the trace is logged if it took
+    longer than `slow_ms` (default `TRACE_SLOW_MS`, 1000), and with
+    `profile` ("cprofile" or "sample") its profile is saved under
+    `profile_dir`; the `Trace` (with `profile_path`) is what `with` binds.
+    Nested traces are spans of the outer one.
+
+    Profiles cover the threads with an open span of the trace. With
+    `own_thread` (the default) that includes the thread opening the trace;
+    an event loop serving other requests meanwhile should pass False.
+    """
+
+    def __init__(self, name: str, slow_ms: float | None = None, profile: str | None = None,
+                 profile_dir: str | None = None, own_thread: bool = True):
+        self.name = name
+        self.own_thread = own_thread
+        self.slow_ms = SLOW_MS if slow_ms is None else slow_ms
+        self.profile = profile or None
+        self.profile_dir = profile_dir or PROFILE_DIR
+        self._outer = None
+
+    def __enter__(self) -> Trace:
+        if _trace.get() is not None:
+            self._outer = span(self.name)
+            self._outer.__enter__()
+            return _trace.get()
+        self._trace = Trace(self.name, self.profile)
+        self._token = _trace.set(self._trace)
+        if self.own_thread:
+            self._trace._enter_thread()
+        if self.profile == "sample":
+            self._trace._sampler = threading.Thread(target=self._trace._sample, name="trace-sampler", daemon=True)
+            self._trace._sampler.start()
+        return self._trace
+
+    def __exit__(self, *exc):
+        if self._outer is not None:
+            return self._outer.__exit__(*exc)
+        t = self._trace
+        if self.own_thread:
+            t._exit_thread()
+        t.duration_ms = (time.perf_counter() - t.start) * 1000
+        if t._sampler is not None:
+            t._stop.set()
+            t._sampler.join()
+        _trace.reset(self._token)
+        if t.profile:
+            t._save_profile(self.profile_dir)
+            logger.info(f"profile of {t.name} ({t.id}) saved to {t.profile_path}")
+        if t.duration_ms > self.slow_ms:
+            logger.warning(f"slow request {t.format()}")
+        return False
+
+
+def current_trace() -> Trace | None:
+    return _trace.get()
+
+
+def propagate(fn):
+    """
+    `fn` bound to a copy of the current context, so spans it opens on
+    another thread join this trace. Call it once per submission: a context
+    cannot run on two threads at once.
+    """
+    return functools.partial(contextvars.copy_context().run, fn)
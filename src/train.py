@@ -1,6 +1,10 @@
 from training.cl_training import CLTraining
-from training.anchor_cl_mining import CLSimplePairMining
+from training.anchor_cl_mining import CLSimplePairMining, CLHardNegativeMining
+from training.telemetry import EarlyStopping, RetrievalEvaluator
 from config import EPOCHS, BATCH_SIZE
+import hashlib
+import json
+import os
 import yaml
 import logging
 logging.basicConfig(
@@ -15,16 +19,52 @@ def train_mode(
     model_name, 
     file_path, 
     model_output_path, 
+    hard_negatives=False,
+    triplet_output_path=None,
+    pretokenized=True,
+    mini_batch_size=None,
+    checkpoint_path="checkpoints/model",
+    checkpoint_save_steps=500,
+    resume=False,
+    telemetry_path=None,
+    early_stopping=None,
 ):
-    miner = CLSimplePairMining()
-    trainer = CLTraining(model_name=model_name)
+    cut = None
+    if early_stopping:
+        # Hold out the last turns of the file: next-turn recall@k on them decides when to stop.
+        # Training data comes from the turns before them only.
+        texts, sessions = CLHardNegativeMining.load_turns(file_path)
+        cut = int(len(texts) * (1 - early_stopping.get("eval_fraction", 0.05)))
+        early_stopping = EarlyStopping(
+            RetrievalEvaluator.next_turns(texts[cut:], sessions[cut:], k=early_stopping.get("k", 10)),
+            eval_steps=early_stopping.get("eval_steps", 100),
+            patience=early_stopping.get("patience", 3),
+        )
+    trainer = CLTraining(
+        model_name=model_name,
+        pretokenized=pretokenized,
+        mini_batch_size=mini_batch_size,
+        checkpoint_path=checkpoint_path,
+        checkpoint_save_steps=checkpoint_save_steps,
+        resume=resume,
+        telemetry_path=telemetry_path,
+        early_stopping=early_stopping,
+    )
 
-    pairs = miner.create_dataset(file_path)
-    
     logger.info(f"preparing data on file: {file_path}")
-    train_dataset = trainer.prepare_inverse_data_for_simcse(pairs)
-    logger.info(f"training starts for model {model_name}, saving to {model_output_path}")
-    trainer.train_simcse(train_dataset, batch_size=BATCH_SIZE, epochs=EPOCHS, warmup_steps=len(train_dataset)//10)    
+    if hard_negatives:
+        # Mined with the base model, before any training.
+        miner = CLHardNegativeMining(model=trainer.model)
+        triplets = miner.mine(file_path, output_path=triplet_output_path, max_turns=cut)
+        train_dataset = trainer.prepare_triplets(triplets)
+        logger.info(f"training starts for model {model_name} on mined triplets, saving to {model_output_path}")
+        trainer.train(train_dataset, batch_size=BATCH_SIZE, epochs=EPOCHS, warmup_steps=len(train_dataset)//10)
+    else:
+        miner = CLSimplePairMining()
+        pairs = miner.create_dataset(file_path)[:cut]
+        train_dataset = trainer.prepare_inverse_data_for_simcse(pairs)
+        logger.info(f"training starts for model {model_name}, saving to {model_output_path}")
+        trainer.train_simcse(train_dataset, batch_size=BATCH_SIZE, epochs=EPOCHS, warmup_steps=len(train_dataset)//10)    
     logger.info(f"training complete, saving model to {model_output_path}")
     trainer.save_model(model_output_path)
 
@@ -38,8 +78,24 @@ if __name__ == "__main__":
     model_name = config["training"]["model_name"]
     model_output_path = config["training"]["model_output_path"]
 
+    # Checkpoints are kept per config and dataset version, so re-running the
+    # same config on the same data resumes it.
+    stat = os.stat(file_path)
+    run = {"config": config, "dataset": [stat.st_size, stat.st_mtime_ns]}
+    run_id = hashlib.sha256(json.dumps(run, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+    checkpoint_path = os.path.join(config["training"].get("checkpoint_dir", "checkpoints"), run_id)
+
     train_mode(
         model_name=model_name,
         file_path=file_path,
         model_output_path=model_output_path,
+        hard_negatives=config["training"].get("hard_negatives", False),
+        triplet_output_path=config["training"].get("triplet_output_path"),
+        pretokenized=config["training"].get("pretokenized", True),
+        mini_batch_size=config["training"].get("mini_batch_size"),
+        checkpoint_path=checkpoint_path,
+        checkpoint_save_steps=config["training"].get("checkpoint_save_steps", 500),
+        resume=True,
+        telemetry_path=config["training"].get("telemetry_path") or os.path.join(checkpoint_path, "telemetry.jsonl"),
+        early_stopping=config["training"].get("early_stopping"),
     )
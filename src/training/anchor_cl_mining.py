@@ -1,4 +1,5 @@
 from typing import List, Dict, Optional
+import numpy as np
 import pandas as pd
 
 class CLSimplePairMining:
@@ -32,13 +33,154 @@ class CLSimplePairMining:
         with open(file_path, 'r', encoding='utf-8') as f:
             self.df = pd.read_csv(f)
         
-        _dict = []
-        for _, row in self.df.iterrows():
-            text = row['text']
-            _dict.append({"anchor": text})
-            
-        
-        return _dict
+        return [{"anchor": text} for text in self.df['text'].tolist()]
+
+
+class CLHardNegativeMining:
+    """
+    Mine (anchor, positive, negative) triplets from dialogue data.
+
+    The corpus is embedded once with the base model. The positive of a turn
+    is the turn right after it (or before it, for the last turn) in the same
+    session; its negatives are the turns most similar to it that are *not*
+    close to it in the conversation. The similarity search runs block by
+    block and only keeps a running top-k per anchor, so memory stays at
+    ``block_size * (block_size + top_k)`` scores whatever the corpus size.
+    """
+
+    def __init__(self, model=None, model_name: Optional[str] = None, batch_size: int = 64):
+        """
+        Args:
+            model: A loaded SentenceTransformer (e.g. ``CLTraining.model``).
+            model_name: Model to load when ``model`` is not given.
+            batch_size: Encoding batch size.
+        """
+        if model is None:
+            from sentence_transformers import SentenceTransformer
+            model = SentenceTransformer(model_name)
+        self.model = model
+        self.batch_size = batch_size
+
+    @staticmethod
+    def load_turns(file_path: str):
+        """
+        Read the dialogue CSV. Returns the texts and an integer session code
+        per turn; turns of a session share the `source` prefix before its last
+        ":" (e.g. "D1" for "D1:3").
+        """
+        with open(file_path, 'r', encoding='utf-8') as f:
+            df = pd.read_csv(f)
+        texts = df['text'].astype(str).tolist()
+        if 'source' in df.columns:
+            sessions = df['source'].astype(str).str.rsplit(':', n=1).str[0]
+        else:
+            sessions = pd.Series([''] * len(df))
+        return texts, pd.factorize(sessions)[0]
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        embeddings = self.model.encode(texts, batch_size=self.batch_size, show_progress_bar=False)
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings / np.where(norms == 0, 1, norms)
+
+    @staticmethod
+    def adjacent_positives(sessions: np.ndarray) -> np.ndarray:
+        """Index of each turn's positive (next turn, else previous one, in the same session), or -1."""
+        n = len(sessions)
+        positives = np.full(n, -1, dtype=np.int64)
+        idx = np.arange(n)
+        has_prev = np.zeros(n, dtype=bool)
+        has_prev[1:] = sessions[1:] == sessions[:-1]
+        has_next = np.zeros(n, dtype=bool)
+        has_next[:-1] = has_prev[1:]
+        positives[has_prev] = idx[has_prev] - 1
+        positives[has_next] = idx[has_next] + 1
+        return positives
+
+    @staticmethod
+    def hard_negatives(
+        embeddings: np.ndarray,
+        sessions: np.ndarray,
+        top_k: int = 10,
+        exclusion_window: int = 3,
+        max_similarity: float = 0.95,
+        block_size: int = 1024,
+    ) -> np.ndarray:
+        """
+        The `top_k` hardest negatives of every turn, hardest first, as an
+        ``(n, top_k)`` index array padded with -1.
+
+        Turns within `exclusion_window` of the anchor in the same session
+        talk about the same thing, and turns more similar than
+        `max_similarity` are near-duplicates; neither is a true negative, so
+        both are excluded.
+        """
+        n = len(embeddings)
+        best_scores = np.full((n, top_k), -np.inf, dtype=np.float32)
+        best_idx = np.full((n, top_k), -1, dtype=np.int64)
+        for r0 in range(0, n, block_size):
+            r1 = min(r0 + block_size, n)
+            rows = np.arange(r0, r1)
+            scores, idx = best_scores[r0:r1], best_idx[r0:r1]
+            for c0 in range(0, n, block_size):
+                c1 = min(c0 + block_size, n)
+                cols = np.arange(c0, c1)
+                sims = embeddings[r0:r1] @ embeddings[c0:c1].T
+                near = (
+                    (np.abs(rows[:, None] - cols[None, :]) <= exclusion_window)
+                    & (sessions[r0:r1, None] == sessions[None, c0:c1])
+                )
+                sims[near | (sims > max_similarity) | (rows[:, None] == cols[None, :])] = -np.inf
+                merged_scores = np.concatenate([scores, sims], axis=1)
+                merged_idx = np.concatenate([idx, np.broadcast_to(cols, sims.shape)], axis=1)
+                keep = np.argpartition(-merged_scores, top_k - 1, axis=1)[:, :top_k]
+                scores = np.take_along_axis(merged_scores, keep, axis=1)
+                idx = np.take_along_axis(merged_idx, keep, axis=1)
+            order = np.argsort(-scores, axis=1)
+            best_scores[r0:r1] = np.take_along_axis(scores, order, axis=1)
+            best_idx[r0:r1] = np.take_along_axis(idx, order, axis=1)
+        best_idx[np.isneginf(best_scores)] = -1
+        return best_idx
+
+    def mine(
+        self,
+        file_path: str,
+        output_path: Optional[str] = None,
+        negatives_per_anchor: int = 1,
+        top_k: int = 10,
+        exclusion_window: int = 3,
+        max_similarity: float = 0.95,
+        block_size: int = 1024,
+        max_turns: Optional[int] = None,
+    ):
+        """
+        Mine triplets from `file_path` and, with `output_path`, save them as a
+        Hugging Face dataset (``anchor``, ``positive``, ``negative`` columns)
+        that ``CLTraining.prepare_triplets`` turns into training examples.
+        Anchors without a positive or a negative are skipped. With
+        `max_turns`, only the first turns are used, as anchors, positives
+        and negatives alike (the rest being held out).
+        """
+        from datasets import Dataset
+        texts, sessions = self.load_turns(file_path)
+        texts, sessions = texts[:max_turns], sessions[:max_turns]
+        embeddings = self.embed(texts)
+        positives = self.adjacent_positives(sessions)
+        negatives = self.hard_negatives(
+            embeddings, sessions, top_k=max(top_k, negatives_per_anchor),
+            exclusion_window=exclusion_window, max_similarity=max_similarity, block_size=block_size,
+        )[:, :negatives_per_anchor]
+
+        anchors, negs = np.nonzero((negatives >= 0) & (positives >= 0)[:, None])
+        negs = negatives[anchors, negs]
+        dataset = Dataset.from_dict({
+            "anchor": [texts[i] for i in anchors],
+            "positive": [texts[i] for i in positives[anchors]],
+            "negative": [texts[i] for i in negs],
+        })
+        if output_path is not None:
+            dataset.save_to_disk(output_path)
+        return dataset
     
 
 if __name__ == "__main__":
@@ -1,53 +1,111 @@
+import logging
+import time
 import numpy as np
 import pandas as pd
 from torch.utils.data import DataLoader
 from training.anchor_cl_mining import CLSimplePairMining
+from training.data_pipeline import pretokenize, fit_pretokenized, peak_memory_mb
 from sklearn.metrics.pairwise import cosine_similarity
 from sentence_transformers import SentenceTransformer, losses, InputExample
 
+logger = logging.getLogger(__name__)
+
 class CLTraining:
-    def __init__(self, model_name):
+    def __init__(
+        self,
+        model_name,
+        pretokenized=True,
+        cache_dir="dataset/tokenized",
+        mini_batch_size=None,
+        checkpoint_path="checkpoints/model",
+        checkpoint_save_steps=500,
+        resume=False,
+        telemetry_path=None,
+        early_stopping=None,
+    ):
         self.model = SentenceTransformer(model_name)
+        # With mini_batch_size, MultipleNegativesRankingLoss caches gradients (GradCache):
+        # memory follows mini_batch_size, so batch_size only sets the number of in-batch negatives.
+        self.mini_batch_size = mini_batch_size
+        # Tokenize once into an Arrow cache and batch by length (training/data_pipeline.py)
+        # instead of re-tokenizing shuffled batches with model.fit.
+        self.pretokenized = pretokenized
+        self.cache_dir = cache_dir
+        # Checkpoints every checkpoint_save_steps; with resume, training continues from the latest one.
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_save_steps = checkpoint_save_steps
+        self.resume = resume
+        # Per-step telemetry (JSONL, or CSV) and an optional training.telemetry.EarlyStopping,
+        # both only with the pre-tokenized pipeline.
+        self.telemetry_path = telemetry_path
+        self.early_stopping = early_stopping
+        self.throughput = None
 
     def prepare_inverse_data_for_simcse(self, pairs):
         # Only need anchor and positive for MultiNegativesRankLoss
         return [InputExample(texts=[p['anchor'], p['anchor']]) for p in pairs]
+
+    def prepare_triplets(self, triplets):
+        # (anchor, positive, negative) for TripletLoss, e.g. from CLHardNegativeMining.mine
+        return [InputExample(texts=[t['anchor'], t['positive'], t['negative']]) for t in triplets]
     
    
+    def _fit(self, train_examples, train_loss, batch_size, epochs, warmup_steps):
+        fit_kwargs = dict(
+            checkpoint_path=self.checkpoint_path,
+            checkpoint_save_steps=self.checkpoint_save_steps,
+            checkpoint_save_total_limit=2,
+        )
+        if self.pretokenized:
+            dataset = pretokenize(self.model, train_examples, cache_dir=self.cache_dir)
+            self.throughput = fit_pretokenized(
+                self.model, train_loss, dataset,
+                batch_size=batch_size, epochs=epochs, warmup_steps=warmup_steps,
+                resume=self.resume, telemetry_path=self.telemetry_path, early_stopping=self.early_stopping,
+                **fit_kwargs
+            )
+        else:
+            if self.telemetry_path or self.early_stopping:
+                logger.warning("telemetry and early stopping need the pre-tokenized pipeline, ignoring them")
+            train_dataloader = DataLoader(train_examples, shuffle=True, batch_size=batch_size)
+            start = time.perf_counter()
+            self.model.fit(
+                train_objectives=[(train_dataloader, train_loss)],
+                epochs=epochs,
+                warmup_steps=warmup_steps,
+                show_progress_bar=True,
+                resume_from_checkpoint=self.resume,
+                **fit_kwargs
+            )
+            seconds = time.perf_counter() - start
+            examples = len(train_examples) * epochs
+            self.throughput = {
+                "examples": examples, "seconds": seconds, "examples_per_second": examples / seconds, **peak_memory_mb()
+            }
+        logger.info(f"training throughput: {self.throughput['examples_per_second']:.1f} examples/s, "
+                    f"peak RSS {self.throughput['peak_rss_mb']:.0f} MB "
+                    f"({'pre-tokenized' if self.pretokenized else 'model.fit'})")
+        return self.throughput
+
+    def _multiple_negatives_loss(self):
+        if self.mini_batch_size:
+            return losses.CachedMultipleNegativesRankingLoss(self.model, mini_batch_size=self.mini_batch_size)
+        return losses.MultipleNegativesRankingLoss(self.model)
+
     def train(self, train_examples, batch_size=8, epochs=7, warmup_steps=10):
-        train_dataloader = DataLoader(train_examples, shuffle=True, batch_size=batch_size)
         train_loss = losses.TripletLoss(model=self.model)
         print(f"Training on {len(train_examples)} triplets...")
-        self.model.fit(
-            train_objectives=[(train_dataloader, train_loss)],
-            epochs=epochs,
-            warmup_steps=warmup_steps,
-            show_progress_bar=True,
-            checkpoint_save_total_limit=2,
-            checkpoint_path= "checkpoints/model"
-        )
+        return self._fit(train_examples, train_loss, batch_size, epochs, warmup_steps)
         
     def train_simcse(self, train_examples, batch_size=8, epochs=7, warmup_steps=5):
-        train_dataloader = DataLoader(train_examples, shuffle=True, batch_size=batch_size)
-        train_loss = losses.MultipleNegativesRankingLoss(self.model)
+        train_loss = self._multiple_negatives_loss()
         print(f"Training on {len(train_examples)} pairs with simcse...")
-        self.model.fit(
-            train_objectives=[(train_dataloader, train_loss)],
-            epochs=epochs,
-            warmup_steps=warmup_steps,
-            show_progress_bar=True,
-        )
+        return self._fit(train_examples, train_loss, batch_size, epochs, warmup_steps)
     
     def train_multineg(self, train_examples, batch_size=8, epochs=7, warmup_steps=5):
-        train_dataloader = DataLoader(train_examples, shuffle=True, batch_size=batch_size)
-        train_loss = losses.MultipleNegativesRankingLoss(self.model)
+        train_loss = self._multiple_negatives_loss()
         print(f"Training on {len(train_examples)} pairs with MultiNegativesRankLoss...")
-        self.model.fit(
-            train_objectives=[(train_dataloader, train_loss)],
-            epochs=epochs,
-            warmup_steps=warmup_steps,
-            show_progress_bar=True,
-        )
+        return self._fit(train_examples, train_loss, batch_size, epochs, warmup_steps)
         
     def evaluate(self, anchor, options):
         embeddings = self.model.encode([anchor] + options)
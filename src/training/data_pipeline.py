@@ -0,0 +1,337 @@
+import hashlib
+import logging
+import os
+import resource
+import shutil
+import time
+from typing import List, Optional
+import numpy as np
+import torch
+from datasets import Dataset, load_from_disk
+from torch.utils.data import DataLoader, Sampler
+from transformers import get_linear_schedule_with_warmup
+from training.telemetry import EarlyStopping, TelemetryLogger
+
+logger = logging.getLogger(__name__)
+
+TRAINER_STATE_FILE = "trainer_state.pt"
+
+
+def peak_memory_mb() -> dict:
+    """Peak resident memory of this process so far (and of the GPU, if used), in MB."""
+    # ru_maxrss is in kilobytes on Linux.
+    peak = {"peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+    if torch.cuda.is_available():
+        peak["peak_cuda_mb"] = torch.cuda.max_memory_allocated() / 2**20
+    return peak
+
+
+def pretokenize(model, examples, cache_dir: Optional[str] = None) -> Dataset:
+    """
+    Tokenize every text of `examples` (``InputExample``s) once, without
+    padding, into an Arrow dataset with one ``input_ids_<i>`` column per
+    text position and a ``length`` column (longest text of the example).
+    Vector labels (e.g. teacher embeddings for distillation) are kept in a
+    ``label`` column; scalar labels are unused by the contrastive losses and
+    dropped.
+
+    With `cache_dir`, the dataset is saved there under a key of the
+    tokenizer, the maximum sequence length and the texts, and later runs on
+    the same data load it instead of tokenizing again.
+    """
+    tokenizer = model.tokenizer
+    max_length = model.max_seq_length
+    lower = getattr(model[0], "do_lower_case", False)
+    n_texts = len(examples[0].texts) if examples else 0
+    labels = None
+    if examples and np.ndim(examples[0].label) == 1:
+        labels = np.asarray([example.label for example in examples], dtype=np.float32)
+
+    cache_path = None
+    if cache_dir is not None:
+        digest = hashlib.sha256(f"{tokenizer.name_or_path}|{max_length}|{lower}".encode("utf-8"))
+        for example in examples:
+            for text in example.texts:
+                digest.update(text.encode("utf-8"))
+                digest.update(b"\0")
+        if labels is not None:
+            digest.update(labels.tobytes())
+        cache_path = os.path.join(cache_dir, digest.hexdigest()[:32])
+        if os.path.isdir(cache_path):
+            logger.info(f"using pre-tokenized training data from {cache_path}")
+            return load_from_disk(cache_path)
+
+    columns = {}
+    lengths = np.zeros(len(examples), dtype=np.int64)
+    for i in range(n_texts):
+        texts = [str(example.texts[i]).strip() for example in examples]
+        if lower:
+            texts = [text.lower() for text in texts]
+        ids = tokenizer(texts, truncation=True, max_length=max_length, padding=False)["input_ids"]
+        columns[f"input_ids_{i}"] = ids
+        lengths = np.maximum(lengths, [len(x) for x in ids])
+    columns["length"] = lengths.tolist()
+    if labels is not None:
+        columns["label"] = labels
+    dataset = Dataset.from_dict(columns)
+
+    if cache_path is not None:
+        dataset.save_to_disk(cache_path)
+        dataset = load_from_disk(cache_path)
+    return dataset
+
+
+class LengthBucketBatchSampler(Sampler[List[int]]):
+    """
+    Batches of similar length, in random order.
+
+    Every epoch the indices are shuffled and cut into pools of
+    `batch_size * pool_batches`; each pool is sorted by length and cut into
+    batches, and the order of all batches is shuffled. Batches therefore
+    need little padding but still differ from epoch to epoch.
+
+    The order only depends on `seed` and the epoch, so `set_epoch` can
+    replay an interrupted epoch from any batch.
+    """
+
+    def __init__(self, lengths, batch_size: int, pool_batches: int = 50, seed: int = 0, drop_last: bool = False):
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.pool_size = batch_size * pool_batches
+        self.drop_last = drop_last
+        self.seed = seed
+        self.epoch = 0
+        self.start_batch = 0
+
+    def set_epoch(self, epoch: int, start_batch: int = 0) -> None:
+        """Make the next iteration yield `epoch`'s batches, skipping the first `start_batch`."""
+        self.epoch = epoch
+        self.start_batch = start_batch
+
+    def __iter__(self):
+        rng = np.random.default_rng([self.seed, self.epoch])
+        start_batch = self.start_batch
+        # Without set_epoch, iterating again gives the next epoch.
+        self.epoch, self.start_batch = self.epoch + 1, 0
+        order = rng.permutation(len(self.lengths))
+        batches = []
+        for start in range(0, len(order), self.pool_size):
+            pool = order[start:start + self.pool_size]
+            pool = pool[np.argsort(self.lengths[pool], kind="stable")]
+            for b in range(0, len(pool), self.batch_size):
+                batch = pool[b:b + self.batch_size]
+                if len(batch) == self.batch_size or not self.drop_last:
+                    batches.append(batch.tolist())
+        for i in rng.permutation(len(batches))[start_batch:]:
+            yield batches[i]
+
+    def __len__(self):
+        if self.drop_last:
+            return len(self.lengths) // self.batch_size
+        n_pools, rest = divmod(len(self.lengths), self.pool_size)
+        per_pool = -(-self.pool_size // self.batch_size)
+        return n_pools * per_pool + -(-rest // self.batch_size)
+
+
+class PretokenizedCollator:
+    """Pad each text position of a batch of pre-tokenized rows into model features."""
+
+    def __init__(self, tokenizer, n_texts: int):
+        self.pad_token_id = tokenizer.pad_token_id
+        self.token_type_ids = "token_type_ids" in tokenizer.model_input_names
+        self.n_texts = n_texts
+
+    def __call__(self, rows):
+        features = []
+        for i in range(self.n_texts):
+            ids = [row[f"input_ids_{i}"] for row in rows]
+            input_ids = torch.full((len(ids), max(map(len, ids))), self.pad_token_id, dtype=torch.long)
+            attention_mask = torch.zeros_like(input_ids)
+            for n, x in enumerate(ids):
+                input_ids[n, :len(x)] = torch.tensor(x)
+                attention_mask[n, :len(x)] = 1
+            feature = {"input_ids": input_ids, "attention_mask": attention_mask}
+            if self.token_type_ids:
+                feature["token_type_ids"] = torch.zeros_like(input_ids)
+            features.append(feature)
+        if "label" in rows[0]:
+            return features, torch.tensor([row["label"] for row in rows], dtype=torch.float32)
+        return features, torch.zeros(len(rows))
+
+
+def latest_checkpoint(checkpoint_path: Optional[str]) -> Optional[str]:
+    """The checkpoint of `fit_pretokenized` under `checkpoint_path` with the most steps, if any."""
+    if not checkpoint_path or not os.path.isdir(checkpoint_path):
+        return None
+    steps = [
+        int(name) for name in os.listdir(checkpoint_path)
+        if name.isdigit() and os.path.exists(os.path.join(checkpoint_path, name, TRAINER_STATE_FILE))
+    ]
+    return os.path.join(checkpoint_path, str(max(steps))) if steps else None
+
+
+def fit_pretokenized(
+    model,
+    loss,
+    dataset: Dataset,
+    batch_size: int = 8,
+    epochs: int = 1,
+    warmup_steps: int = 0,
+    learning_rate: float = 2e-5,
+    weight_decay: float = 0.01,
+    max_grad_norm: float = 1.0,
+    checkpoint_path: Optional[str] = None,
+    checkpoint_save_steps: int = 500,
+    checkpoint_save_total_limit: Optional[int] = None,
+    resume: bool = False,
+    telemetry_path: Optional[str] = None,
+    log_steps: int = 10,
+    early_stopping: Optional[EarlyStopping] = None,
+    seed: int = 0,
+) -> dict:
+    """
+    Train `model` with `loss` on a dataset from `pretokenize`, batching with
+    `LengthBucketBatchSampler`. Optimizer and schedule match
+    ``SentenceTransformer.fit``'s defaults (AdamW, linear warmup and decay).
+    Returns throughput figures of the run.
+
+    Every `checkpoint_save_steps` steps and at the end, the model is saved to
+    ``checkpoint_path/<step>`` together with the optimizer, scheduler and
+    early-stopping state; with `resume`, training continues from the latest
+    of those checkpoints, at the same batch of the same epoch. The
+    checkpoints of a finished run are discarded instead. Every
+    `log_steps` steps, loss, learning rate, examples/s, tokens/s and peak
+    memory are appended to `telemetry_path` (see `TelemetryLogger`).
+    """
+    n_texts = sum(1 for name in dataset.column_names if name.startswith("input_ids_"))
+    sampler = LengthBucketBatchSampler(dataset["length"], batch_size, seed=seed)
+    loader = DataLoader(
+        dataset,
+        batch_sampler=sampler,
+        collate_fn=PretokenizedCollator(model.tokenizer, n_texts),
+        # Its own generator, so starting an epoch does not draw from the global RNG (and a
+        # resumed run sees the same dropout masks as an uninterrupted one).
+        generator=torch.Generator(),
+    )
+    steps_per_epoch = len(loader)
+    total_steps = steps_per_epoch * epochs
+    device = model.device
+    loss.to(device)
+    no_decay = ("bias", "LayerNorm.bias", "LayerNorm.weight")
+    params = list(loss.named_parameters())
+    optimizer = torch.optim.AdamW([
+        {"params": [p for n, p in params if not any(nd in n for nd in no_decay)], "weight_decay": weight_decay},
+        {"params": [p for n, p in params if any(nd in n for nd in no_decay)], "weight_decay": 0.0},
+    ], lr=learning_rate)
+    scheduler = get_linear_schedule_with_warmup(optimizer, warmup_steps, total_steps)
+    telemetry = TelemetryLogger(telemetry_path) if telemetry_path else None
+
+    step = 0
+    resumed_from = latest_checkpoint(checkpoint_path) if resume else None
+    if resumed_from is not None:
+        state = torch.load(os.path.join(resumed_from, TRAINER_STATE_FILE), map_location="cpu", weights_only=False)
+        if state.get("finished") or state["step"] >= total_steps:
+            # Nothing left to resume: train again from scratch rather than re-save the old weights.
+            logger.info(f"{resumed_from} is the end of a finished run, starting a new one")
+            for name in os.listdir(checkpoint_path):
+                if name.isdigit():
+                    shutil.rmtree(os.path.join(checkpoint_path, name), ignore_errors=True)
+            resumed_from = None
+    if resumed_from is not None:
+        # The weights are the saved model itself, the rest is in the state file.
+        model.load_state_dict(type(model)(resumed_from, device=str(device)).state_dict())
+        optimizer.load_state_dict(state["optimizer"])
+        scheduler.load_state_dict(state["scheduler"])
+        if early_stopping is not None and state.get("early_stopping") is not None:
+            early_stopping.load_state_dict(state["early_stopping"])
+        torch.set_rng_state(state["torch_rng"])
+        step = state["step"]
+        logger.info(f"resuming training from {resumed_from} (step {step} of {total_steps})")
+
+    def save_checkpoint():
+        path = os.path.join(checkpoint_path, str(step))
+        model.save(path)
+        torch.save({
+            "step": step,
+            "optimizer": optimizer.state_dict(),
+            "scheduler": scheduler.state_dict(),
+            "early_stopping": early_stopping.state_dict() if early_stopping is not None else None,
+            "torch_rng": torch.get_rng_state(),
+            "finished": step == total_steps or stopped_early,
+        }, os.path.join(path, TRAINER_STATE_FILE))
+        saved = sorted(
+            (int(name) for name in os.listdir(checkpoint_path)
+             if name.isdigit() and os.path.exists(os.path.join(checkpoint_path, name, TRAINER_STATE_FILE))),
+        )
+        if checkpoint_save_total_limit:
+            for old in saved[:-checkpoint_save_total_limit]:
+                shutil.rmtree(os.path.join(checkpoint_path, str(old)), ignore_errors=True)
+
+    examples = real_tokens = padded_tokens = 0
+    window = {"examples": 0, "tokens": 0, "loss": 0.0, "steps": 0, "start": time.perf_counter()}
+    stopped_early = early_stopping is not None and early_stopping.should_stop
+    start = time.perf_counter()
+    loss.train()
+    for epoch in range(step // steps_per_epoch, epochs):
+        if stopped_early:
+            break
+        sampler.set_epoch(epoch, start_batch=step - epoch * steps_per_epoch)
+        for features, labels in loader:
+            features = [{k: v.to(device) for k, v in f.items()} for f in features]
+            value = loss(features, labels.to(device))
+            value.backward()
+            torch.nn.utils.clip_grad_norm_(loss.parameters(), max_grad_norm)
+            optimizer.step()
+            scheduler.step()
+            optimizer.zero_grad()
+
+            step += 1
+            tokens = sum(int(f["attention_mask"].sum()) for f in features)
+            examples += len(labels)
+            real_tokens += tokens
+            padded_tokens += sum(f["attention_mask"].numel() for f in features)
+            window["examples"] += len(labels)
+            window["tokens"] += tokens
+            window["loss"] += value.item()
+            window["steps"] += 1
+
+            if telemetry is not None and (step % log_steps == 0 or step == total_steps):
+                seconds = time.perf_counter() - window["start"]
+                telemetry.log({
+                    "time": time.time(),
+                    "step": step,
+                    "epoch": epoch,
+                    "loss": window["loss"] / window["steps"],
+                    "lr": scheduler.get_last_lr()[0],
+                    "examples_per_second": window["examples"] / seconds,
+                    "tokens_per_second": window["tokens"] / seconds,
+                    **peak_memory_mb(),
+                })
+                window = {"examples": 0, "tokens": 0, "loss": 0.0, "steps": 0, "start": time.perf_counter()}
+            if early_stopping is not None and step % early_stopping.eval_steps == 0:
+                score = early_stopping.evaluate(model, step)
+                loss.train()  # encode() switched the model to eval mode
+                if telemetry is not None:
+                    telemetry.log({"time": time.time(), "step": step, "epoch": epoch, "eval": score})
+                stopped_early = early_stopping.should_stop
+            if checkpoint_path and (step % checkpoint_save_steps == 0 or step == total_steps or stopped_early):
+                save_checkpoint()
+            if stopped_early:
+                logger.info(f"stopping early at step {step}: no improvement for {early_stopping.patience} evaluations")
+                break
+    seconds = time.perf_counter() - start
+    loss.eval()
+    if early_stopping is not None:
+        early_stopping.restore_best(model)
+    return {
+        "examples": examples,
+        "seconds": seconds,
+        "examples_per_second": examples / seconds if seconds else 0.0,
+        # Share of the processed tokens that were not padding.
+        "padding_efficiency": real_tokens / padded_tokens if padded_tokens else 1.0,
+        "steps": step,
+        "resumed_from": resumed_from,
+        "stopped_early": stopped_early,
+        "best_score": early_stopping.best_score if early_stopping is not None else None,
+        **peak_memory_mb(),
+    }
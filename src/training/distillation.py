@@ -0,0 +1,197 @@
+"""
+Distil a trained embedding model into a smaller, faster student.
+
+    python src/training/distillation.py --teacher trained_model/model --output trained_model/model_student \
+        --file_path dataset/dialogue.csv --num_layers 3 --qa_path evaluation/eval_dataset/locomo/locomo_conv-26_qa.json
+"""
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+import argparse
+import copy
+import json
+import logging
+import statistics
+import time
+from typing import List, Optional
+import numpy as np
+import pandas as pd
+import torch
+from sentence_transformers import InputExample, SentenceTransformer, losses, models
+from training.data_pipeline import fit_pretokenized, pretokenize
+
+logger = logging.getLogger(__name__)
+
+
+def _layers(transformer_module):
+    """The ``nn.ModuleList`` of transformer blocks of a Hugging Face encoder."""
+    auto_model = transformer_module.auto_model
+    for path in ("encoder.layer", "transformer.layer", "layers"):
+        module = auto_model
+        try:
+            for name in path.split("."):
+                module = getattr(module, name)
+        except AttributeError:
+            continue
+        return module
+    raise ValueError(f"Cannot find the transformer layers of {type(auto_model).__name__}")
+
+
+def make_student(
+    teacher: SentenceTransformer,
+    num_layers: Optional[int] = None,
+    output_dim: Optional[int] = None,
+    pca_texts: Optional[List[str]] = None,
+):
+    """
+    Copy `teacher` and keep `num_layers` of its transformer layers, evenly
+    spaced (first and last included). With `output_dim`, a linear layer
+    initialised with the principal components of the teacher's embeddings of
+    `pca_texts` is appended. Returns the student and the ``(output_dim,
+    teacher_dim)`` projection to apply to teacher embeddings (None without
+    `output_dim`).
+    """
+    student = copy.deepcopy(teacher)
+    if num_layers is not None:
+        layers = _layers(student[0])
+        keep = np.unique(np.linspace(0, len(layers) - 1, num_layers).round().astype(int))
+        for i in reversed(range(len(layers))):
+            if i not in keep:
+                del layers[i]
+        student[0].auto_model.config.num_hidden_layers = len(layers)
+
+    projection = None
+    if output_dim is not None:
+        if not pca_texts:
+            raise ValueError("output_dim needs pca_texts to initialise the projection")
+        embeddings = teacher.encode(pca_texts, convert_to_numpy=True, show_progress_bar=False)
+        embeddings = embeddings - embeddings.mean(axis=0)
+        # Rows of vt are the principal directions.
+        projection = np.linalg.svd(embeddings, full_matrices=False)[2][:output_dim].astype(np.float32)
+        dense = models.Dense(
+            in_features=projection.shape[1],
+            out_features=output_dim,
+            bias=False,
+            activation_function=torch.nn.Identity(),
+        )
+        dense.linear.weight.data = torch.from_numpy(projection.copy())
+        student.add_module(str(len(student)), dense)
+    return student, projection
+
+
+def query_latency_ms(model: SentenceTransformer, queries: List[str], repeats: int = 3) -> float:
+    """Median latency of embedding one query at a time, in milliseconds."""
+    model.encode(queries[:1], show_progress_bar=False)  # warm up
+    timings = []
+    for _ in range(repeats):
+        for query in queries:
+            start = time.perf_counter()
+            model.encode([query], show_progress_bar=False)
+            timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def locomo_accuracy(model: SentenceTransformer, file_path: str, qa_path: str, top_k: int = 3) -> float:
+    """
+    Share of the locomo questions whose evidence turns (by `source`, e.g.
+    "D1:3") are all among the `top_k` turns closest to the question, with
+    plain dense search over the dialogue CSV. This scores the embedding
+    model alone, without Qdrant, chunking or an LLM; questions and
+    matching are those of `evaluation/locomo_eval.py`, so the two reports
+    agree.
+    """
+    from evaluation.locomo_eval import evidence_ranks, score
+
+    df = pd.read_csv(file_path)
+    with open(qa_path, "r", encoding="utf-8") as f:
+        qas = [qa for qa in json.load(f) if qa.get("evidence")]
+    if not qas:
+        return 0.0
+    turns = model.encode(df["text"].astype(str).tolist(), normalize_embeddings=True, show_progress_bar=False)
+    questions = model.encode([qa["question"] for qa in qas], normalize_embeddings=True, show_progress_bar=False)
+    top = np.argsort(-(questions @ turns.T), axis=1)[:, :top_k]
+    sources = df["source"].astype(str).to_numpy()
+    ranks = [evidence_ranks(qa["evidence"], [{sources[i]} for i in row]) for qa, row in zip(qas, top)]
+    return score(ranks, [top_k])["accuracy"][str(top_k)]
+
+
+class EmbeddingDistillation:
+    """
+    Train a student (fewer layers and/or a smaller output dimension) to
+    reproduce the teacher's embeddings, with an MSE loss on the project's own
+    dialogue texts. The student is saved with ``SentenceTransformer.save``,
+    so `EmbeddingModelController` loads it like any trained model; vectors
+    of the two models are not interchangeable, so collections must be
+    re-indexed with the student.
+    """
+
+    def __init__(self, teacher_path: str, num_layers: Optional[int] = None, output_dim: Optional[int] = None,
+                 batch_size: int = 64):
+        self.teacher = SentenceTransformer(teacher_path)
+        self.num_layers = num_layers
+        self.output_dim = output_dim
+        self.batch_size = batch_size
+        self.student = None
+        self.projection = None
+        self.throughput = None
+
+    def distill(self, texts: List[str], output_path: Optional[str] = None, epochs: int = 3, train_batch_size: int = 32,
+                learning_rate: float = 1e-4, cache_dir: Optional[str] = None) -> SentenceTransformer:
+        texts = list(dict.fromkeys(t for t in texts if isinstance(t, str) and t.strip()))
+        self.student, self.projection = make_student(
+            self.teacher, self.num_layers, self.output_dim, pca_texts=texts[:20000]
+        )
+        targets = self.teacher.encode(texts, batch_size=self.batch_size, convert_to_numpy=True, show_progress_bar=False)
+        if self.projection is not None:
+            targets = targets @ self.projection.T
+        dataset = pretokenize(
+            self.student, [InputExample(texts=[t], label=v) for t, v in zip(texts, targets)], cache_dir=cache_dir
+        )
+        logger.info(f"distilling {len(texts)} texts into a {self.num_layers or 'full'}-layer student")
+        self.throughput = fit_pretokenized(
+            self.student, losses.MSELoss(self.student), dataset,
+            batch_size=train_batch_size, epochs=epochs, warmup_steps=len(dataset) // train_batch_size // 10,
+            learning_rate=learning_rate,
+        )
+        if output_path:
+            self.student.save(output_path)
+        return self.student
+
+    def report(self, queries: List[str], file_path: Optional[str] = None, qa_path: Optional[str] = None,
+               top_k: int = 3) -> dict:
+        """Parameters, single-query latency and (with `qa_path`) locomo accuracy of teacher vs student."""
+        result = {}
+        for name, model in (("teacher", self.teacher), ("student", self.student)):
+            model.to("cpu")
+            result[name] = {
+                "parameters": sum(p.numel() for p in model.parameters()),
+                "dim": model.get_sentence_embedding_dimension(),
+                "query_latency_ms": query_latency_ms(model, queries),
+            }
+            if qa_path:
+                result[name]["locomo_accuracy"] = locomo_accuracy(model, file_path, qa_path, top_k)
+        return result
+
+
+def argparser():
+    parser = argparse.ArgumentParser(description="Distil a trained embedding model into a smaller student")
+    parser.add_argument("--teacher", type=str, required=True, help="Trained model to distil")
+    parser.add_argument("--output", type=str, required=True, help="Where to save the student")
+    parser.add_argument("--file_path", type=str, required=True, help="Dialogue CSV whose texts are the training corpus")
+    parser.add_argument("--num_layers", type=int, default=None, help="Transformer layers of the student")
+    parser.add_argument("--output_dim", type=int, default=None, help="Embedding dimension of the student")
+    parser.add_argument("--epochs", type=int, default=3)
+    parser.add_argument("--qa_path", type=str, default=None, help="locomo QA json to compare accuracy on")
+    parser.add_argument("--top_k", type=int, default=3)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    from file_util import resolve_model_path
+    logging.basicConfig(level=logging.INFO)
+    args = argparser()
+    texts = pd.read_csv(args.file_path)["text"].astype(str).tolist()
+    distillation = EmbeddingDistillation(resolve_model_path(args.teacher), args.num_layers, args.output_dim)
+    distillation.distill(texts, output_path=resolve_model_path(args.output), epochs=args.epochs)
+    print(json.dumps(distillation.report(texts[:100], args.file_path, args.qa_path, args.top_k), indent=2))
@@ -0,0 +1,119 @@
+import copy
+import csv
+import json
+import logging
+import os
+from typing import Callable, List, Optional
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class TelemetryLogger:
+    """
+    Append training records (dicts) to `path`: one JSON object per line, or
+    CSV rows if `path` ends in ``.csv``. The file is appended to, so a
+    resumed run continues the log of the interrupted one.
+    """
+
+    CSV_FIELDS = [
+        "time", "step", "epoch", "loss", "lr", "examples_per_second", "tokens_per_second",
+        "peak_rss_mb", "peak_cuda_mb", "eval",
+    ]
+
+    def __init__(self, path: str):
+        self.path = path
+        self.csv = path.endswith(".csv")
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def log(self, record: dict) -> None:
+        new_file = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        with open(self.path, "a", encoding="utf-8", newline="") as f:
+            if self.csv:
+                writer = csv.DictWriter(f, fieldnames=self.CSV_FIELDS, extrasaction="ignore")
+                if new_file:
+                    writer.writeheader()
+                writer.writerow(record)
+            else:
+                f.write(json.dumps(record) + "\n")
+
+
+class RetrievalEvaluator:
+    """
+    Recall@k of retrieving each query's target among all targets, e.g. the
+    next turn of held-out dialogue turns. Called with the model, returns a
+    float; higher is better.
+    """
+
+    def __init__(self, queries: List[str], targets: List[str], k: int = 10, batch_size: int = 64):
+        self.queries = queries
+        self.targets = targets
+        self.k = k
+        self.batch_size = batch_size
+
+    @classmethod
+    def next_turns(cls, texts: List[str], sessions, **kwargs) -> "RetrievalEvaluator":
+        """Queries are turns, targets the turn after each (same session)."""
+        from training.anchor_cl_mining import CLHardNegativeMining
+
+        positives = CLHardNegativeMining.adjacent_positives(np.asarray(sessions))
+        keep = np.flatnonzero(positives >= 0)
+        return cls([texts[i] for i in keep], [texts[positives[i]] for i in keep], **kwargs)
+
+    def __call__(self, model) -> float:
+        if not self.queries:
+            return 0.0
+        q = model.encode(self.queries, batch_size=self.batch_size, normalize_embeddings=True, show_progress_bar=False)
+        t = model.encode(self.targets, batch_size=self.batch_size, normalize_embeddings=True, show_progress_bar=False)
+        sims = np.asarray(q) @ np.asarray(t).T
+        own = np.diag(sims)
+        # Rank of each query's own target: how many targets score higher.
+        ranks = (sims > own[:, None]).sum(axis=1)
+        return float(np.mean(ranks < self.k))
+
+
+class EarlyStopping:
+    """
+    Run `evaluator(model)` every `eval_steps` optimizer steps and stop once
+    it has not improved by more than `min_delta` for `patience` evaluations.
+    The best weights are kept and restored at the end of training.
+    """
+
+    def __init__(self, evaluator: Callable, eval_steps: int = 100, patience: int = 3, min_delta: float = 0.0):
+        self.evaluator = evaluator
+        self.eval_steps = eval_steps
+        self.patience = patience
+        self.min_delta = min_delta
+        self.best_score: Optional[float] = None
+        self.best_step: Optional[int] = None
+        self.bad_evals = 0
+        self.best_state = None
+
+    def evaluate(self, model, step: int) -> float:
+        """Evaluate at `step`; returns the score and updates `should_stop`."""
+        score = self.evaluator(model)
+        if self.best_score is None or score > self.best_score + self.min_delta:
+            self.best_score, self.best_step, self.bad_evals = score, step, 0
+            self.best_state = {k: v.detach().cpu().clone() for k, v in model.state_dict().items()}
+        else:
+            self.bad_evals += 1
+        logger.info(f"step {step}: eval {score:.4f} (best {self.best_score:.4f} at step {self.best_step})")
+        return score
+
+    @property
+    def should_stop(self) -> bool:
+        return self.bad_evals >= self.patience
+
+    def restore_best(self, model) -> None:
+        if self.best_state is not None:
+            model.load_state_dict(self.best_state)
+
+    _STATE = ("best_score", "best_step", "bad_evals", "best_state")
+
+    def state_dict(self) -> dict:
+        return copy.deepcopy({k: getattr(self, k) for k in self._STATE})
+
+    def load_state_dict(self, state: dict) -> None:
+        for k in self._STATE:
+            setattr(self, k, state[k])
@@ -0,0 +1,55 @@
+import re
+
+import pandas as pd
+
+from benchmarks.suite import compare, metric, run
+from benchmarks.synthetic_dialogue import SyntheticDialogue
+
+
+def test_synthetic_dialogue_scales_the_examples(tmp_path):
+    en = SyntheticDialogue("en", seed=1)
+    df = pd.read_csv(en.write(str(tmp_path / "en.csv"), 2500))
+    assert list(df.columns) == ["source", "time", "talker", "text"] and len(df) == 2500
+    assert df["source"].iloc[0] == "D1:0" and df["source"].iloc[-1] == "D63:19"
+    assert set(df["talker"]) <= {talker for talker, _ in en.lines}
+    # Lines are mutated, not copied, so dedup does not fold the corpus away.
+    assert df["text"].nunique() > 0.9 * len(df)
+    assert list(SyntheticDialogue("en", seed=1).rows(50)) == list(en.rows(50))
+
+    cn = pd.DataFrame(SyntheticDialogue("cn").rows(200))
+    assert cn["text"].str.contains(r"[一-鿿]").mean() > 0.9
+    assert not cn["text"].str.contains(r"[一-鿿] [一-鿿]").any()
+
+
+def test_regressions_respect_metric_direction():
+    baseline = {
+        "embed/en/10/texts_per_second": metric(100, "higher"),
+        "cl_retrieve/en/10/latency_ms_p50": metric(10, "lower"),
+        "chunk_text/en/10/seconds": metric(1.0, "lower"),
+        "chunk_text/en/10/chunks": metric(5, "info"),
+    }
+    current = {
+        "embed/en/10/texts_per_second": metric(80, "higher"),
+        "cl_retrieve/en/10/latency_ms_p50": metric(7, "lower"),
+        "chunk_text/en/10/seconds": metric(1.05, "lower"),
+        "chunk_text/en/10/chunks": metric(50, "info"),
+        "indexer/en/10/rows_per_second": metric(1, "higher"),
+    }
+    status = {row["metric"]: row["status"] for row in compare(current, baseline, threshold=0.1)}
+    assert status == {
+        "embed/en/10/texts_per_second": "regression",
+        "cl_retrieve/en/10/latency_ms_p50": "improvement",
+        "chunk_text/en/10/seconds": "ok",
+    }
+
+
+def test_run_collects_metrics_per_corpus(tmp_path):
+    metrics = run("unused", ["en", "cn"], [300], ["chunk_text", "chunk_by_similarity"], str(tmp_path), repeats=2)
+    assert set(metrics) == {
+        f"{name}/{lang}/300/{key}"
+        for lang in ("en", "cn")
+        for name, keys in (("chunk_text", ("seconds", "rows_per_second", "chunks")),
+                           ("chunk_by_similarity", ("seconds", "clusters")))
+        for key in keys
+    }
+    assert all(re.fullmatch(r"higher|lower|info", m["better"]) for m in metrics.values())
@@ -0,0 +1,117 @@
+import os
+import random
+import re
+from typing import List
+
+import pytest
+
+from retrieval.chunking_strategies.neighbour_sim import NeibourSimilarityChunker
+
+EXAMPLES = os.path.join(os.path.dirname(__file__), "..", "examples")
+
+
+def reference_chunk_text(chunker, text, max_tokens):
+    """The original re-tokenizing implementation, with lines that follow a
+    flushed buffer separated by a space instead of glued together."""
+    tokenizer = chunker.default_tokenizer
+    if chunker.detect_language(text) == "chinese":
+        delimiters = ["\n\n", "\n", "。", "，"]
+    else:
+        delimiters = ["\n\n", "\n", ".", ","]
+
+    def _split(segment: str, level: int) -> List[str]:
+        if level >= len(delimiters):
+            return [segment.strip()]
+        if len(tokenizer(segment)) <= max_tokens:
+            return [segment.strip()]
+        delim = delimiters[level]
+        parts = segment.split(delim)
+        chunks: List[str] = []
+        buffer = ""
+        for i, part in enumerate(parts):
+            append_delim = delim if level >= 2 and i < len(parts) - 1 else ""
+            candidate = (buffer + part + append_delim).strip()
+            if not candidate:
+                continue
+            if len(tokenizer(candidate)) > max_tokens:
+                if buffer:
+                    chunks.extend(_split(buffer.strip(), level + 1))
+                    buffer = part + append_delim + (" " if level < 2 else "")
+                else:
+                    chunks.extend(_split(part + append_delim, level + 1))
+                    buffer = ""
+            else:
+                buffer = candidate + (" " if level < 2 else "")
+        if buffer:
+            chunks.append(buffer.strip())
+        refined: List[str] = []
+        for ch in chunks:
+            refined.extend(_split(ch, level + 1))
+        return refined
+
+    return [c for c in _split(text.replace("\r\n", "\n"), 0) if c]
+
+
+def random_text(seed):
+    rng = random.Random(seed)
+    words = ["alpha", "beta", "gamma", "delta", "Tony", "suit", "42", "混元珠"]
+    paragraphs = []
+    for _ in range(rng.randint(1, 6)):
+        lines = []
+        for _ in range(rng.randint(1, 8)):
+            sentence = " ".join(rng.choice(words) for _ in range(rng.randint(1, 30)))
+            lines.append(rng.choice([", ", ". ", ","]).join(sentence.split(" " + words[0])))
+        paragraphs.append("\n".join(lines))
+    return "\n\n".join(paragraphs)
+
+
+@pytest.fixture
+def chunker():
+    return NeibourSimilarityChunker(embedding_model_name="unused")
+
+
+@pytest.mark.parametrize("name", ["cn_example_nazha_dataset.csv", "en_example_ironman_dataset.csv"])
+@pytest.mark.parametrize("max_tokens", [20, 150])
+def test_matches_reference_on_examples(chunker, name, max_tokens):
+    with open(os.path.join(EXAMPLES, name), encoding="utf-8") as f:
+        next(f)
+        text = f.read()[:30000]
+    assert chunker.chunk_text(text, max_tokens=max_tokens) == reference_chunk_text(
+        chunker, text, max_tokens
+    )
+
+
+@pytest.mark.parametrize("seed", range(30))
+def test_matches_reference_on_random_text(chunker, seed):
+    text = random_text(seed)
+    for max_tokens in (5, 17, 60):
+        assert chunker.chunk_text(text, max_tokens=max_tokens) == reference_chunk_text(
+            chunker, text, max_tokens
+        )
+
+
+def test_lines_after_a_flush_are_not_glued(chunker):
+    text = "alpha beta\ndelta epsilon zeta eta theta iota kappa\nlambda mu\nnu xi"
+    assert chunker.chunk_text(text, max_tokens=6)[-1] == "lambda mu nu xi"
+
+
+def test_model_tokenizer_sets_the_token_limit(chunker):
+    def letters(text):
+        return re.findall(r"[a-z]", text)
+
+    class FakeTokenizer:
+        def __call__(self, texts, **kwargs):
+            return {"input_ids": [letters(t) for t in texts]}
+
+    class FakeEmbedder:
+        class model:
+            tokenizer = FakeTokenizer()
+
+    text = "a-b-c\nd-e-f\ng-h-i"
+    # The regex tokenizer counts 5 tokens per line, so no two lines fit in 6.
+    assert chunker.chunk_text(text, max_tokens=6) == ["a-b-c", "d-e-f", "g-h-i"]
+    chunker.use_model_tokenizer = True
+    chunker._embedder = FakeEmbedder()
+    chunks = chunker.chunk_text(text, max_tokens=6)
+    assert chunks == ["a-b-c d-e-f", "g-h-i"]
+    assert all(len(letters(chunk)) <= 6 for chunk in chunks)
@@ -0,0 +1,67 @@
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src")))
+
+import re
+import zlib
+
+import numpy as np
+import pytest
+from qdrant_client import QdrantClient
+
+from database.connector import QdrantConnector
+
+
+class FakeEmbeddingModel:
+    """Stands in for `EmbeddingModelController`: hashed bag-of-words vectors,
+    so texts sharing words are similar, without loading a real model."""
+
+    def __init__(self, model_name=None, dim=16):
+        self.model_name = model_name
+        self.dim = dim
+
+    def _vector(self, text):
+        vec = np.zeros(self.dim, dtype=np.float32)
+        for token in re.findall(r"\w+", str(text).lower()):
+            rng = np.random.default_rng(zlib.crc32(token.encode("utf-8")))
+            vec += rng.normal(size=self.dim).astype(np.float32)
+        return vec if vec.any() else np.full(self.dim, 1e-3, dtype=np.float32)
+
+    def embed(self, text):
+        if isinstance(text, str):
+            return self._vector(text)
+        return np.stack([self._vector(t) for t in text]) if len(text) else np.zeros((0, self.dim))
+
+
+TINY_WORDS = ["tony", "pepper", "suit", "armor", "lab", "coffee", "jarvis", "fly", "fix", "the", "a", "is"]
+
+
+def build_tiny_model(path, hidden_size=16, num_hidden_layers=1, hidden_dropout_prob=0.1):
+    """Save a tiny random BERT over `TINY_WORDS` to `path`, loadable by
+    `SentenceTransformer(path)`, so training runs offline in seconds."""
+    from transformers import BertConfig, BertModel, BertTokenizerFast
+
+    path = str(path)
+    os.makedirs(path, exist_ok=True)
+    vocab = os.path.join(path, "vocab.txt")
+    with open(vocab, "w", encoding="utf-8") as f:
+        f.write("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + TINY_WORDS) + "\n")
+    BertTokenizerFast(vocab_file=vocab).save_pretrained(path)
+    BertModel(BertConfig(
+        vocab_size=5 + len(TINY_WORDS), hidden_size=hidden_size, num_hidden_layers=num_hidden_layers,
+        num_attention_heads=2, intermediate_size=2 * hidden_size, max_position_embeddings=64,
+        hidden_dropout_prob=hidden_dropout_prob, attention_probs_dropout_prob=hidden_dropout_prob,
+    )).save_pretrained(path)
+    return path
+
+
+@pytest.fixture(scope="session")
+def tiny_model_path(tmp_path_factory):
+    return build_tiny_model(tmp_path_factory.mktemp("tiny_bert"))
+
+
+@pytest.fixture
+def memory_qdrant(monkeypatch):
+    """Route every `QdrantConnector().connect()` to one in-memory client."""
+    client = QdrantClient(":memory:")
+    monkeypatch.setattr(QdrantConnector, "connect", lambda self, *a, **kw: client)
+    return client
@@ -0,0 +1,94 @@
+import json
+import os
+
+import pytest
+
+from database.qdrant_controller import FOLDED_FIELD, QdrantController
+from retrieval import consolidation
+from retrieval.consolidation import MemoryConsolidator
+from retrieval.structured_csv_retrieve import StructuredCSVRetrieval
+from tests.conftest import FakeEmbeddingModel
+
+
+class FakeModelContext:
+    def __init__(self, model_name):
+        self.history = []
+
+    def clear_history(self):
+        self.history = []
+
+    def add_user_message(self, messages):
+        self.history.append(messages)
+
+    def call_model(self):
+        return "summary of " + str(self.history[-1].count("\n") - 4) + " turns"
+
+
+@pytest.fixture
+def memories(memory_qdrant, monkeypatch):
+    monkeypatch.setattr(consolidation, "EmbeddingModelController", FakeEmbeddingModel)
+    monkeypatch.setattr(consolidation, "ModelContext", FakeModelContext)
+    qc = QdrantController(memory_qdrant)
+    qc.create_collection("memories", vector_size=16)
+    topics = [[1.0] + [0.0] * 15] * 4 + [[0.0, 1.0] + [0.0] * 14] * 4 + [[0.0, 0.0, 1.0] + [0.0] * 13] * 2
+    stamps = ["2020-01-01T00:00:00Z"] * 8 + ["2999-01-01T00:00:00Z"] * 2
+    qc.upsert_points("memories", [
+        qc.make_point(i, vector, {"text": f"turn {i}", "talker": "TONY", "time": "", "source": f"M:{i}",
+                                  "row": i, "timestamp": stamp})
+        for i, (vector, stamp) in enumerate(zip(topics, stamps))
+    ])
+    return qc
+
+
+def test_old_clusters_become_summaries(memories, tmp_path):
+    consolidator = MemoryConsolidator("memories", "unused", archive_dir=str(tmp_path), batch_size=5, pause_seconds=0)
+    report = consolidator.run_once()
+
+    assert report["points_before"] == 10 and report["points_after"] == 4
+    assert report["clusters"] == 2 and report["turns_consolidated"] == 8
+    assert report["latency_ms_after"] is not None
+
+    points = {p.id: p.payload for p in memories.client.scroll("memories", limit=20)[0]}
+    assert sorted(points) == [0, 4, 8, 9]
+    assert points[4]["kind"] == "summary"
+    assert points[4]["consolidated_sources"] == ["M:4", "M:5", "M:6", "M:7"]
+    assert StructuredCSVRetrieval.stands_for(points[0]) == ["M:0", "M:1", "M:2", "M:3"]
+
+    with open(consolidator.archive_path, encoding="utf-8") as f:
+        archived = [json.loads(line) for line in f]
+    assert [a["id"] for a in archived] == list(range(8))
+    assert archived[5]["vector"][:3] == [0.0, 1.0, 0.0]
+
+    # Incremental: nothing new is old enough, so a second run changes nothing.
+    assert consolidator.run_once()["clusters"] == 0
+    assert memories.client.count("memories").count == 4
+
+
+def test_folded_duplicates_are_archived_with_their_cluster(memories, tmp_path):
+    # M:5 stands for a repeat far away in the dialogue (row 10); M:9, which
+    # is too recent to consolidate, for row 11.
+    memories.client.set_payload("memories", {"duplicate_sources": ["M:10"]}, points=[5])
+    memories.client.set_payload("memories", {"duplicate_sources": ["M:11"]}, points=[9])
+    memories.upsert_points("memories", [
+        memories.make_point(row, {}, {"text": f"repeat {row}", "talker": "TONY", "time": "", "source": f"M:{row}",
+                                      "row": row, FOLDED_FIELD: into})
+        for row, into in ((10, 5), (11, 9))
+    ])
+    consolidator = MemoryConsolidator("memories", "unused", archive_dir=str(tmp_path), batch_size=5, pause_seconds=0)
+    report = consolidator.run_once()
+
+    assert report["points_before"] == 12 and report["points_after"] == 5
+    points = {p.id: p.payload for p in memories.client.scroll("memories", limit=20)[0]}
+    assert sorted(points) == [0, 4, 8, 9, 11]
+    assert points[4]["consolidated_sources"] == ["M:4", "M:5", "M:6", "M:7"]
+    with open(consolidator.archive_path, encoding="utf-8") as f:
+        archived = {a["id"]: a for a in map(json.loads, f)}
+    assert sorted(archived) == list(range(8)) + [10] and archived[10]["vector"] is None
+
+
+def test_collection_and_tenant_keep_separate_archives(memories, tmp_path):
+    dotted = MemoryConsolidator("a.b", "unused", archive_dir=str(tmp_path))
+    tenant = MemoryConsolidator("a", "unused", tenant="b", archive_dir=str(tmp_path))
+    assert dotted.archive_path != tenant.archive_path and dotted.state_path != tenant.state_path
+    escaped = MemoryConsolidator("a", "unused", tenant="../../x", archive_dir=str(tmp_path))
+    assert os.path.dirname(escaped.archive_path) == str(tmp_path)
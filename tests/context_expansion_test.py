@@ -0,0 +1,50 @@
+from types import SimpleNamespace
+
+import pytest
+
+from database.qdrant_controller import QdrantController
+from retrieval.structured_csv_retrieve import StructuredCSVRetrieval
+
+
+@pytest.fixture
+def dialogue(memory_qdrant, monkeypatch):
+    qc = QdrantController(memory_qdrant)
+    qc.create_collection("dialogue", vector_size=2)
+    qc.upsert_points("dialogue", [
+        qc.make_point(i, [1.0, float(i)], {"text": f"line {i}", "talker": "TONY", "time": "", "source": f"D1:{i}"})
+        for i in range(20)
+    ])
+    calls = []
+    original = QdrantController.get_points
+
+    def counting_get_points(self, collection, ids, **kwargs):
+        calls.append(list(ids))
+        return original(self, collection, ids, **kwargs)
+
+    monkeypatch.setattr(QdrantController, "get_points", counting_get_points)
+    return qc, calls
+
+
+def hits(*ids):
+    return [SimpleNamespace(id=i, payload=None) for i in ids]
+
+
+def test_overlapping_windows_merge_and_keep_hit_order(dialogue):
+    qc, calls = dialogue
+    # Ranked hits: 10 first, then 0 (window clipped at the start), then 12
+    # (overlaps 10's window), then 19 (window runs past the last row).
+    result = StructuredCSVRetrieval().expand_context(qc, "dialogue", hits(10, 0, 12, 19), window=2)
+
+    assert [item["idx"] for item in result] == [
+        [f"D1:{i}" for i in range(8, 15)],
+        ["D1:0", "D1:1", "D1:2"],
+        ["D1:17", "D1:18", "D1:19"],
+    ]
+    assert result[1]["text"] == "[] TONY: line 0\n[] TONY: line 1\n[] TONY: line 2\n"
+    assert len(calls) == 1
+
+
+def test_touching_windows_form_one_snippet(dialogue):
+    qc, _ = dialogue
+    result = StructuredCSVRetrieval().expand_context(qc, "dialogue", hits(3, 6), window=1)
+    assert [item["idx"] for item in result] == [[f"D1:{i}" for i in range(2, 8)]]
@@ -0,0 +1,118 @@
+import csv
+import itertools
+
+import pytest
+
+from database.model_registry import ModelRegistry
+from database.qdrant_controller import QdrantController
+from tests.conftest import FakeEmbeddingModel
+from retrieval import contextual_retrieve
+from retrieval.chunking_strategies.neighbour_sim import NeibourSimilarityChunker
+
+
+class FakeModelContext:
+    def __init__(self, model_name):
+        self.history = []
+
+    def clear_history(self):
+        self.history = []
+
+    def add_user_message(self, messages):
+        self.history.append(messages)
+
+    def call_model(self):
+        return "context: " + self.history[-1].split("<chunk>")[1].split("</chunk>")[0].strip()[:40]
+
+
+def write_dialogue(path, n_rows):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["source", "time", "talker", "text"])
+        for i in range(n_rows):
+            writer.writerow([f"D1:{i}", "", "TONY" if i % 2 else "PEPPER", f"Line number {i}, about the suit."])
+
+
+def test_stream_chunks_is_lazy_and_keeps_sources(tmp_path):
+    path = str(tmp_path / "dialogue.csv")
+    write_dialogue(path, 50)
+    chunker = NeibourSimilarityChunker(embedding_model_name="unused")
+
+    consumed = []
+
+    def tracking_rows():
+        for i, row in enumerate(chunker.iter_rows(path)):
+            consumed.append(i)
+            yield row
+
+    stream = chunker.stream_chunks(tracking_rows(), max_tokens=30, batch_size=4, language_sample_chars=10)
+    first = next(stream)
+    assert len(consumed) < 50
+    chunks = [first, *stream]
+
+    assert [r for c in chunks for r in c.rows] == list(range(50))
+    assert [s for c in chunks for s in c.sources] == [f"D1:{i}" for i in range(50)]
+    assert chunks[0].text.startswith("D1:0,,PEPPER,")
+
+
+def test_oversized_row_is_split_but_keeps_its_source(tmp_path):
+    path = str(tmp_path / "long.csv")
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["source", "time", "talker", "text"])
+        writer.writerow(["D1:0", "", "TONY", "Short."])
+        writer.writerow(["D1:1", "", "TONY", " ".join(["word"] * 10) + ". " + " ".join(["more"] * 10) + "."])
+    chunker = NeibourSimilarityChunker(embedding_model_name="unused")
+    chunks = list(chunker.stream_chunks(chunker.iter_rows(path), max_tokens=25))
+    assert [c.sources for c in chunks] == [["D1:0"], ["D1:1"], ["D1:1"]]
+
+
+def test_text_files_keep_paragraph_boundaries_like_chunk_text(tmp_path):
+    text = "a b\n\nc d e f\ng h\n\ni j k\nl m n\no p\n\nq"
+    path = tmp_path / "notes.txt"
+    path.write_text(text, encoding="utf-8")
+    chunker = NeibourSimilarityChunker(embedding_model_name="unused")
+    chunks = list(chunker.stream_chunks(chunker.iter_rows(str(path)), max_tokens=6))
+    # "c d e f / g h" fits in one chunk, so it is not packed after "a b";
+    # "i j k / l m n / o p" does not, so its rows are packed on their own.
+    assert [c.text for c in chunks] == [" ".join(c.split()) for c in chunker.chunk_text(text, max_tokens=6)]
+    assert [c.rows for c in chunks] == [[0], [2, 3], [5, 6], [7], [9]]
+
+
+def test_contextual_index_streams_into_qdrant(tmp_path, memory_qdrant, monkeypatch):
+    monkeypatch.setattr(contextual_retrieve, "ModelContext", FakeModelContext)
+    monkeypatch.setattr(NeibourSimilarityChunker, "embedder", FakeEmbeddingModel())
+    path = str(tmp_path / "dialogue.csv")
+    write_dialogue(path, 300)
+
+    indexer = contextual_retrieve.ContextualIndexing(summary_workers=3, batch_size=5)
+    indexer.index(embedding_model_path="unused", file_path=path, collection_name="ctx")
+
+    points, _ = memory_qdrant.scroll("ctx", limit=1000, with_payload=True)
+    points.sort(key=lambda p: p.id)
+    assert [p.id for p in points] == list(range(len(points)))
+    assert list(itertools.chain.from_iterable(p.payload["source"] for p in points)) == [
+        f"D1:{i}" for i in range(300)
+    ]
+    assert all(p.payload["key"].startswith("context: D1:") for p in points)
+    assert ModelRegistry(QdrantController(memory_qdrant)).get("ctx")["fingerprint"] == "hub:unused"
+
+
+def test_failed_index_leaves_no_collection(tmp_path, memory_qdrant, monkeypatch):
+    class FailingModelContext(FakeModelContext):
+        calls = 0
+
+        def call_model(self):
+            FailingModelContext.calls += 1
+            if FailingModelContext.calls > 20:
+                raise RuntimeError("LLM unavailable")
+            return super().call_model()
+
+    monkeypatch.setattr(contextual_retrieve, "ModelContext", FailingModelContext)
+    monkeypatch.setattr(NeibourSimilarityChunker, "embedder", FakeEmbeddingModel())
+    path = str(tmp_path / "dialogue.csv")
+    write_dialogue(path, 300)
+
+    indexer = contextual_retrieve.ContextualIndexing(summary_workers=1, batch_size=5)
+    with pytest.raises(RuntimeError, match="LLM unavailable"):
+        indexer.index(embedding_model_path="unused", file_path=path, collection_name="ctx")
+    assert not memory_qdrant.collection_exists("ctx")
@@ -0,0 +1,83 @@
+import csv
+
+import numpy as np
+
+from database.qdrant_controller import FOLDED_FIELD, QdrantController
+from retrieval import structured_csv_retrieve
+from retrieval.dedup import MinHashDeduplicator, shingles
+from retrieval.structured_csv_retrieve import StructuredCSVIndexing, StructuredCSVRetrieval
+from tests.conftest import FakeEmbeddingModel
+
+
+def test_shingles_ignore_case_and_punctuation_and_split_cjk():
+    assert shingles("Yeah.") == shingles("yeah!!") == {"yeah"}
+    assert shingles("混元珠") == {"混元", "元珠"}
+    assert shingles("...") == {"..."}
+
+
+def test_clusters_fold_near_duplicates_only():
+    texts = [
+        "Jarvis, run the diagnostics on the Mark 42 suit.",
+        "OK.",
+        "jarvis run the diagnostics on the mark 42 suit",
+        "Jarvis, run the diagnostics on the Mark 43 suit.",
+        "ok",
+        "哪吒是混元珠的魔丸。",
+        "哪吒是混元珠的魔丸！",
+    ]
+    assert MinHashDeduplicator().clusters(texts) == [[0, 2], [1, 4], [3], [5, 6]]
+
+
+def test_clusters_scale_linearly_without_false_merges():
+    rng = np.random.default_rng(0)
+    words = [f"w{i}" for i in range(500)]
+    texts = [" ".join(rng.choice(words, size=12)) for _ in range(2000)]
+    clusters = MinHashDeduplicator().clusters(texts + texts[:100])
+    assert len(clusters) == 2000
+    assert [c for c in clusters if len(c) > 1] == [[i, 2000 + i] for i in range(100)]
+
+
+def test_index_embeds_representatives_and_keeps_duplicate_sources(tmp_path, memory_qdrant, monkeypatch):
+    calls = []
+
+    class CountingEmbedder(FakeEmbeddingModel):
+        def embed(self, text):
+            calls.append(len(text))
+            return super().embed(text)
+
+    monkeypatch.setattr(structured_csv_retrieve, "EmbeddingModelController", CountingEmbedder)
+    path = str(tmp_path / "dialogue.csv")
+    rows = [("TONY", "Yeah."), ("PEPPER", "Where is the suit?"), ("TONY", "yeah"),
+            ("PEPPER", "Yeah."), ("TONY", "The suit is in the lab."), ("TONY", "Yeah!")]
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["source", "time", "talker", "text"])
+        for i, (talker, text) in enumerate(rows):
+            writer.writerow([f"D1:{i}", "", talker, text])
+
+    indexer = StructuredCSVIndexing()
+    indexer.index(embedding_model_path="unused", file_path=path, collection_name="dedup")
+
+    assert calls == [4]
+    assert indexer.report["duplicates"] == 2
+    assert indexer.report["vector_bytes_saved"] == 2 * 16 * 4
+    qc = QdrantController(memory_qdrant)
+    points = {p.id: p.payload for p in qc.get_points("dedup", list(range(6)))}
+    assert sorted(points) == list(range(6))
+    assert points[0]["duplicate_sources"] == ["D1:2", "D1:5"]
+    assert "duplicate_sources" not in points[3]
+    # The folded lines keep their own row and time, without a vector.
+    assert points[2]["text"] == "TONY: yeah" and points[2]["row"] == 2 and points[2][FOLDED_FIELD] == 0
+    assert [p.id for p in memory_qdrant.scroll("dedup", with_vectors=True)[0] if not p.vector] == [2, 5]
+
+    result = StructuredCSVRetrieval().retrieve(
+        collection_name="dedup", embedding_model_path="unused", query="TONY: yeah", top_k=1,
+    )
+    assert result[0]["idx"] == "D1:0" and result[0]["duplicates"] == ["D1:2", "D1:5"]
+
+    # Context windows have no holes where a duplicate was folded away.
+    [snippet] = StructuredCSVRetrieval().retrieve(
+        collection_name="dedup", embedding_model_path="unused", query="TONY: yeah", top_k=1, context_window=3,
+    )
+    assert snippet["idx"] == ["D1:0", "D1:1", "D1:2", "D1:3"]
+    assert "TONY: TONY: yeah" in snippet["text"] and snippet["duplicates"] == ["D1:5"]
@@ -0,0 +1,69 @@
+import json
+
+import numpy as np
+import pytest
+from sentence_transformers import SentenceTransformer
+
+from tests.conftest import TINY_WORDS, build_tiny_model
+from training.distillation import EmbeddingDistillation, locomo_accuracy, make_student
+
+
+@pytest.fixture(scope="module")
+def teacher_path(tmp_path_factory):
+    # No dropout: the untrained student is already close to a random teacher,
+    # and dropout noise would hide the improvement.
+    return build_tiny_model(tmp_path_factory.mktemp("teacher"), hidden_size=32, num_hidden_layers=4,
+                            hidden_dropout_prob=0.0)
+
+
+def corpus(n=120, seed=0):
+    rng = np.random.default_rng(seed)
+    texts = [" ".join(rng.choice(TINY_WORDS, size=rng.integers(2, 12))) for _ in range(n)]
+    return list(dict.fromkeys(texts))
+
+
+def test_make_student_keeps_evenly_spaced_layers(teacher_path):
+    teacher = SentenceTransformer(teacher_path, device="cpu")
+    layers = teacher[0].auto_model.encoder.layer
+    student, projection = make_student(teacher, num_layers=2, output_dim=8, pca_texts=corpus())
+
+    kept = student[0].auto_model.encoder.layer
+    assert len(kept) == 2 and len(layers) == 4
+    assert kept[0].output.dense.weight.equal(layers[0].output.dense.weight)
+    assert kept[1].output.dense.weight.equal(layers[3].output.dense.weight)
+    assert projection.shape == (8, 32)
+    assert student.get_sentence_embedding_dimension() == 8
+
+
+def test_distilled_student_matches_the_teacher(teacher_path, tmp_path):
+    texts = corpus()
+    distillation = EmbeddingDistillation(teacher_path, num_layers=1, output_dim=8)
+    distillation.teacher.to("cpu")
+    student, projection = make_student(distillation.teacher, 1, 8, pca_texts=texts)
+    targets = distillation.teacher.encode(texts) @ projection.T
+    before = np.mean((student.encode(texts) - targets) ** 2)
+
+    distillation.distill(texts, output_path=str(tmp_path / "student"), epochs=5, train_batch_size=16)
+    np.testing.assert_allclose(distillation.projection, projection, atol=1e-5)
+    saved = SentenceTransformer(str(tmp_path / "student"), device="cpu")
+    after = np.mean((saved.encode(texts) - targets) ** 2)
+    assert saved.get_sentence_embedding_dimension() == 8
+    assert after < before
+
+    report = distillation.report(texts[:5])
+    assert report["student"]["parameters"] < report["teacher"]["parameters"]
+    assert report["student"]["query_latency_ms"] > 0
+
+
+def test_locomo_accuracy(teacher_path, tmp_path):
+    csv = tmp_path / "conv.csv"
+    csv.write_text("source,time,talker,text\nD1:1,,TONY,tony fix the suit\nD1:2,,PEPPER,coffee in the lab\n")
+    qa = tmp_path / "qa.json"
+    qa.write_text(json.dumps([
+        {"question": "tony fix the suit", "evidence": ["D1:1"]},
+        {"question": "coffee", "evidence": ["D1:1", "D1:2"]},
+        {"question": "no evidence", "evidence": []},
+    ]))
+    model = SentenceTransformer(teacher_path, device="cpu")
+    assert locomo_accuracy(model, str(csv), str(qa), top_k=2) == 1.0
+    assert locomo_accuracy(model, str(csv), str(qa), top_k=1) == 0.5
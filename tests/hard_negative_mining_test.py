@@ -0,0 +1,82 @@
+import csv
+
+import numpy as np
+import pytest
+
+from tests.conftest import FakeEmbeddingModel
+from training.anchor_cl_mining import CLHardNegativeMining
+
+
+class FakeSentenceTransformer(FakeEmbeddingModel):
+    def encode(self, texts, **kwargs):
+        return self.embed(texts)
+
+
+def brute_force(embeddings, sessions, top_k, window, max_similarity):
+    n = len(embeddings)
+    sims = embeddings @ embeddings.T
+    out = np.full((n, top_k), -1)
+    for i in range(n):
+        valid = [j for j in range(n) if j != i and sims[i, j] <= max_similarity
+                 and not (sessions[i] == sessions[j] and abs(i - j) <= window)]
+        ranked = sorted(valid, key=lambda j: -sims[i, j])[:top_k]
+        out[i, :len(ranked)] = ranked
+    return out
+
+
+@pytest.mark.parametrize("block_size", [7, 64, 1000])
+def test_blocked_search_matches_brute_force(block_size):
+    rng = np.random.default_rng(0)
+    embeddings = rng.normal(size=(150, 8)).astype(np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    sessions = np.repeat(np.arange(5), 30)
+    got = CLHardNegativeMining.hard_negatives(
+        embeddings, sessions, top_k=5, exclusion_window=3, max_similarity=0.9, block_size=block_size
+    )
+    np.testing.assert_array_equal(got, brute_force(embeddings, sessions, 5, 3, 0.9))
+
+
+def test_adjacent_positives_stay_in_session():
+    sessions = np.array([0, 0, 0, 1, 2, 2])
+    assert CLHardNegativeMining.adjacent_positives(sessions).tolist() == [1, 2, 1, -1, 5, 4]
+
+
+def test_mine_writes_a_triplet_dataset(tmp_path):
+    path = str(tmp_path / "dialogue.csv")
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["source", "time", "talker", "text"])
+        for session in range(3):
+            for turn in range(6):
+                writer.writerow([f"D{session}:{turn}", "", "TONY", f"session {session} turn {turn} about the suit"])
+        writer.writerow(["D9:0", "", "TONY", "a lonely turn"])
+
+    from datasets import load_from_disk
+    from training.cl_training import CLTraining
+
+    miner = CLHardNegativeMining(model=FakeSentenceTransformer())
+    miner.mine(path, output_path=str(tmp_path / "triplets"), exclusion_window=1)
+    triplets = load_from_disk(str(tmp_path / "triplets"))
+
+    assert len(triplets) == 18
+    assert triplets[0]["anchor"] == "session 0 turn 0 about the suit"
+    assert triplets[0]["positive"] == "session 0 turn 1 about the suit"
+    assert triplets[0]["negative"] != triplets[0]["positive"]
+    examples = CLTraining.prepare_triplets(None, triplets)
+    assert examples[0].texts == [triplets[0]["anchor"], triplets[0]["positive"], triplets[0]["negative"]]
+
+
+def test_mining_never_uses_held_out_turns(tmp_path):
+    path = str(tmp_path / "dialogue.csv")
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["source", "time", "talker", "text"])
+        for turn in range(20):
+            writer.writerow([f"D{turn // 10}:{turn}", "", "TONY", f"turn {turn} about the suit"])
+
+    triplets = CLHardNegativeMining(model=FakeSentenceTransformer()).mine(path, exclusion_window=1, max_turns=15)
+    held_out = {f"turn {turn} about the suit" for turn in range(15, 20)}
+    used = set(triplets["anchor"]) | set(triplets["positive"]) | set(triplets["negative"])
+    assert len(triplets) == 15 and not used & held_out
+    # The last training turn's positive is the turn before it, not the first held-out one.
+    assert triplets["positive"][-1] == "turn 13 about the suit"
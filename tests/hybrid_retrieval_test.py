@@ -0,0 +1,56 @@
+import csv
+import zlib
+
+import numpy as np
+import pytest
+
+from model_management.sparse_model_controller import SparseModelController, lexical_tokens
+from retrieval import structured_csv_retrieve
+from retrieval.structured_csv_retrieve import StructuredCSVIndexing, StructuredCSVRetrieval
+
+
+class LexicallyBlindEmbedder:
+    """Dense vectors that carry no lexical signal at all."""
+
+    def __init__(self, model_name=None):
+        pass
+
+    def embed(self, text):
+        def vec(t):
+            return np.random.default_rng(zlib.crc32(t.encode("utf-8"))).normal(size=8)
+        return vec(text) if isinstance(text, str) else np.stack([vec(t) for t in text])
+
+
+def test_lexical_tokens_are_cjk_aware():
+    assert lexical_tokens("Chitauri army") == ["chitauri", "army"]
+    assert lexical_tokens("混元珠") == ["混", "元", "珠", "混元", "元珠"]
+
+
+def test_bm25_document_weights_saturate_and_normalise_length():
+    model = SparseModelController(avg_doc_length=4)
+    once, twice, long_doc = model.embed_documents(["suit a b c", "suit suit b c", "suit " + "x " * 20])
+    idx = SparseModelController.term_index("suit")
+
+    def weight(vec):
+        return dict(zip(vec.indices, vec.values))[idx]
+
+    assert weight(once) < weight(twice) < 2 * weight(once)
+    assert weight(long_doc) < weight(once)
+
+
+@pytest.mark.parametrize("query, expected", [("Who fought the Chitauri?", "D1:7"), ("混元珠在哪里", "D1:3")])
+def test_hybrid_query_surfaces_rare_terms(tmp_path, memory_qdrant, monkeypatch, query, expected):
+    monkeypatch.setattr(structured_csv_retrieve, "EmbeddingModelController", LexicallyBlindEmbedder)
+    path = str(tmp_path / "dialogue.csv")
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["source", "time", "talker", "text"])
+        for i in range(20):
+            text = {3: "混元珠很是愤怒。", 7: "The Chitauri came through the portal."}.get(i, f"Small talk number {i}.")
+            writer.writerow([f"D1:{i}", "", "TONY", text])
+
+    StructuredCSVIndexing().index(embedding_model_path="unused", file_path=path, collection_name="hybrid")
+    result = StructuredCSVRetrieval().retrieve(
+        collection_name="hybrid", embedding_model_path="unused", query=query, top_k=5, hybrid=True
+    )
+    assert result[0]["idx"] == expected
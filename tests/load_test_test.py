@@ -0,0 +1,65 @@
+import asyncio
+import random
+
+import httpx
+import pytest
+
+from benchmarks.load_test import Phase, Workload, arrivals, drive, parse_mix
+from retrieval import structured_csv_retrieve
+from tests.conftest import FakeEmbeddingModel
+
+
+def test_mix_is_normalised_and_validated():
+    assert parse_mix("single=3,batch=1") == {"single": 0.75, "batch": 0.25}
+    assert parse_mix("filtered") == {"filtered": 1.0}
+    with pytest.raises(ValueError, match="unknown"):
+        parse_mix("unknown=1")
+
+
+def test_arrivals_are_an_open_loop_poisson_schedule():
+    times = arrivals(50, 20, random.Random(0))
+    assert times == sorted(times) and 0 < times[0] and times[-1] < 20
+    assert len(times) == pytest.approx(1000, rel=0.1)
+    assert times == arrivals(50, 20, random.Random(0))
+
+
+def test_phase_summary():
+    phase = Phase(rate=10, duration=2)
+    phase.records = [
+        {"kind": "single", "ok": True, "status": "200", "latency": 0.01 * (i + 1), "done": 0.1 * i}
+        for i in range(18)
+    ] + [{"kind": "batch", "ok": False, "status": "500", "latency": 0.5, "done": 2.5}] * 2
+    summary = phase.summary([(0.0, 100.0), (1.0, 120.0), (2.0, 110.0)])
+    assert summary["requests"] == 20 and summary["errors"] == {"500": 2}
+    assert summary["error_rate"] == pytest.approx(0.1)
+    assert summary["achieved_qps"] == pytest.approx(18 / 2.5)
+    assert summary["latency_ms"]["p50"] == pytest.approx(95)
+    assert summary["by_kind"]["batch"]["latency_ms"]["p50"] is None
+    assert summary["server_rss_mb"] == {"start": 100.0, "max": 120.0, "end": 110.0}
+
+
+def test_drives_the_api_with_every_request_kind(tmp_path, memory_qdrant, monkeypatch):
+    import api
+    from retrieval import contextual_retrieve, multi_collection_retrieve
+    from retrieval.chunking_strategies import neighbour_sim
+
+    for module in (structured_csv_retrieve, contextual_retrieve, multi_collection_retrieve, neighbour_sim):
+        monkeypatch.setattr(module, "EmbeddingModelController", FakeEmbeddingModel)
+    monkeypatch.setattr(contextual_retrieve.ContextualIndexing, "_summarize", lambda self, chunk: chunk[:40])
+    paths = []
+    for i in range(3):
+        path = tmp_path / f"load_{i}.csv"
+        path.write_text("source,time,talker,text\n" + "".join(
+            f"D1:{j},,TONY,line {j} of file {i} about the suit\n" for j in range(20)
+        ), encoding="utf-8")
+        paths.append(str(path))
+    workload = Workload("unused", paths[:2], ["the suit", "file 1"], contextual_path=paths[2])
+
+    report = asyncio.run(drive(
+        "http://api", workload, parse_mix("single,batch,filtered,contextual"), [20], 1,
+        transport=httpx.ASGITransport(app=api.app),
+    ))
+    [phase] = report["phases"]
+    assert phase["error_rate"] == 0 and phase["requests"] > 5
+    assert set(phase["by_kind"]) <= {"single", "batch", "filtered", "contextual"}
+    assert phase["server_rss_mb"] is None and report["server_rss_timeline"] == []
@@ -0,0 +1,110 @@
+import csv
+import json
+
+import pytest
+
+from evaluation import locomo_eval
+from evaluation.locomo_eval import LocomoEvaluation, evidence_ranks, score
+from retrieval import structured_csv_retrieve
+from retrieval.structured_csv_retrieve import StructuredCSVRetrieval
+from tests.conftest import FakeEmbeddingModel
+
+CONVERSATIONS = {
+    "conv-1": [
+        ("Caroline", "I went to the LGBTQ support group yesterday."),
+        ("Melanie", "I painted a sunrise over the lake last week."),
+        ("Caroline", "Adoption agencies called me about the interview."),
+        ("Melanie", "My kids loved the camping trip in the mountains."),
+    ],
+    "conv-2": [
+        ("Jon", "I lost my banking job in January."),
+        ("Gina", "My clothing store opened downtown."),
+        ("Jon", "The dance studio needs a new floor."),
+    ],
+}
+QUESTIONS = {
+    "conv-1": [
+        {"question": "When did Melanie paint a sunrise over the lake?", "evidence": ["D1:1"]},
+        {"question": "Where did Melanie's kids go camping in the mountains?", "evidence": ["D1:3"]},
+        {"question": "What did Caroline do about adoption and the support group?", "evidence": ["D1:0", "D1:2"]},
+        {"question": "An adversarial question without evidence", "evidence": []},
+    ],
+    "conv-2": [
+        {"question": "When did Jon lose his banking job?", "evidence": ["D1:0"]},
+        {"question": "Where did Gina's clothing store open?", "evidence": ["D1:1"]},
+    ],
+}
+
+
+@pytest.fixture
+def data_dir(tmp_path, memory_qdrant, monkeypatch):
+    monkeypatch.setattr(structured_csv_retrieve, "EmbeddingModelController", FakeEmbeddingModel)
+    monkeypatch.setattr(locomo_eval, "EmbeddingModelController", FakeEmbeddingModel)
+    for conversation, lines in CONVERSATIONS.items():
+        with open(tmp_path / f"locomo_{conversation}.csv", "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["source", "time", "talker", "text"])
+            for i, (talker, text) in enumerate(lines):
+                writer.writerow([f"D1:{i}", "", talker, text])
+        with open(tmp_path / f"locomo_{conversation}_qa.json", "w", encoding="utf-8") as f:
+            json.dump(QUESTIONS[conversation], f)
+    return str(tmp_path)
+
+
+def test_metrics_for_every_k_from_one_ranking():
+    ranks = [evidence_ranks(["a"], [{"b"}, {"a"}]), evidence_ranks(["a", "b"], [{"a"}, {"c"}, {"b"}])]
+    assert ranks == [[2], [1, 3]]
+    metrics = score(ranks, [1, 3])
+    assert metrics["accuracy"] == {"1": 0.0, "3": 1.0}
+    assert metrics["recall"] == {"1": 0.25, "3": 1.0}
+    assert metrics["mrr"] == pytest.approx((1 / 2 + 1) / 2)
+    # Exact matching: "D1:3" is not found in "D1:30".
+    assert evidence_ranks(["D1:3"], [{"D1:30"}]) == [float("inf")]
+
+
+def test_evaluates_every_conversation_in_one_run(data_dir):
+    report = LocomoEvaluation("unused", data_dir=data_dir, top_ks=[1, 2, 4], workers=2).run()
+    assert report["config"]["conversations"] == ["conv-1", "conv-2"]
+
+    conv1 = report["conversations"]["conv-1"]["modes"]["naive_csv"]
+    assert conv1["questions"] == 3 and conv1["skipped"] == 1
+    assert conv1["accuracy"]["4"] == 1.0 and conv1["recall"]["4"] == 1.0
+    assert report["summary"]["naive_csv"]["questions"] == 5
+    assert 0 < report["summary"]["naive_csv"]["mrr"] <= 1
+    assert set(report["timing"]["stages"]) == {"index", "embed", "search", "score"}
+    json.dumps(report)
+
+
+def test_batch_search_matches_per_query_retrieval(data_dir):
+    report = LocomoEvaluation("unused", data_dir=data_dir, top_ks=[1, 2]).run()
+    for conversation, questions in QUESTIONS.items():
+        collection = report["conversations"][conversation]["modes"]["naive_csv"]["collection"]
+        ranks = []
+        for qa in questions:
+            if not qa["evidence"]:
+                continue
+            hits = StructuredCSVRetrieval().retrieve(collection, "unused", qa["question"], top_k=2)
+            ranks.append(evidence_ranks(qa["evidence"], [{hit["idx"], *hit["duplicates"]} for hit in hits]))
+        expected = score(ranks, [1, 2])
+        actual = report["conversations"][conversation]["modes"]["naive_csv"]
+        assert actual["accuracy"] == expected["accuracy"] and actual["mrr"] == pytest.approx(expected["mrr"])
+
+
+def test_retrained_model_gets_its_own_collections(data_dir, tmp_path):
+    before = LocomoEvaluation("unused", data_dir=data_dir, top_ks=[1]).run()
+    model_dir = tmp_path / "model"
+    model_dir.mkdir()
+    (model_dir / "weights.bin").write_bytes(b"v1")
+    first = LocomoEvaluation(str(model_dir), data_dir=data_dir, top_ks=[1]).run()
+    (model_dir / "weights.bin").write_bytes(b"v2")
+    retrained = LocomoEvaluation(str(model_dir), data_dir=data_dir, top_ks=[1]).run()
+    names = [
+        report["conversations"]["conv-1"]["modes"]["naive_csv"]["collection"]
+        for report in (before, first, retrained)
+    ]
+    assert len(set(names)) == 3 and all(name.startswith("locomo_conv-1_naive_csv_") for name in names)
+
+
+def test_unknown_conversation_is_an_error(data_dir):
+    with pytest.raises(ValueError, match="conv-99"):
+        LocomoEvaluation("unused", data_dir=data_dir, conversations=["conv-99"])
@@ -0,0 +1,192 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import pytest
+
+from database.qdrant_controller import QdrantController
+from retrieval import memory_buffer
+from retrieval.memory_buffer import MemoryWriteBuffer, close_memory_buffers, get_memory_buffer, search_memories
+from retrieval.style_index import StyleIndex
+from tests.conftest import FakeEmbeddingModel
+
+
+@pytest.fixture
+def make_buffer(tmp_path, memory_qdrant, monkeypatch):
+    monkeypatch.setattr(memory_buffer, "EmbeddingModelController", FakeEmbeddingModel)
+    buffers = []
+
+    def make(**kwargs):
+        kwargs.setdefault("flush_interval", 3600)
+        buffer = MemoryWriteBuffer("memories", "unused", wal_dir=str(tmp_path), **kwargs)
+        buffers.append(buffer)
+        return buffer
+
+    yield make
+    for buffer in buffers:
+        buffer._closed.set()
+        buffer._wake.set()
+
+
+def test_read_your_writes_before_flush(make_buffer, memory_qdrant):
+    buffer = make_buffer(max_batch=100)
+    buffer.add([{"text": "The arc reactor is in the basement.", "talker": "TONY"}])
+
+    assert not memory_qdrant.collection_exists("memories")
+    hits = buffer.search("where is the arc reactor", top_k=1)
+    assert hits[0]["idx"] == "memory:0"
+
+    assert buffer.flush() == 1
+    assert buffer.pending_count() == 0
+    hits = buffer.search("where is the arc reactor", top_k=5)
+    assert [hit["idx"] for hit in hits] == ["memory:0"]
+
+
+def test_flushes_by_size_and_appends_rows(make_buffer, memory_qdrant):
+    qc = QdrantController(memory_qdrant)
+    qc.create_collection("memories", vector_size=16)
+    qc.upsert_points("memories", [qc.make_point(i, [1.0] * 16, {"text": "old", "row": i}) for i in range(5)])
+
+    buffer = make_buffer(max_batch=3)
+    acks = buffer.add([{"text": f"memory {i}", "talker": "PEPPER"} for i in range(3)])
+    assert [ack["row"] for ack in acks] == [5, 6, 7]
+
+    deadline = time.monotonic() + 5
+    while buffer.pending_count() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert buffer.pending_count() == 0
+    assert memory_qdrant.count("memories").count == 8
+    assert StyleIndex(qc).get("memories", "PEPPER")["count"] == 3
+
+
+def test_acknowledged_writes_survive_a_crash(make_buffer, memory_qdrant):
+    crashed = make_buffer(max_batch=100)
+    crashed.add([{"text": "Jarvis, remember this.", "talker": "TONY", "source": "S:1"}])
+    crashed.add([{"text": "And this too.", "talker": "TONY"}])
+
+    # A new process replays the log and keeps numbering after it.
+    recovered = make_buffer(max_batch=100)
+    assert recovered.pending_count() == 2
+    assert recovered.add([{"text": "New one."}])[0]["row"] == 2
+    assert recovered.flush() == 3
+    sources = {p.payload["source"] for p in memory_qdrant.scroll("memories", limit=10)[0]}
+    assert sources == {"S:1", "memory:1", "memory:2"}
+    assert open(recovered.wal_path).read() == ""
+
+
+def test_collection_and_tenant_never_share_a_log(tmp_path, memory_qdrant, monkeypatch):
+    monkeypatch.setattr(memory_buffer, "EmbeddingModelController", FakeEmbeddingModel)
+    buffers = []
+
+    def make(collection_name, tenant=None):
+        buffers.append(MemoryWriteBuffer(collection_name, "unused", tenant=tenant,
+                                         wal_dir=str(tmp_path), flush_interval=3600))
+        return buffers[-1]
+
+    try:
+        dotted, tenant, escaped = make("mem.u1"), make("mem", "u1"), make("mem", "../../escaped")
+        dotted.add([{"text": "Collection mem.u1."}])
+        tenant.add([{"text": "Tenant u1 of mem."}])
+        escaped.add([{"text": "Still inside the log directory."}])
+        assert len({dotted.wal_path, tenant.wal_path, escaped.wal_path}) == 3
+        assert {os.path.dirname(b.wal_path) for b in (dotted, tenant, escaped)} == {str(tmp_path)}
+
+        # After a restart each replays only its own memories ...
+        assert [e["text"] for e in make("mem.u1")._pending] == ["Collection mem.u1."]
+        # ... and skips entries of another collection found in its log.
+        with open(tenant.wal_path, "a", encoding="utf-8") as f:
+            f.write(open(dotted.wal_path, encoding="utf-8").read())
+        assert [e["text"] for e in make("mem", "u1")._pending] == ["Tenant u1 of mem."]
+    finally:
+        for buffer in buffers:
+            buffer._closed.set()
+            buffer._wake.set()
+
+
+def test_api_rejects_path_separators_in_names(memory_qdrant):
+    from fastapi.testclient import TestClient
+    import api
+
+    with TestClient(api.app) as client:
+        for body in ({"collection_name": "../mem"}, {"collection_name": "mem", "tenant": "a/b"}):
+            response = client.post("/memory/add", json={"model_output_path": "unused", "text": "hi", **body})
+            assert response.status_code == 422
+
+
+def test_search_does_not_wait_for_a_flush(make_buffer):
+    buffer = make_buffer(max_batch=100)
+    buffer.add([{"text": "The arc reactor is in the basement.", "talker": "TONY"}])
+    hits = []
+    with buffer._flush_lock:  # a slow flush in progress
+        searcher = threading.Thread(target=lambda: hits.extend(buffer.search("arc reactor", top_k=1)))
+        searcher.start()
+        searcher.join(5)
+        assert not searcher.is_alive()
+    assert hits[0]["idx"] == "memory:0"
+
+
+def test_one_buffer_per_collection_and_model(tmp_path, memory_qdrant, monkeypatch):
+    monkeypatch.setattr(memory_buffer, "EmbeddingModelController", FakeEmbeddingModel)
+    monkeypatch.setattr(memory_buffer, "DEFAULT_WAL_DIR", str(tmp_path))
+    monkeypatch.setattr(memory_buffer, "_BUFFERS", OrderedDict())
+    try:
+        old = get_memory_buffer("memories", "model-v1")
+        assert get_memory_buffer("memories", "model-v1") is old
+        old.add([{"text": "Embedded with the old model."}])
+        new = get_memory_buffer("memories", "model-v2")
+        # The old buffer was flushed and closed, not left sharing the log.
+        assert new is not old and new.embedding_model_path == "model-v2"
+        assert old._closed.is_set() and new.pending_count() == 0
+        assert memory_qdrant.count("memories").count == 1
+    finally:
+        close_memory_buffers()
+
+
+@pytest.fixture
+def registry(tmp_path, memory_qdrant, monkeypatch):
+    monkeypatch.setattr(memory_buffer, "EmbeddingModelController", FakeEmbeddingModel)
+    monkeypatch.setattr(memory_buffer, "DEFAULT_WAL_DIR", str(tmp_path))
+    monkeypatch.setattr(memory_buffer, "_BUFFERS", OrderedDict())
+    yield memory_buffer
+    close_memory_buffers()
+
+
+def test_registry_evicts_least_recently_used_buffers(registry, memory_qdrant, monkeypatch):
+    monkeypatch.setattr(registry, "_BUFFERS_MAX", 2)
+    first, second = get_memory_buffer("first", "unused"), get_memory_buffer("second", "unused")
+    second.add([{"text": "Not flushed yet."}])
+    assert get_memory_buffer("first", "unused") is first
+
+    # Evicting `second` flushes it without holding up other requests.
+    closing, release = threading.Event(), threading.Event()
+    close = second.close
+    second.close = lambda: (closing.set(), release.wait(5), close())
+    opener = threading.Thread(target=get_memory_buffer, args=("third", "unused"))
+    opener.start()
+    assert closing.wait(5)
+    assert get_memory_buffer("first", "unused") is first
+    release.set()
+    opener.join(5)
+    assert list(registry._BUFFERS) == [("third", None, "unused"), ("first", None, "unused")]
+    assert second._closed.is_set() and memory_qdrant.count("second").count == 1
+
+    monkeypatch.setattr(registry, "_BUFFER_IDLE_SECONDS", 0)
+    get_memory_buffer("first", "unused")
+    assert list(registry._BUFFERS) == [("first", None, "unused")]
+
+
+def test_search_starts_a_buffer_only_for_unflushed_memories(registry, tmp_path):
+    stored = get_memory_buffer("memories", "unused")
+    stored.add([{"text": "The arc reactor is in the basement.", "talker": "TONY"}])
+    close_memory_buffers()
+    assert search_memories("memories", "unused", "arc reactor", top_k=1)[0]["idx"] == "memory:0"
+    assert not registry._BUFFERS
+
+    # A log left by a crashed process is replayed, so its memories are found too.
+    crashed = MemoryWriteBuffer("memories", "unused", flush_interval=3600)
+    crashed.add([{"text": "Jarvis keeps the suit in the lab.", "talker": "TONY"}])
+    crashed._closed.set()
+    crashed._wake.set()
+    assert search_memories("memories", "unused", "suit in the lab", top_k=1)[0]["idx"] == "memory:1"
+    assert list(registry._BUFFERS) == [("memories", None, "unused")]
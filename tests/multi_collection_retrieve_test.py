@@ -0,0 +1,71 @@
+import time
+
+import pytest
+
+from tests.conftest import FakeEmbeddingModel
+from database.qdrant_controller import QdrantController
+from retrieval import multi_collection_retrieve
+from retrieval.multi_collection_retrieve import MultiCollectionRetrieval, normalize_scores
+
+
+@pytest.fixture
+def episodes(memory_qdrant, monkeypatch):
+    monkeypatch.setattr(multi_collection_retrieve, "EmbeddingModelController", FakeEmbeddingModel)
+    embedder = FakeEmbeddingModel()
+    qc = QdrantController(memory_qdrant)
+    lines = {
+        "episode_1": ["the suit is ready", "coffee please", "arc reactor online"],
+        "episode_2": ["the suit needs repairs", "lunch time"],
+        "episode_3": ["weather is nice"],
+    }
+    for name, texts in lines.items():
+        qc.create_collection(name, vector_size=embedder.dim)
+        qc.upsert_points(name, [
+            qc.make_point(i, embedder.embed(t).tolist(), {"text": t, "talker": "TONY", "time": "", "source": f"{name}:{i}"})
+            for i, t in enumerate(texts)
+        ])
+    return list(lines)
+
+
+def test_normalize_scores():
+    assert normalize_scores([0.2, 0.6, 0.4], "minmax") == pytest.approx([0.0, 1.0, 0.5])
+    assert normalize_scores([0.3], "minmax") == [1.0]
+    assert normalize_scores([1.0, 3.0], "zscore") == [-1.0, 1.0]
+    assert normalize_scores([0.2, 0.9]) == [0.2, 0.9]
+
+
+def test_global_top_k_across_collections(episodes):
+    retriever = MultiCollectionRetrieval()
+    result = retriever.retrieve(episodes, "unused", "the suit", top_k=4)
+    assert len(result) == 4
+    assert {r["idx"] for r in result[:2]} == {"episode_1:0", "episode_2:0"}
+    assert [r["score"] for r in result] == sorted((r["score"] for r in result), reverse=True)
+    assert retriever.failed_collections == []
+
+
+def test_weak_shard_loses_to_relevant_hits(episodes):
+    # episode_3 has nothing about the suit: its best hit must not outrank
+    # the relevant ones, as it does once min-max rescales it to 1.0.
+    result = MultiCollectionRetrieval().retrieve(episodes, "unused", "the suit", top_k=2)
+    assert {r["idx"] for r in result} == {"episode_1:0", "episode_2:0"}
+    minmax = MultiCollectionRetrieval().retrieve(episodes, "unused", "the suit", top_k=3, normalization="minmax")
+    assert "episode_3:0" in {r["idx"] for r in minmax}
+
+
+def test_slow_and_missing_collections_degrade_gracefully(episodes, monkeypatch):
+    original = QdrantController.search
+
+    def slow_search(self, collection_name, *args, **kwargs):
+        if collection_name == "episode_2":
+            time.sleep(1.0)
+        return original(self, collection_name, *args, **kwargs)
+
+    monkeypatch.setattr(QdrantController, "search", slow_search)
+    retriever = MultiCollectionRetrieval()
+    start = time.monotonic()
+    result = retriever.retrieve(episodes + ["no_such_collection"], "unused", "the suit", top_k=3, timeout=0.3)
+
+    assert time.monotonic() - start < 0.9
+    assert sorted(retriever.failed_collections) == ["episode_2", "no_such_collection"]
+    assert {r["collection"] for r in result} <= {"episode_1", "episode_3"}
+    assert result[0]["idx"] == "episode_1:0"
@@ -0,0 +1,71 @@
+from typing import List, Sequence
+
+import numpy as np
+import pytest
+
+from retrieval.chunking_strategies.neighbour_sim import NeibourSimilarityChunker
+
+
+def dense_chunk_by_similarity(chunker, chunks, embeddings, similarity_threshold):
+    """Reference implementation: full similarity matrix + linear rescans."""
+    sim_mat = chunker.cosine_similarity_matrix(embeddings)
+    clusters: List[List[int]] = [[i] for i in range(len(chunks))]
+
+    def _mean_similarity(a: Sequence[int], b: Sequence[int]) -> float:
+        sims = [sim_mat[i, j] for i in a for j in b]
+        return float(sum(sims) / len(sims)) if sims else -1.0
+
+    while True:
+        best_sim = -1.0
+        best_i = -1
+        for i in range(len(clusters) - 1):
+            sim = _mean_similarity(clusters[i], clusters[i + 1])
+            if sim > best_sim:
+                best_sim = sim
+                best_i = i
+        if best_sim < similarity_threshold or best_i == -1:
+            break
+        clusters[best_i : best_i + 2] = [clusters[best_i] + clusters[best_i + 1]]
+    return [[chunks[idx] for idx in cluster] for cluster in clusters], clusters
+
+
+def drifting_embeddings(n, dim, seed):
+    """Random walk so that neighbouring chunks are similar and topics drift."""
+    rng = np.random.default_rng(seed)
+    steps = rng.normal(size=(n, dim))
+    jumps = rng.random(n) < 0.1
+    steps[jumps] *= 8
+    return np.cumsum(steps, axis=0).astype(np.float32)
+
+
+@pytest.fixture
+def chunker():
+    return NeibourSimilarityChunker(embedding_model_name="unused")
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("threshold", [0.3, 0.6, 0.85])
+def test_matches_dense_implementation(chunker, seed, threshold):
+    n = 120
+    chunks = [f"chunk {i}" for i in range(n)]
+    embeddings = drifting_embeddings(n, 16, seed)
+
+    expected = dense_chunk_by_similarity(chunker, chunks, embeddings, threshold)
+    actual = chunker.chunk_by_similarity(
+        chunks, similarity_threshold=threshold, embeddings=embeddings
+    )
+    assert actual == expected
+
+
+def test_small_inputs(chunker):
+    assert chunker.chunk_by_similarity([], embeddings=np.zeros((0, 4))) == ([], [])
+    assert chunker.chunk_by_similarity(["a"], embeddings=np.ones((1, 4))) == ([["a"]], [[0]])
+
+
+def test_clusters_cover_input_in_order(chunker):
+    n = 2000
+    chunks = [str(i) for i in range(n)]
+    _, clusters = chunker.chunk_by_similarity(
+        chunks, similarity_threshold=0.5, embeddings=drifting_embeddings(n, 32, 7)
+    )
+    assert [idx for cluster in clusters for idx in cluster] == list(range(n))
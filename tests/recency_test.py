@@ -0,0 +1,51 @@
+import csv
+
+import pytest
+
+from retrieval import structured_csv_retrieve
+from retrieval.structured_csv_retrieve import StructuredCSVIndexing, StructuredCSVRetrieval, parse_timestamp
+from tests.conftest import FakeEmbeddingModel
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("1:56 pm on 8 May, 2023", "2023-05-08T13:56:00Z"),
+    ("2023-05-08T15:56:00+02:00", "2023-05-08T13:56:00Z"),
+    ("time", None),
+    ("第1集", None),
+    (float("nan"), None),
+])
+def test_parse_timestamp(value, expected):
+    assert parse_timestamp(value) == expected
+
+
+@pytest.fixture
+def diary(tmp_path, memory_qdrant, monkeypatch):
+    monkeypatch.setattr(structured_csv_retrieve, "EmbeddingModelController", FakeEmbeddingModel)
+    path = str(tmp_path / "diary.csv")
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["source", "time", "talker", "text"])
+        writer.writerow(["D1:0", "9:00 am on 1 January, 2023", "MELANIE", "I painted a sunrise by the lake."])
+        writer.writerow(["D2:0", "9:00 am on 1 March, 2023", "MELANIE", "Went hiking with the kids, saw a sunrise."])
+        writer.writerow(["D3:0", "9:00 am on 1 June, 2023", "MELANIE", "I painted a sunrise by the lake!"])
+        writer.writerow(["D4:0", "", "MELANIE", "I painted a sunrise, no date."])
+    # D1:0 and D3:0 are near-duplicates: they are folded into one point.
+    indexer = StructuredCSVIndexing()
+    indexer.index(embedding_model_path="unused", file_path=path, collection_name="diary")
+    assert indexer.report["duplicates"] == 1
+
+
+@pytest.mark.parametrize("hybrid", [False, True])
+def test_recent_turns_outrank_stale_ones(diary, hybrid):
+    retriever = StructuredCSVRetrieval()
+    kwargs = dict(collection_name="diary", embedding_model_path="unused", query="painted a sunrise",
+                  top_k=3, hybrid=hybrid)
+
+    plain = retriever.retrieve(**kwargs)
+    recent = retriever.retrieve(**kwargs, recency_half_life_days=30, recency_weight=1.0,
+                                recency_now="2023-06-02T00:00:00Z")
+
+    # The folded line counts as recent as its repetition in June.
+    assert recent[0]["idx"] == "D3:0" and recent[0]["duplicates"] == ["D1:0"]
+    assert sorted(item["idx"] for item in recent) == sorted(item["idx"] for item in plain)
+    assert recent[-1]["idx"] in {"D2:0", "D4:0"}
@@ -0,0 +1,115 @@
+import csv
+
+import numpy as np
+import pytest
+
+from database.model_registry import ModelRegistry
+from database.qdrant_controller import QdrantController
+from model_management.embedding_model_controller import model_fingerprint
+from retrieval import reembed, structured_csv_retrieve
+from retrieval.reembed import ReembedJob
+from retrieval.structured_csv_retrieve import StructuredCSVIndexing
+from retrieval.style_index import StyleIndex
+from tests.conftest import FakeEmbeddingModel
+
+LINES = [("TONY", "I am Iron Man."), ("PEPPER", "Tony, the board meeting is at nine."),
+         ("TONY", "Iron Man suit, ready for flight."), ("PEPPER", "Please sign the board papers."),
+         ("TONY", "Where is my coffee?")]
+
+
+class RetrainedModel(FakeEmbeddingModel):
+    """A 'new version' of the fake model: different vectors, same dimension."""
+
+    def embed(self, text):
+        return -super().embed(text)
+
+
+@pytest.fixture
+def stale(tmp_path, memory_qdrant, monkeypatch):
+    monkeypatch.setattr(structured_csv_retrieve, "EmbeddingModelController", FakeEmbeddingModel)
+    monkeypatch.setattr(reembed, "EmbeddingModelController", RetrainedModel)
+    path = str(tmp_path / "ironman.csv")
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["source", "time", "talker", "text"])
+        for i, (talker, text) in enumerate(LINES):
+            writer.writerow([f"D1:{i}", "", talker, text])
+    model_dir = tmp_path / "model"
+    model_dir.mkdir()
+    (model_dir / "weights.bin").write_bytes(b"v1")
+    # Indexing tags the collection with the model it was embedded with.
+    StructuredCSVIndexing().index(embedding_model_path=str(model_dir), file_path=path, collection_name="ironman")
+    registry = ModelRegistry(QdrantController(memory_qdrant))
+    assert [r["collection"] for r in registry.records()] == ["ironman"]
+    assert not registry.status()[0]["stale"]
+    (model_dir / "weights.bin").write_bytes(b"v2 after retraining")
+    return registry
+
+
+def test_status_reports_stale_collections(stale):
+    [status] = stale.status()
+    assert status["collection"] == "ironman" and status["exists"]
+    assert status["stale"] and status["current_fingerprint"] != status["fingerprint"]
+
+
+def test_queries_warn_about_collections_indexed_before_a_retrain(stale, caplog):
+    import retrieve
+
+    model_path = stale.get("ironman")["model_path"]
+    with caplog.at_level("WARNING", logger="retrieve"):
+        retrieve.check_model("ironman", model_path)
+        retrieve.check_model("ironman", model_path)
+    assert len(caplog.records) == 2 and "another version of the model" in caplog.records[0].message
+    assert stale.get("ironman")["fingerprint"] != model_fingerprint(model_path)
+
+
+def test_reembed_rebuilds_vectors_from_payloads(stale):
+    qc = stale.qc
+    sparse_before = {p.id: p.vector["lexical"] for p in qc.client.scroll("ironman", limit=10, with_vectors=True)[0]}
+    style_before = qc.get_points("ironman_style", [StyleIndex.talker_id("TONY")], with_vectors=True)[0].vector
+
+    progress = ReembedJob("ironman", stale, batch_size=2, max_busy_fraction=1.0).run()
+    assert progress["status"] == "done" and progress["done"] == 5 and progress["skipped"] == 0
+
+    new_model = RetrainedModel()
+    for point in qc.client.scroll("ironman", limit=10, with_payload=True, with_vectors=True)[0]:
+        expected, actual = np.ravel(new_model.embed(point.payload["text"])), np.asarray(point.vector[""])
+        np.testing.assert_allclose(actual / np.linalg.norm(actual), expected / np.linalg.norm(expected), atol=1e-5)
+        assert point.vector["lexical"] == sparse_before[point.id]
+    style_after = qc.get_points("ironman_style", [StyleIndex.talker_id("TONY")], with_vectors=True)[0].vector
+    np.testing.assert_allclose(style_after, -np.asarray(style_before), atol=1e-5)
+
+    [status] = stale.status()
+    assert not status["stale"] and status["reembed"] is None
+    assert ReembedJob("ironman", stale).run() == {"status": "current"}
+
+
+def test_interrupted_reembed_resumes(stale, monkeypatch):
+    job = ReembedJob("ironman", stale, batch_size=2, max_busy_fraction=1.0)
+    monkeypatch.setattr(job, "_throttle", lambda *args: job._stop.set())
+    progress = job.run()
+    assert progress["status"] == "paused" and progress["done"] == 2
+    assert stale.get("ironman")["reembed"]["done"] == 2
+
+    progress = ReembedJob("ironman", stale, batch_size=2, max_busy_fraction=1.0).run()
+    assert progress["status"] == "done" and progress["done"] == 5
+
+
+def test_dimension_change_needs_reindexing(stale, monkeypatch):
+    monkeypatch.setattr(reembed, "EmbeddingModelController", lambda model_name: FakeEmbeddingModel(dim=8))
+    progress = ReembedJob("ironman", stale, max_busy_fraction=1.0).run()
+    assert progress["status"].startswith("dimension_mismatch")
+    assert stale.status()[0]["stale"]
+
+
+def test_api_reports_and_starts_reembedding(stale):
+    from fastapi.testclient import TestClient
+    import api
+
+    with TestClient(api.app) as client:
+        assert client.get("/collections/status").json()["result"][0]["stale"]
+        assert client.post("/collections/missing/reembed").status_code == 404
+        response = client.post("/collections/ironman/reembed").json()
+        assert response["started"]
+        api._reembed["worker"]._thread.join(timeout=30)
+        assert not client.get("/collections/status").json()["result"][0]["stale"]
@@ -0,0 +1,89 @@
+import csv
+from types import SimpleNamespace
+
+import pytest
+
+from tests.conftest import FakeEmbeddingModel
+from model_management import reranker_model_controller
+from model_management.reranker_model_controller import RerankerModelController
+from retrieval import structured_csv_retrieve
+from retrieval.structured_csv_retrieve import StructuredCSVIndexing, StructuredCSVRetrieval
+
+
+class FakeCrossEncoder:
+    """
+    Scores a pair by how many query words the passage contains, taking
+    `delay` seconds per pair on a fake clock (`now`).
+    """
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.pairs_scored = 0
+        self.now = 0.0
+
+    def predict(self, pairs, batch_size=32, show_progress_bar=False):
+        self.now += self.delay * len(pairs)
+        self.pairs_scored += len(pairs)
+        return [sum(w in p.lower() for w in q.lower().split()) for q, p in pairs]
+
+
+@pytest.fixture
+def cross_encoder(monkeypatch):
+    model = FakeCrossEncoder()
+    monkeypatch.setattr(reranker_model_controller, "load_cross_encoder", lambda name: model)
+    monkeypatch.setattr(reranker_model_controller, "_SCORE_CACHE", reranker_model_controller._ScoreCache(1000))
+    monkeypatch.setattr(reranker_model_controller, "_SECONDS_PER_PAIR", {})
+    monkeypatch.setattr(reranker_model_controller, "time", SimpleNamespace(perf_counter=lambda: model.now))
+    return model
+
+
+def test_rerank_orders_by_score_and_caches(cross_encoder):
+    reranker = RerankerModelController("fake", batch_size=2)
+    passages = ["nothing here", "iron suit", "iron man suit", "suit"]
+    assert reranker.rerank("iron suit", passages, top_k=2) == [(1, 2.0), (2, 2.0)]
+    assert cross_encoder.pairs_scored == 4
+
+    reranker.rerank("iron suit", passages + ["new iron"], top_k=2)
+    assert cross_encoder.pairs_scored == 5
+
+
+def test_budget_truncates_candidates(cross_encoder):
+    cross_encoder.delay = 0.005
+    reranker = RerankerModelController("fake", batch_size=4)
+    passages = [f"passage {i}" for i in range(40)]
+    scores = reranker.score("passage", passages, budget_ms=60)
+    # Batches take 20ms: the first is scored to learn that, then two more fit.
+    assert [s is not None for s in scores] == [True] * 12 + [False] * 28
+
+
+def test_throughput_estimate_outlives_the_controller(cross_encoder):
+    cross_encoder.delay = 0.005
+    RerankerModelController("fake", batch_size=4).score("warm up", ["a", "b", "c", "d"])
+    # Retrievers build a controller per request: the next one already knows
+    # a batch takes 20ms and does not blow a 10ms budget on a first batch.
+    scores = RerankerModelController("fake", batch_size=4).score("passage", ["e", "f", "g", "h"], budget_ms=10)
+    assert scores == [None] * 4 and cross_encoder.pairs_scored == 4
+
+
+def test_retriever_reranks_a_larger_candidate_set(tmp_path, memory_qdrant, monkeypatch, cross_encoder):
+    monkeypatch.setattr(structured_csv_retrieve, "EmbeddingModelController", FakeEmbeddingModel)
+    path = str(tmp_path / "dialogue.csv")
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["source", "time", "talker", "text"])
+        for i in range(30):
+            writer.writerow([f"D1:{i}", "", "TONY", f"line {i} about the suit"])
+        writer.writerow(["D1:30", "", "PEPPER", "where is the arc reactor"])
+
+    StructuredCSVIndexing().index(embedding_model_path="unused", file_path=path, collection_name="rr")
+    result = StructuredCSVRetrieval().retrieve(
+        collection_name="rr",
+        embedding_model_path="unused",
+        query="arc reactor",
+        top_k=20,
+        rerank_k=31,
+        final_k=3,
+        reranker_model="fake",
+    )
+    assert len(result) == 3
+    assert result[0]["idx"] == "D1:30"
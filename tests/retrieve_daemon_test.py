@@ -0,0 +1,123 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import pytest
+
+from retrieval import structured_csv_retrieve
+from retrieve import qdrant_retrieve_mode
+import retrieve_daemon
+from retrieve_daemon import DaemonError, RetrieveDaemon, ping, request, runtime_dir
+from tests.conftest import FakeEmbeddingModel
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+
+@pytest.fixture
+def socket_path():
+    # Unix socket paths are limited to ~100 bytes: pytest's tmp_path can be too long.
+    directory = tempfile.mkdtemp(prefix="rd-")
+    yield os.path.join(directory, "d.sock")
+    shutil.rmtree(directory)
+
+
+def write_dialogue(path, n=40):
+    path.write_text("source,time,talker,text\n" + "".join(
+        f"D1:{i},,TONY,line {i} about the {'suit' if i % 4 else 'coffee'}\n" for i in range(n)
+    ), encoding="utf-8")
+    return str(path)
+
+
+def exited(pid):
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().rsplit(")", 1)[1].split()[0] == "Z"  # a zombie has exited
+    except FileNotFoundError:
+        return True
+
+
+def start(daemon):
+    thread = threading.Thread(target=daemon.serve_forever, daemon=True)
+    thread.start()
+    assert daemon.ready.wait(5)
+    return thread
+
+
+def test_daemon_serves_retrieve_modes(tmp_path, socket_path, memory_qdrant, monkeypatch):
+    monkeypatch.setattr(structured_csv_retrieve, "EmbeddingModelController", FakeEmbeddingModel)
+    kwargs = dict(embedding_model_path="unused", file_path=write_dialogue(tmp_path / "talk.csv"),
+                  query="the coffee", collection_name="talk", mode="naive_csv", top_k=3)
+    daemon = RetrieveDaemon(socket_path, idle_seconds=60)
+    thread = start(daemon)
+    try:
+        result, profile_path = request("qdrant", kwargs, socket_path=socket_path, autostart=False)
+        assert result == qdrant_retrieve_mode(**kwargs) and profile_path is None
+        assert RetrieveDaemon(socket_path).serve_forever() is False  # the socket is taken
+        with pytest.raises(DaemonError) as error:
+            request("qdrant", {**kwargs, "mode": "bogus"}, socket_path=socket_path, autostart=False)
+        assert error.value.type == "ValueError" and "bogus" in str(error.value)
+        with pytest.raises(DaemonError, match="Unknown op"):
+            request("rm", socket_path=socket_path, autostart=False)
+        status = ping(socket_path)
+        assert status["pid"] == os.getpid() and status["requests"] == 4
+    finally:
+        daemon.shutdown()
+        thread.join(5)
+    assert not os.path.exists(socket_path) and ping(socket_path) is None
+    with pytest.raises(FileNotFoundError):
+        request("qdrant", kwargs, socket_path=socket_path, autostart=False)
+
+
+def test_daemon_exits_when_idle(socket_path):
+    daemon = RetrieveDaemon(socket_path, idle_seconds=0.3)
+    thread = start(daemon)
+    assert ping(socket_path) is not None
+    thread.join(5)
+    assert not thread.is_alive() and not os.path.exists(socket_path)
+
+
+def test_runtime_dir_is_private(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_RUNTIME_DIR", str(tmp_path))
+    assert runtime_dir() == str(tmp_path)
+    monkeypatch.delenv("XDG_RUNTIME_DIR")
+    monkeypatch.setattr(retrieve_daemon.tempfile, "gettempdir", lambda: str(tmp_path))
+    directory = runtime_dir()
+    assert os.path.dirname(directory) == str(tmp_path) and os.stat(directory).st_mode & 0o777 == 0o700
+    # A directory others can write to (e.g. planted by another user) is refused.
+    os.chmod(directory, 0o777)
+    with pytest.raises(PermissionError):
+        runtime_dir()
+
+
+def test_lock_file_is_not_truncated(socket_path):
+    with open(socket_path + ".lock", "w") as f:
+        f.write("not ours")
+    daemon = RetrieveDaemon(socket_path, idle_seconds=0.3)
+    start(daemon).join(5)
+    assert open(socket_path + ".lock").read() == "not ours"
+
+
+def test_cli_spawns_and_reuses_a_warm_daemon(tmp_path, socket_path, tiny_model_path):
+    env = {**os.environ, "RETRIEVE_DAEMON_SOCKET": socket_path, "RETRIEVE_DAEMON_IDLE_SECONDS": "3"}
+    env.pop("RETRIEVE_NO_DAEMON", None)
+    command = [sys.executable, os.path.join(ROOT, "src", "retrieve.py"), "--model_output_path", tiny_model_path,
+               "--file_path", write_dialogue(tmp_path / "talk.csv"), "--query", "the coffee", "--top_k", "2"]
+
+    def run(*extra):
+        done = subprocess.run(command + list(extra), env=env, capture_output=True, text=True, timeout=120)
+        assert done.returncode == 0, done.stderr
+        return done.stdout
+
+    direct = run("--no_daemon")
+    assert ping(socket_path) is None
+    assert run() == direct
+    pid = ping(socket_path)["pid"]
+    assert run() == direct and ping(socket_path)["pid"] == pid
+    deadline = time.monotonic() + 15
+    while not exited(pid) and time.monotonic() < deadline:
+        time.sleep(0.2)
+    assert exited(pid) and not os.path.exists(socket_path)
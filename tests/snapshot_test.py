@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+from qdrant_client import QdrantClient
+
+from database.model_registry import ModelRegistry
+from database.qdrant_controller import QdrantController
+from database.snapshot import export_collection, import_snapshot
+from model_management.embedding_model_controller import model_fingerprint
+from model_management.sparse_model_controller import SparseModelController
+
+
+@pytest.fixture
+def source():
+    qc = QdrantController(QdrantClient(":memory:"))
+    qc.create_collection("persona", vector_size=4, sparse=True)
+    texts = [f"memory number {i}" for i in range(25)]
+    sparse = SparseModelController().embed_documents(texts)
+    rng = np.random.default_rng(0)
+    qc.upsert_points("persona", [
+        qc.make_point(i, rng.normal(size=4).tolist(), {"text": text, "row": i}, sparse_vector=sparse[i])
+        for i, text in enumerate(texts)
+    ])
+    return qc
+
+
+def dump(qc, name):
+    points, _ = qc.client.scroll(name, limit=100, with_payload=True, with_vectors=True)
+    return {p.id: (p.payload, p.vector) for p in points}
+
+
+def test_round_trip_without_inference(source, tmp_path):
+    manifest = export_collection(source, "persona", str(tmp_path), model_fingerprint="sha256:abc", batch_size=7)
+    assert manifest["count"] == 25 and manifest["dim"] == 4 and manifest["sparse"]
+    assert np.load(tmp_path / "vectors.npy", mmap_mode="r").shape == (25, 4)
+
+    target = QdrantController(QdrantClient(":memory:"))
+    import_snapshot(target, str(tmp_path), model_fingerprint="sha256:abc", batch_size=6, model_path="models/persona")
+    record = ModelRegistry(target).get("persona")
+    assert record["fingerprint"] == "sha256:abc" and record["model_path"] == "models/persona"
+
+    before, after = dump(source, "persona"), dump(target, "persona")
+    assert before.keys() == after.keys()
+    for point_id, (payload, vector) in before.items():
+        assert after[point_id][0] == payload
+        np.testing.assert_allclose(after[point_id][1][""], vector[""], rtol=1e-6)
+        assert after[point_id][1]["lexical"].indices == vector["lexical"].indices
+
+
+def test_import_refuses_another_model(source, tmp_path):
+    export_collection(source, "persona", str(tmp_path), model_fingerprint="sha256:abc")
+    target = QdrantController(QdrantClient(":memory:"))
+    with pytest.raises(ValueError, match="embedded with model"):
+        import_snapshot(target, str(tmp_path), model_fingerprint="sha256:other")
+    assert not target.collection_exists("persona")
+
+
+def test_model_fingerprint_follows_the_weights(tmp_path):
+    (tmp_path / "config.json").write_text("{}")
+    (tmp_path / "model.safetensors").write_bytes(b"weights")
+    first = model_fingerprint(str(tmp_path))
+    assert first == model_fingerprint(str(tmp_path))
+    (tmp_path / "model.safetensors").write_bytes(b"retrained")
+    assert model_fingerprint(str(tmp_path)) != first
+    assert model_fingerprint("BAAI/bge-m3") == "hub:BAAI/bge-m3"
@@ -0,0 +1,64 @@
+import csv
+
+import numpy as np
+import pytest
+
+from database.qdrant_controller import QdrantController
+from retrieval import structured_csv_retrieve
+from retrieval.structured_csv_retrieve import StructuredCSVIndexing
+from retrieval.style_index import StyleIndex
+from tests.conftest import FakeEmbeddingModel
+
+LINES = [
+    ("TONY", "I am Iron Man."),
+    ("PEPPER", "Tony, the board meeting is at nine."),
+    ("TONY", "Iron Man suit, ready for flight."),
+    ("PEPPER", "Please sign the board papers."),
+    ("TONY", "Jarvis, the Iron Man suit again."),
+    ("TONY", "Where is my coffee?"),
+]
+
+
+@pytest.fixture
+def indexed(tmp_path, memory_qdrant, monkeypatch):
+    monkeypatch.setattr(structured_csv_retrieve, "EmbeddingModelController", FakeEmbeddingModel)
+    path = str(tmp_path / "ironman.csv")
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["source", "time", "talker", "text"])
+        for i, (talker, text) in enumerate(LINES):
+            writer.writerow([f"D1:{i}", "", talker, text])
+    StructuredCSVIndexing().index(embedding_model_path="unused", file_path=path, collection_name="ironman")
+    return QdrantController(memory_qdrant)
+
+
+def test_style_profile_is_a_point_lookup(indexed):
+    profile = StyleIndex(indexed).get("ironman", "TONY", top_n=2)
+    assert profile["count"] == 4
+    assert len(profile["representatives"]) == 2
+    assert all(r["source"] in {"D1:0", "D1:2", "D1:4", "D1:5"} for r in profile["representatives"])
+    assert "embedding" not in profile["representatives"][0]
+    assert StyleIndex(indexed).get("ironman", "HAPPY") is None
+    assert StyleIndex(indexed).get("missing", "TONY") is None
+
+
+def test_incremental_updates_match_a_rebuild(indexed):
+    index = StyleIndex(indexed)
+    incremental = indexed.get_points("ironman_style", [StyleIndex.talker_id("TONY")], with_vectors=True)[0]
+    index.rebuild("ironman", batch_size=2)
+    rebuilt = indexed.get_points("ironman_style", [StyleIndex.talker_id("TONY")], with_vectors=True)[0]
+
+    np.testing.assert_allclose(incremental.vector, rebuilt.vector, atol=1e-5)
+    assert rebuilt.payload["count"] == 4
+    assert [r["source"] for r in incremental.payload["pool"]] == [r["source"] for r in rebuilt.payload["pool"]]
+
+
+def test_style_endpoint(indexed):
+    from fastapi.testclient import TestClient
+    from api import app
+
+    client = TestClient(app)
+    response = client.get("/style/PEPPER", params={"collection_name": "ironman", "top_n": 1})
+    assert response.status_code == 200
+    assert response.json()["result"]["count"] == 2
+    assert client.get("/style/HAPPY", params={"collection_name": "ironman"}).status_code == 404
@@ -0,0 +1,83 @@
+import csv
+
+import pytest
+
+from database.model_registry import ModelRegistry
+from database.qdrant_controller import QdrantController, TENANT_FIELD
+from database.tenant_migration import migrate_collection
+from retrieval import structured_csv_retrieve
+from retrieval.structured_csv_retrieve import StructuredCSVIndexing, StructuredCSVRetrieval
+from tests.conftest import FakeEmbeddingModel
+
+
+def write_dialogue(path, episode, lines):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["source", "time", "talker", "text"])
+        for i, text in enumerate(lines):
+            writer.writerow([f"{episode}:{i}", "", "TONY", text])
+
+
+@pytest.fixture
+def shared(tmp_path, memory_qdrant, monkeypatch):
+    monkeypatch.setattr(structured_csv_retrieve, "EmbeddingModelController", FakeEmbeddingModel)
+    lines = [f"Small talk number {i} about the suit." for i in range(12)]
+    for episode in ("E1", "E2"):
+        path = str(tmp_path / f"{episode}.csv")
+        write_dialogue(path, episode, lines)
+        StructuredCSVIndexing().index(
+            embedding_model_path="unused", file_path=path, collection_name="shared", tenant=episode
+        )
+    return QdrantController(memory_qdrant)
+
+
+@pytest.mark.parametrize("hybrid", [False, True])
+def test_search_never_crosses_tenants(shared, hybrid):
+    for tenant in ("E1", "E2"):
+        result = StructuredCSVRetrieval().retrieve(
+            collection_name="shared", embedding_model_path="unused", query="the suit",
+            top_k=30, hybrid=hybrid, tenant=tenant,
+        )
+        assert len(result) == 12
+        assert all(item["idx"].startswith(f"{tenant}:") for item in result)
+
+
+def test_context_expansion_stays_in_tenant(shared):
+    result = StructuredCSVRetrieval().retrieve(
+        collection_name="shared", embedding_model_path="unused", query="Small talk number 5",
+        top_k=1, tenant="E2", context_window=1,
+    )
+    assert len(result[0]["idx"]) == 3
+    assert all(source.startswith("E2:") for source in result[0]["idx"])
+
+
+def test_delete_tenant_keeps_the_others(shared):
+    StructuredCSVIndexing().delete(collection_name="shared", tenant="E1")
+    assert not shared.tenant_exists("shared", "E1")
+    assert shared.tenant_exists("shared", "E2")
+    assert shared.client.count("shared").count == 12
+
+
+def test_migration_moves_collection_into_tenant(memory_qdrant):
+    qc = QdrantController(memory_qdrant)
+    qc.create_collection("episode_1", vector_size=2)
+    qc.upsert_points("episode_1", [
+        qc.make_point(i, [1.0, float(i)], {"text": f"line {i}", "source": f"E1:{i}"}) for i in range(10)
+    ])
+    registry = ModelRegistry(qc)
+    registry.tag("episode_1", "trained_model/model", fingerprint="sha256:abc")
+
+    assert migrate_collection(qc, "episode_1", "shared", batch_size=3, delete_source=True) == 10
+    assert not qc.collection_exists("episode_1")
+    assert registry.get("shared")["fingerprint"] == "sha256:abc" and registry.get("episode_1") is None
+    points = qc.get_points("shared", [qc.make_point_id(4, "episode_1")])
+    assert points[0].payload == {"text": "line 4", "source": "E1:4", "row": 4, TENANT_FIELD: "episode_1"}
+
+
+def test_migration_refuses_another_model(memory_qdrant):
+    qc = QdrantController(memory_qdrant)
+    for name, fingerprint in (("episode_1", "sha256:abc"), ("shared", "sha256:other")):
+        qc.create_collection(name, vector_size=2)
+        ModelRegistry(qc).tag(name, "trained_model/model", fingerprint=fingerprint)
+    with pytest.raises(ValueError, match="embedded with model"):
+        migrate_collection(qc, "episode_1", "shared")
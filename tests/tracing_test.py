@@ -0,0 +1,117 @@
+import logging
+import os
+import pstats
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import tracing
+from retrieval import structured_csv_retrieve
+from tests.conftest import FakeEmbeddingModel
+from tracing import current_trace, propagate, span, trace
+
+
+def busy(ms):
+    end = time.perf_counter() + ms / 1000
+    while time.perf_counter() < end:
+        pass
+
+
+@span("decorated")
+def decorated():
+    busy(5)
+
+
+def test_spans_record_a_breakdown_per_path():
+    with span("outside"):
+        assert current_trace() is None
+    with trace("request", slow_ms=10_000) as t:
+        with span("index"):
+            with span("embed"):
+                busy(2)
+        for _ in range(3):
+            decorated()
+    breakdown = {entry["span"]: entry for entry in t.breakdown()}
+    assert list(breakdown) == ["index/embed", "index", "decorated"]
+    assert breakdown["decorated"]["count"] == 3 and breakdown["decorated"]["ms"] >= 15
+    assert breakdown["index"]["ms"] >= breakdown["index/embed"]["ms"] >= 2
+    assert t.duration_ms >= 17 and t.profile_path is None
+    assert "index.embed;dur=" in t.server_timing()
+
+
+def test_slow_requests_are_logged_with_their_spans(caplog):
+    with caplog.at_level(logging.WARNING, logger="tracing"):
+        with trace("fast", slow_ms=1000):
+            decorated()
+        with trace("slow", slow_ms=1):
+            decorated()
+    [record] = caplog.records
+    assert "slow request slow" in record.message and "decorated:" in record.message
+
+
+def test_spans_follow_propagated_work_onto_threads():
+    with ThreadPoolExecutor(2) as pool, trace("fanout", slow_ms=10_000) as t:
+        with span("search"):
+            futures = [pool.submit(propagate(decorated)) for _ in range(4)]
+            [f.result() for f in futures]
+        pool.submit(decorated).result()  # not propagated: not part of the trace
+    assert {entry["span"]: entry["count"] for entry in t.breakdown()} == {"search/decorated": 4, "search": 1}
+
+
+@pytest.mark.parametrize("mode, suffix", [("cprofile", ".prof"), ("sample", ".folded")])
+def test_profiles_are_saved_for_flamegraphs(tmp_path, mode, suffix):
+    with trace("profiled", slow_ms=10_000, profile=mode, profile_dir=str(tmp_path)) as t:
+        decorated()
+        busy(50)
+    assert t.profile_path.endswith(suffix) and os.path.dirname(t.profile_path) == str(tmp_path)
+    if mode == "cprofile":
+        functions = {name for _, _, name in pstats.Stats(t.profile_path).stats}
+        assert "busy" in functions
+    else:
+        lines = open(t.profile_path, encoding="utf-8").read().splitlines()
+        assert any("busy (tracing_test.py" in line for line in lines)
+        assert all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+    with pytest.raises(ValueError):
+        trace("bad", profile="perf").__enter__()
+
+
+def test_api_returns_server_timing_and_profiles(tmp_path, memory_qdrant, monkeypatch):
+    from fastapi.testclient import TestClient
+    import api
+
+    monkeypatch.setattr(structured_csv_retrieve, "EmbeddingModelController", FakeEmbeddingModel)
+    monkeypatch.setattr(tracing, "PROFILE_DIR", str(tmp_path / "profiles"))
+    monkeypatch.setattr(api, "PROFILE_ENABLED", True)
+    path = tmp_path / "traced.csv"
+    path.write_text("source,time,talker,text\n" + "".join(
+        f"D1:{i},,TONY,line {i} about the suit\n" for i in range(50)
+    ), encoding="utf-8")
+    body = {"model_output_path": "unused", "file_path": str(path), "query": "the suit", "top_k": 3}
+
+    with TestClient(api.app) as client:
+        cold = client.post("/retrieve/qdrant", json=body, headers={"X-Profile": "cprofile"})
+        warm = client.post("/retrieve/qdrant", json=body)
+        bad = client.post("/retrieve/qdrant", json=body, headers={"X-Profile": "perf"})
+    assert cold.status_code == warm.status_code == 200 and bad.status_code == 400
+    assert "qdrant_retrieve_mode.index.read_and_embed.embed;dur=" in cold.headers["server-timing"]
+    assert "read_and_embed" not in warm.headers["server-timing"]
+    assert "qdrant_retrieve_mode.retrieve.search;dur=" in warm.headers["server-timing"]
+    assert os.path.exists(cold.headers["x-profile-path"]) and "x-profile-path" not in warm.headers
+    assert cold.headers["x-trace-id"] != warm.headers["x-trace-id"]
+
+    monkeypatch.setattr(api, "PROFILE_ENABLED", False)
+    with TestClient(api.app) as client:
+        refused = client.post("/retrieve/qdrant", json=body, headers={"X-Profile": "sample"})
+    assert refused.status_code == 403 and len(os.listdir(tmp_path / "profiles")) == 1
+
+
+def test_only_the_newest_profiles_are_kept(tmp_path, monkeypatch):
+    monkeypatch.setattr(tracing, "PROFILE_KEEP", 2)
+    paths = []
+    for _ in range(4):
+        with trace("profiled", slow_ms=10_000, profile="cprofile", profile_dir=str(tmp_path)) as t:
+            busy(2)
+        paths.append(t.profile_path)
+        time.sleep(0.01)
+    assert sorted(os.listdir(tmp_path)) == sorted(os.path.basename(p) for p in paths[2:])
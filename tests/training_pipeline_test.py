@@ -0,0 +1,182 @@
+import json
+import os
+
+import numpy as np
+import pytest
+import torch
+from sentence_transformers import InputExample, SentenceTransformer, losses
+
+from tests.conftest import TINY_WORDS as WORDS
+from training.data_pipeline import LengthBucketBatchSampler, fit_pretokenized, pretokenize
+
+
+@pytest.fixture(scope="module")
+def tiny_model(tiny_model_path):
+    return SentenceTransformer(tiny_model_path, device="cpu")
+
+
+def examples(n=40, seed=0):
+    rng = np.random.default_rng(seed)
+    texts = [" ".join(rng.choice(WORDS, size=rng.integers(1, 30))) for _ in range(n)]
+    return [InputExample(texts=[t, t]) for t in texts]
+
+
+def test_sampler_covers_every_index_in_shuffled_length_buckets():
+    rng = np.random.default_rng(1)
+    lengths = rng.integers(1, 200, size=1000)
+    sampler = LengthBucketBatchSampler(lengths, batch_size=16, pool_batches=10)
+
+    first = list(sampler)
+    assert len(first) == len(sampler)
+    assert sorted(i for batch in first for i in batch) == list(range(1000))
+    spread = np.mean([np.ptp(lengths[batch]) for batch in first])
+    assert spread < np.ptp(lengths) / 4
+    # Not in length order, and a different order the next epoch.
+    assert [lengths[b].min() for b in first] != sorted(lengths[b].min() for b in first)
+    assert list(sampler) != first
+
+
+def test_pretokenize_is_cached(tiny_model, tmp_path):
+    data = examples()
+    dataset = pretokenize(tiny_model, data, cache_dir=str(tmp_path))
+    assert len(dataset) == len(data)
+    assert dataset.column_names == ["input_ids_0", "input_ids_1", "length"]
+    expected = tiny_model.tokenizer(data[0].texts[0])["input_ids"]
+    assert dataset[0]["input_ids_0"] == expected
+    assert dataset[0]["length"] == len(expected)
+
+    cached = pretokenize(tiny_model, data, cache_dir=str(tmp_path))
+    assert cached.cache_files == dataset.cache_files
+    assert len(list(tmp_path.iterdir())) == 1
+
+
+def test_fit_pretokenized_trains(tiny_model, tmp_path):
+    dataset = pretokenize(tiny_model, examples())
+    before = [p.detach().clone() for p in tiny_model.parameters()]
+    stats = fit_pretokenized(
+        tiny_model, losses.MultipleNegativesRankingLoss(tiny_model), dataset, batch_size=8, epochs=2,
+        checkpoint_path=str(tmp_path / "checkpoints"), checkpoint_save_steps=3, checkpoint_save_total_limit=2,
+    )
+    assert stats["examples"] == 80
+    assert stats["examples_per_second"] > 0
+    assert 0 < stats["padding_efficiency"] <= 1
+    assert any(not p.equal(b) for p, b in zip(tiny_model.parameters(), before))
+    assert sorted(c.name for c in (tmp_path / "checkpoints").iterdir()) == ["10", "9"]
+
+
+def test_cached_loss_matches_full_batch_gradients(tiny_model):
+    from training.data_pipeline import PretokenizedCollator
+
+    dataset = pretokenize(tiny_model, examples(n=12))
+    features, labels = PretokenizedCollator(tiny_model.tokenizer, 2)([dataset[i] for i in range(12)])
+    grads = []
+    for loss in (losses.MultipleNegativesRankingLoss(tiny_model),
+                 losses.CachedMultipleNegativesRankingLoss(tiny_model, mini_batch_size=4)):
+        tiny_model.zero_grad()
+        loss.eval()  # no dropout, so both see the same embeddings
+        loss(features, labels).backward()
+        grads.append([p.grad.clone() for p in tiny_model.parameters() if p.grad is not None])
+    assert len(grads[0]) == len(grads[1])
+    for full, cached in zip(*grads):
+        assert torch.allclose(full, cached, atol=1e-5)
+
+
+def test_cl_training_with_mini_batches(tiny_model_path, tmp_path):
+    from training.cl_training import CLTraining
+
+    trainer = CLTraining(tiny_model_path, cache_dir=str(tmp_path / "cache"), mini_batch_size=4,
+                         checkpoint_path=str(tmp_path / "checkpoints"))
+    assert isinstance(trainer._multiple_negatives_loss(), losses.CachedMultipleNegativesRankingLoss)
+    stats = trainer.train_simcse(examples(), batch_size=20, epochs=1, warmup_steps=0)
+    assert stats["examples"] == 40
+    assert stats["peak_rss_mb"] > 0
+
+
+class Crash(Exception):
+    pass
+
+
+class CrashingLoss(torch.nn.Module):
+    """Wraps a loss and raises on its `crash_at`-th call, like a killed run."""
+
+    def __init__(self, loss, crash_at):
+        super().__init__()
+        self.loss = loss
+        self.calls = 0
+        self.crash_at = crash_at
+
+    def forward(self, features, labels):
+        self.calls += 1
+        if self.calls == self.crash_at:
+            raise Crash()
+        return self.loss(features, labels)
+
+
+def test_resume_continues_where_the_crashed_run_stopped(tiny_model_path, tmp_path):
+    dataset = pretokenize(SentenceTransformer(tiny_model_path, device="cpu"), examples())
+    kwargs = dict(batch_size=8, epochs=2, checkpoint_save_steps=3)
+
+    torch.manual_seed(0)
+    reference = SentenceTransformer(tiny_model_path, device="cpu")
+    fit_pretokenized(reference, losses.MultipleNegativesRankingLoss(reference), dataset, **kwargs)
+
+    torch.manual_seed(0)
+    model = SentenceTransformer(tiny_model_path, device="cpu")
+    telemetry = str(tmp_path / "telemetry.jsonl")
+    with pytest.raises(Crash):
+        fit_pretokenized(model, CrashingLoss(losses.MultipleNegativesRankingLoss(model), crash_at=8), dataset,
+                         checkpoint_path=str(tmp_path / "ckpt"), telemetry_path=telemetry, log_steps=1, **kwargs)
+    model = SentenceTransformer(tiny_model_path, device="cpu")
+    stats = fit_pretokenized(model, losses.MultipleNegativesRankingLoss(model), dataset,
+                             checkpoint_path=str(tmp_path / "ckpt"), telemetry_path=telemetry, log_steps=1,
+                             resume=True, **kwargs)
+
+    assert stats["resumed_from"] == str(tmp_path / "ckpt" / "6")
+    assert stats["steps"] == 10 and stats["examples"] == 32
+    for p, q in zip(model.parameters(), reference.parameters()):
+        assert p.equal(q)
+    with open(telemetry) as f:
+        records = [json.loads(line) for line in f]
+    assert [r["step"] for r in records] == [1, 2, 3, 4, 5, 6, 7, 7, 8, 9, 10]
+    assert {"loss", "lr", "examples_per_second", "tokens_per_second", "peak_rss_mb"} <= set(records[-1])
+
+
+def test_finished_run_is_not_resumed(tiny_model_path, tmp_path):
+    dataset = pretokenize(SentenceTransformer(tiny_model_path, device="cpu"), examples())
+    kwargs = dict(batch_size=8, epochs=1, checkpoint_save_steps=2, checkpoint_path=str(tmp_path / "ckpt"), resume=True)
+    model = SentenceTransformer(tiny_model_path, device="cpu")
+    assert fit_pretokenized(model, losses.MultipleNegativesRankingLoss(model), dataset, **kwargs)["steps"] == 5
+    (tmp_path / "ckpt" / "5" / "first_run").touch()
+
+    model = SentenceTransformer(tiny_model_path, device="cpu")
+    stats = fit_pretokenized(model, losses.MultipleNegativesRankingLoss(model), dataset, **kwargs)
+    assert stats["resumed_from"] is None and stats["steps"] == 5 and stats["examples"] == 40
+    assert sorted(os.listdir(tmp_path / "ckpt")) == ["2", "4", "5"]
+    assert not (tmp_path / "ckpt" / "5" / "first_run").exists()
+
+
+def test_early_stopping_restores_the_best_weights(tiny_model):
+    from training.telemetry import EarlyStopping
+
+    scores = iter([0.5, 0.7, 0.6, 0.6, 0.9])
+    snapshots = []
+
+    def evaluator(model):
+        snapshots.append([p.detach().clone() for p in model.parameters()])
+        return next(scores)
+
+    early_stopping = EarlyStopping(evaluator, eval_steps=2, patience=2)
+    stats = fit_pretokenized(tiny_model, losses.MultipleNegativesRankingLoss(tiny_model),
+                             pretokenize(tiny_model, examples()), batch_size=8, epochs=4,
+                             early_stopping=early_stopping)
+    assert stats["stopped_early"] and stats["steps"] == 8 and stats["best_score"] == 0.7
+    for p, best in zip(tiny_model.parameters(), snapshots[1]):
+        assert p.equal(best)
+
+
+def test_retrieval_evaluator_on_next_turns(tiny_model):
+    from training.telemetry import RetrievalEvaluator
+
+    evaluator = RetrievalEvaluator.next_turns(["tony", "pepper", "suit", "lab"], [0, 0, 1, 1], k=4)
+    assert evaluator.targets == ["pepper", "tony", "lab", "suit"]
+    assert evaluator(tiny_model) == 1.0